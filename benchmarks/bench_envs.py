@@ -0,0 +1,300 @@
+"""
+Benchmark of the environment step throughput. It instantiates every environment class defined in
+continuous_measurement/sac_tri_envs_con.py, discrete_measurement/sac_tri_envs_dis.py and
+projective_measurement/src/sac_tri_envs.py, drives each of them with a fixed-seed random sequence of
+actions, and writes the results to a JSON file, so that speedups and regressions from env rewrites
+can be tracked over time.
+
+For each environment it reports:
+    - the number of steps per second
+    - the latency percentiles of env.step(), separately for each discrete action d_act (0,1,2)
+    - the memory allocated by python during the steps (measured with tracemalloc in a separate pass)
+
+Usage (from the main directory of the repository):
+    python benchmarks/bench_envs.py --steps 5000 --d-act-probs 0.4,0.3,0.3 --output results.json
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import subprocess
+import traceback
+from datetime import datetime
+
+import numpy as np
+
+#location of the main directory of the repository
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+#each entry is (folder containing the env module, env module name, script from which env_params are loaded)
+ENV_MODULES = [
+    (os.path.join(REPO_DIR, "continuous_measurement"), "sac_tri_envs_con",
+        os.path.join(REPO_DIR, "continuous_measurement", "train_agent.py")),
+    (os.path.join(REPO_DIR, "discrete_measurement"), "sac_tri_envs_dis",
+        os.path.join(REPO_DIR, "discrete_measurement", "train_agent.py")),
+    (os.path.join(REPO_DIR, "projective_measurement", "src"), "sac_tri_envs", None),
+]
+
+#the projective_measurement folder has no train_agent.py. These are the env_params used in the
+#jupyter/*_training.ipynb notebooks
+PROJECTIVE_ENV_PARAMS = {
+    "TwoLevelBosonicFeedbackDemonPowDiss": {
+        "g": 1.,
+        "b": 1.,
+        "min_u": -0.8,
+        "max_u": 0.8,
+        "e0": 5.,
+        "dt": 0.07,
+        "a": 0.7,
+        "pow_coeff": 1.,
+        "diss_coeff": 1.,
+    },
+    "TwoQubitResonantFeedbackDemonPowDiss": {
+        "e0": 5.,
+        "g": 1.,
+        "b": 1.,
+        "gamma": 1.,
+        "min_u": -0.8,
+        "max_u": 0.8,
+        "dt": 0.15,
+        "a": 1.,
+        "pow_coeff": 1.,
+        "diss_coeff": 1.,
+        "counter_rot": False,
+        "mesolver_nsteps": 30000,
+    },
+}
+
+#parameters that some environments require, but that are not in the train_agent.py scripts.
+#In TwoLevelDemonDisPowDisse0 the action u is the qubit gap, so it must be bounded away from zero
+EXTRA_ENV_PARAMS = {
+    "TwoLevelDemonDisPowDisse0": {"gm": 0.02, "min_u": 0.1},
+}
+
+def env_params_from_script(script_file):
+    """
+    Extracts the env_params dictionary from a train_agent.py script without executing it
+    (executing it would start a training).
+
+    Args:
+        script_file (str): location of the train_agent.py script
+
+    Raises:
+        NameError: if the script doesn't define env_params as a literal dictionary
+
+    Returns:
+        env_params (dict): the environment parameters
+    """
+    with open(script_file, "r") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "env_params" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise NameError(f"env_params not found in {script_file}")
+
+def env_classes_in_module(module):
+    """ returns a list with (name, class) of all gym.Env classes defined in module """
+    import gym
+    classes = []
+    for name, obj in vars(module).items():
+        if isinstance(obj, type) and issubclass(obj, gym.Env) and obj.__module__ == module.__name__:
+            classes.append((name, obj))
+    return classes
+
+def import_env_module(folder, module_name):
+    """ imports the env module module_name located in folder """
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    return __import__(module_name)
+
+def random_actions(env, steps, d_act_probs, seed):
+    """
+    Generates a fixed-seed sequence of random actions for env.
+
+    Args:
+        env (gym.Env): the environment
+        steps (int): number of actions to generate
+        d_act_probs (list(float)): probability of choosing each discrete action (0,1,2)
+        seed (int): seed of the random number generator
+
+    Returns:
+        d_acts (np.array): the discrete actions
+        u_acts (np.array): the continuous actions, with shape (steps, act_dim)
+    """
+    rng = np.random.default_rng(seed)
+    box = env.action_space[1]
+    d_acts = rng.choice(len(d_act_probs), size=steps, p=d_act_probs)
+    u_acts = rng.uniform(box.low, box.high, size=(steps,) + box.shape).astype(box.dtype)
+    return d_acts, u_acts
+
+def time_steps(env, d_acts, u_acts):
+    """
+    Performs the steps on env measuring the duration of each one.
+
+    Returns:
+        durations (np.array): duration of each step in seconds
+        total (float): total duration of the loop in seconds
+    """
+    durations = np.zeros(len(d_acts))
+    start = time.perf_counter()
+    for i in range(len(d_acts)):
+        t0 = time.perf_counter()
+        env.step((int(d_acts[i]), u_acts[i]))
+        durations[i] = time.perf_counter() - t0
+    total = time.perf_counter() - start
+    return durations, total
+
+def latency_stats(durations):
+    """ returns a dictionary with count, mean and percentiles (in microseconds) of the durations """
+    if len(durations) == 0:
+        return {"count": 0}
+    us = durations*1.e6
+    return {"count": int(len(us)), "mean_us": float(np.mean(us)), "p50_us": float(np.percentile(us, 50)),
+            "p90_us": float(np.percentile(us, 90)), "p99_us": float(np.percentile(us, 99)), "max_us": float(np.max(us))}
+
+def measure_allocations(env, d_acts, u_acts):
+    """
+    Performs the steps on env tracing the python memory allocations. It is done in a separate pass since
+    tracemalloc slows down the execution.
+
+    Returns:
+        (dict): peak traced memory, and net allocated bytes and blocks per step
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(len(d_acts)):
+        env.step((int(d_acts[i]), u_acts[i]))
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    net_bytes = sum(stat.size_diff for stat in stats)
+    net_blocks = sum(stat.count_diff for stat in stats)
+    steps = max(len(d_acts), 1)
+    return {"steps": int(len(d_acts)), "peak_traced_bytes": int(peak), "net_bytes_per_step": net_bytes/steps,
+            "net_blocks_per_step": net_blocks/steps}
+
+def benchmark_env(env_class, env_params, steps, alloc_steps, d_act_probs, seed):
+    """
+    Benchmarks a single environment class.
+
+    Args:
+        env_class: the environment class
+        env_params (dict): parameters used to initialize env_class
+        steps (int): number of timed steps
+        alloc_steps (int): number of steps used to measure the allocations
+        d_act_probs (list(float)): probability of choosing each discrete action (0,1,2)
+        seed (int): seed used for the actions and the environment randomness
+
+    Returns:
+        (dict): the results of the benchmark
+    """
+    #the environments draw their random numbers from a generator seeded with env_params["seed"]
+    env_params = dict(env_params, seed=seed)
+    t0 = time.perf_counter()
+    env = env_class(env_params)
+    init_time = time.perf_counter() - t0
+    env.reset()
+    d_acts, u_acts = random_actions(env, steps + alloc_steps, d_act_probs, seed)
+
+    #timed pass
+    durations, total = time_steps(env, d_acts[:steps], u_acts[:steps])
+    latency = {str(d): latency_stats(durations[d_acts[:steps] == d]) for d in range(len(d_act_probs))}
+
+    #allocation pass
+    allocations = measure_allocations(env, d_acts[steps:], u_acts[steps:]) if alloc_steps > 0 else None
+
+    return {"init_time_s": init_time, "steps": steps, "steps_per_sec": steps/total,
+            "latency_all": latency_stats(durations), "latency_by_d_act": latency, "allocations": allocations}
+
+def git_commit():
+    """ returns the current git commit of the repository, or None """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(steps, alloc_steps, d_act_probs, seed, only=None):
+    """
+    Runs the benchmark on all environment classes.
+
+    Args:
+        steps (int): number of timed steps per environment
+        alloc_steps (int): number of steps per environment used to measure the allocations
+        d_act_probs (list(float)): probability of choosing each discrete action (0,1,2)
+        seed (int): seed of all random number generators
+        only (list(str)): if specified, only the environment classes with these names are benchmarked
+
+    Returns:
+        (dict): metadata and results of the benchmark, ready to be saved as JSON
+    """
+    results = []
+    for folder, module_name, script_file in ENV_MODULES:
+        t0 = time.perf_counter()
+        module = import_env_module(folder, module_name)
+        import_time = time.perf_counter() - t0
+        base_params = env_params_from_script(script_file) if script_file is not None else None
+        for name, env_class in env_classes_in_module(module):
+            if only is not None and name not in only:
+                continue
+            if base_params is None:
+                env_params = dict(PROJECTIVE_ENV_PARAMS.get(name, {}))
+            else:
+                env_params = dict(base_params)
+            env_params.update(EXTRA_ENV_PARAMS.get(name, {}))
+            result = {"module": module_name, "env_class": name, "env_params": env_params,
+                        "module_import_time_s": import_time}
+            print(f"Benchmarking {module_name}.{name}")
+            try:
+                result.update(benchmark_env(env_class, env_params, steps, alloc_steps, d_act_probs, seed))
+            except Exception:
+                #an environment that cannot run here (e.g. missing dependency) is recorded, not fatal
+                result["error"] = traceback.format_exc()
+                print(f"  failed: {result['error'].splitlines()[-1]}")
+            results.append(result)
+
+    metadata = {"timestamp": datetime.now().isoformat(), "git_commit": git_commit(), "python": platform.python_version(),
+                "numpy": np.__version__, "platform": platform.platform(), "steps": steps, "alloc_steps": alloc_steps,
+                "d_act_probs": list(d_act_probs), "seed": seed}
+    return {"metadata": metadata, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the step throughput of all environment classes.")
+    parser.add_argument("--steps", type=int, default=5000, help="timed steps per environment")
+    parser.add_argument("--alloc-steps", type=int, default=500, help="steps used to measure allocations (0 to skip)")
+    parser.add_argument("--d-act-probs", type=str, default="0.34,0.33,0.33",
+                        help="comma separated probabilities of the discrete actions 0,1,2")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", type=str, default=None, help="comma separated names of env classes to benchmark")
+    parser.add_argument("--output", type=str, default=None, help="output JSON file")
+    args = parser.parse_args()
+
+    d_act_probs = np.array([float(p) for p in args.d_act_probs.split(",")])
+    d_act_probs = d_act_probs / d_act_probs.sum()
+    only = None if args.only is None else args.only.split(",")
+
+    data = run(args.steps, args.alloc_steps, d_act_probs, args.seed, only)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(REPO_DIR, "benchmarks", "results", f"envs_{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    print(f"Results saved to {output}")
+
+    #summary
+    for result in data["results"]:
+        if "error" in result:
+            print(f"{result['module']}.{result['env_class']}: error")
+        else:
+            print(f"{result['module']}.{result['env_class']}: {result['steps_per_sec']:.1f} steps/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Micro and macro benchmarks of the SAC training code (sac_tri.py and core_tri.py).
+
+The micro benchmarks time, for a matrix of HIDDEN_SIZES, BATCH_SIZE, observation sizes and torch threads:
+    - ReplayBuffer.sample_batch
+    - SacTrain.compute_loss_q (forward and backward)
+    - SacTrain.compute_loss_pi (forward and backward, with the Q-networks frozen as in SacTrain.update)
+    - SacTrain.update (a full update of critics, policy and temperatures)
+    - the p50/p99 latency of MLPActorCritic.act on a single observation (the call done at every step), compared
+      with the full forward pass of the policy
+The networks and the replay buffer are created directly from fake observation and action spaces, so no
+environment, logging folder or plot is involved.
+
+The ensemble benchmark times EnsembleSacTrain.update for ensembles of different sizes, i.e. the update of
+all the members of the ensemble at once, to compare it with the update of a single agent.
+
+The macro benchmark runs SacTrain.train() on a real environment in a temporary folder, without plots.
+
+Each configuration can be run in different execution modes:
+    - "eager": the code as it is
+    - "fused_adam": the Adam optimizers use the fused (or foreach) implementation
+    - "compiled": the policy and value networks are wrapped with torch.compile
+    - "critic_grads": the Q-networks are not frozen during the policy update, so the backward pass of the policy
+      loss also computes the gradient of their parameters. This was the behavior when SacTrain.q_params was an
+      exhausted iterator, and it measures the gain of freezing them
+
+Results (updates per second, peak RSS and allocator statistics) are written to a JSON file.
+
+Usage (from the main directory of the repository):
+    python benchmarks/bench_sac.py --variant continuous --hidden-sizes 128,128;256,128 --batch-sizes 128,256
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import traceback
+from datetime import datetime
+
+#the benchmarks never display plots
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+from bench_envs import REPO_DIR, PROJECTIVE_ENV_PARAMS, env_params_from_script, git_commit, latency_stats
+
+#folder of each variant of the code, and env used by the macro benchmark
+VARIANTS = {
+    "continuous": (os.path.join(REPO_DIR, "continuous_measurement"), "sac_tri_envs_con",
+                    "TwoLevelBosonicFeedbackDemonPowDissContMeas"),
+    "discrete": (os.path.join(REPO_DIR, "discrete_measurement"), "sac_tri_envs_dis", "TwoLevelDemonDisPowDiss"),
+    "projective": (os.path.join(REPO_DIR, "projective_measurement", "src"), "sac_tri_envs",
+                    "TwoLevelBosonicFeedbackDemonPowDiss"),
+}
+
+MODES = ["eager", "fused_adam", "compiled", "critic_grads"]
+
+#hyperparameters used by the benchmarks. Only the ones affecting the update matter
+BASE_HYPERPARAMS = {
+    "BATCH_SIZE": 256,
+    "LR": 0.0003,
+    "ALPHA_LR": 0.001,
+    "H_D_START": np.log(3.),
+    "H_D_END": 0.01,
+    "H_D_DECAY": 80000,
+    "H_C_START": 0.8,
+    "H_C_END": -3.,
+    "H_C_DECAY": 80000,
+    "REPLAY_MEMORY_SIZE": 80000,
+    "POLYAK": 0.995,
+    "LOG_STEPS": 2000,
+    "GAMMA": 0.998,
+    "HIDDEN_SIZES": (128,128),
+    "SAVE_STATE_STEPS": 10**12,
+    "INITIAL_RANDOM_STEPS": 5000,
+    "UPDATE_AFTER": 1000,
+    "UPDATE_EVERY": 50,
+    "USE_CUDA": False,
+    "MIN_COV_EIGEN": 1.e-8,
+    "DONT_SAVE_MEMORY": True,
+}
+
+def import_variant(variant):
+    """ imports and returns the sac_tri, extra and env modules of the given variant """
+    folder, env_module_name, _ = VARIANTS[variant]
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    import sac_tri
+    import extra
+    env_module = __import__(env_module_name)
+    return sac_tri, extra, env_module
+
+def fake_spaces(obs_dim):
+    """ returns an observation space with obs_dim variables, and an action space like the ones of sac_tri_envs """
+    import gym
+    observation_space = gym.spaces.Box(low=np.zeros(obs_dim, dtype=np.float32) - 1.,
+                                        high=np.zeros(obs_dim, dtype=np.float32) + 1., dtype=np.float32)
+    action_space = (gym.spaces.Discrete(3), gym.spaces.Box(low=np.array([-1.], dtype=np.float32),
+                                                            high=np.array([1.], dtype=np.float32), dtype=np.float32))
+    return observation_space, action_space
+
+def make_trainer(sac_tri, extra, obs_dim, hidden_sizes, batch_size, mode, fill=20000):
+    """
+    Creates a SacTrain object with initialized networks, optimizers and a replay buffer filled with random
+    transitions, without creating an environment or a logging folder.
+
+    Args:
+        sac_tri: the sac_tri module
+        extra: the extra module
+        obs_dim (int): number of observation variables
+        hidden_sizes (tuple(int)): HIDDEN_SIZES
+        batch_size (int): BATCH_SIZE
+        mode (str): one of MODES
+        fill (int): number of random transitions in the replay buffer
+
+    Returns:
+        train (sac_tri.SacTrain): the SacTrain object
+    """
+    import torch
+    train = sac_tri.SacTrain()
+    train.s = extra.SacTrainState()
+    train.s.device = torch.device("cpu")
+    train.s.training_hyperparams = dict(BASE_HYPERPARAMS, HIDDEN_SIZES=hidden_sizes, BATCH_SIZE=batch_size)
+    train.initialize_default_hyperparams()
+    train.s.steps_done = 0
+    observation_space, action_space = fake_spaces(obs_dim)
+    train.env = types.SimpleNamespace(observation_space=observation_space, action_space=action_space)
+
+    #fill the replay buffer with random transitions
+    train.memory = sac_tri.ReplayBuffer(obs_dim, 1, train.s.training_hyperparams["REPLAY_MEMORY_SIZE"], train.s.device)
+    train.memory.obs_buf[:fill] = torch.rand((fill, obs_dim))*2.-1.
+    train.memory.obs2_buf[:fill] = torch.rand((fill, obs_dim))*2.-1.
+    train.memory.tri_act_buf[:fill] = torch.randint(0, 3, (fill,)).float()
+    train.memory.act_buf[:fill] = torch.rand((fill, 1))*2.-1.
+    train.memory.rew_buf[:fill] = torch.randn(fill)
+    train.memory.ptr, train.memory.size = fill, fill
+
+    #create the networks and the optimizers
+    train.initialize_nns()
+    train.create_optimizer()
+
+    if mode == "fused_adam":
+        optim = torch.optim
+        fused_kwargs = {"fused": True} if "fused" in optim.Adam.__init__.__code__.co_varnames else {"foreach": True}
+        lr = train.s.training_hyperparams["LR"]
+        train.pi_optimizer = optim.Adam(train.ac.pi.parameters(), lr=lr, **fused_kwargs)
+        train.q_optimizer = optim.Adam(list(train.ac.q1.parameters()) + list(train.ac.q2.parameters()), lr=lr, **fused_kwargs)
+    elif mode == "critic_grads":
+        #the loops freezing the Q-networks in SacTrain.update iterate over nothing
+        train.q_params = []
+    elif mode == "compiled":
+        for ac in (train.ac, train.ac_targ):
+            ac.pi = torch.compile(ac.pi)
+            ac.q1 = torch.compile(ac.q1)
+            ac.q2 = torch.compile(ac.q2)
+    return train
+
+def time_calls(func, min_time, warmup):
+    """
+    Calls func repeatedly for at least min_time seconds, after warmup calls.
+
+    Returns:
+        (float): number of calls per second
+    """
+    for _ in range(warmup):
+        func()
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls/elapsed
+
+def time_latencies(func, calls, warmup):
+    """
+    Calls func a given number of times, after warmup calls, measuring the duration of each call.
+
+    Returns:
+        (dict): latency statistics in microseconds (see bench_envs.latency_stats)
+    """
+    for _ in range(warmup):
+        func()
+    durations = np.zeros(calls)
+    for i in range(calls):
+        t0 = time.perf_counter()
+        func()
+        durations[i] = time.perf_counter() - t0
+    return latency_stats(durations)
+
+def act_latency(train, obs_dim, calls, warmup):
+    """
+    Measures the latency of the policy calls on a single observation: MLPActorCritic.act, used at every training
+    and evaluation step, and the full forward pass of the policy (the previous implementation of act).
+
+    Returns:
+        (dict): latency statistics of each call, stochastic and deterministic
+    """
+    import torch
+    obs = torch.rand(obs_dim)*2.-1.
+
+    def forward(deterministic):
+        with torch.no_grad():
+            return train.ac.pi(obs.view(1,-1), deterministic, False)
+
+    return {"act": time_latencies(lambda: train.ac.act(obs), calls, warmup),
+            "act_deterministic": time_latencies(lambda: train.ac.act(obs, True), calls, warmup),
+            "pi_forward": time_latencies(lambda: forward(False), calls, warmup),
+            "pi_forward_deterministic": time_latencies(lambda: forward(True), calls, warmup)}
+
+def allocator_stats(func):
+    """
+    Returns the number of bytes allocated by the torch CPU allocator (measured with the torch profiler),
+    and the peak memory of the cuda allocator if cuda is in use, during a single call of func.
+    """
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        func()
+    allocated = sum(max(event.self_cpu_memory_usage, 0) for event in prof.events())
+    stats = {"cpu_allocated_bytes_per_call": int(allocated)}
+    if torch.cuda.is_available():
+        stats["cuda_max_memory_allocated"] = int(torch.cuda.max_memory_allocated())
+    return stats
+
+def peak_rss_bytes():
+    """ peak resident set size of the process (ru_maxrss is in kB on Linux and in bytes on macOS) """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(rss if sys.platform == "darwin" else rss*1024)
+
+def micro_benchmark(sac_tri, extra, obs_dim, hidden_sizes, batch_size, threads, mode, min_time, warmup, act_calls):
+    """
+    Runs the micro benchmarks for a single configuration.
+
+    Returns:
+        (dict): calls per second of each function, latency of the policy calls, peak RSS and allocator
+            statistics of SacTrain.update
+    """
+    import torch
+    torch.set_num_threads(threads)
+    train = make_trainer(sac_tri, extra, obs_dim, hidden_sizes, batch_size, mode)
+    batch = train.memory.sample_batch(batch_size)
+
+    def loss_q():
+        train.q_optimizer.zero_grad()
+        train.compute_loss_q(batch).backward()
+
+    def loss_pi():
+        for p in train.q_params:
+            p.requires_grad = False
+        train.pi_optimizer.zero_grad()
+        train.compute_loss_pi(batch)[0].backward()
+        for p in train.q_params:
+            p.requires_grad = True
+
+    def update():
+        train.update(train.memory.sample_batch(batch_size))
+
+    result = {"obs_dim": obs_dim, "hidden_sizes": list(hidden_sizes), "batch_size": batch_size, "threads": threads,
+              "mode": mode}
+    result["sample_batch_per_sec"] = time_calls(lambda: train.memory.sample_batch(batch_size), min_time, warmup)
+    result["compute_loss_q_per_sec"] = time_calls(loss_q, min_time, warmup)
+    result["compute_loss_pi_per_sec"] = time_calls(loss_pi, min_time, warmup)
+    result["updates_per_sec"] = time_calls(update, min_time, warmup)
+    result["update_allocator"] = allocator_stats(update)
+    if act_calls > 0:
+        result["act_latency"] = act_latency(train, obs_dim, act_calls, warmup)
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+def ensemble_benchmark(sac_tri, extra, obs_dim, hidden_sizes, batch_size, threads, ensemble_size, min_time, warmup):
+    """
+    Times EnsembleSacTrain.update for an ensemble of ensemble_size members, each one created as in make_trainer.
+
+    Returns:
+        (dict): updates per second of the whole ensemble, and the corresponding updates per second of the members
+    """
+    import torch
+    torch.set_num_threads(threads)
+    ensemble = sac_tri.EnsembleSacTrain()
+    ensemble.members = [make_trainer(sac_tri, extra, obs_dim, hidden_sizes, batch_size, "eager")
+                        for _ in range(ensemble_size)]
+    ensemble.initialize_ensemble()
+    updates_per_sec = time_calls(lambda: ensemble.update(ensemble.sample_batch(batch_size)), min_time, warmup)
+    return {"obs_dim": obs_dim, "hidden_sizes": list(hidden_sizes), "batch_size": batch_size, "threads": threads,
+            "ensemble_size": ensemble_size, "ensemble_updates_per_sec": updates_per_sec,
+            "member_updates_per_sec": updates_per_sec*ensemble_size, "peak_rss_bytes": peak_rss_bytes()}
+
+def macro_benchmark(sac_tri, env_module, env_name, env_params, steps, threads, hidden_sizes, batch_size):
+    """
+    Runs SacTrain.train() for a number of steps on a real environment, in a temporary folder, without plots.
+    The number of initial random steps and of steps before the updates are small, so that most of the
+    time is spent in the normal training regime.
+
+    Returns:
+        (dict): training steps per second, and updates per second
+    """
+    import torch
+    torch.set_num_threads(threads)
+    tmp_dir = tempfile.mkdtemp()
+    original_save_data_dir = sac_tri.SacTrain.SAVE_DATA_DIR
+    sac_tri.SacTrain.SAVE_DATA_DIR = tmp_dir
+    try:
+        hyperparams = dict(BASE_HYPERPARAMS, HIDDEN_SIZES=hidden_sizes, BATCH_SIZE=batch_size,
+                            INITIAL_RANDOM_STEPS=batch_size, UPDATE_AFTER=batch_size, LOG_STEPS=steps)
+        log_info = {"log_running_reward": True, "log_running_loss": True, "log_actions": True, "extra_str": "_bench"}
+        train = sac_tri.SacTrain()
+        train.initialize_new_train(getattr(env_module, env_name), dict(env_params), hyperparams, log_info)
+        #reach the normal training regime before timing
+        train.train(2*batch_size, output_plots=False)
+        start = time.perf_counter()
+        train.train(steps, output_plots=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        sac_tri.SacTrain.SAVE_DATA_DIR = original_save_data_dir
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    #UPDATE_EVERY updates are done every UPDATE_EVERY steps, so there is one update per step
+    return {"env_class": env_name, "steps": steps, "threads": threads, "hidden_sizes": list(hidden_sizes),
+            "batch_size": batch_size, "steps_per_sec": steps/elapsed, "updates_per_sec": steps/elapsed,
+            "peak_rss_bytes": peak_rss_bytes()}
+
+def parse_int_list(string):
+    return [int(s) for s in string.split(",") if s != ""]
+
+def parse_hidden_sizes(string):
+    return [tuple(parse_int_list(s)) for s in string.split(";") if s != ""]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SAC updates.")
+    parser.add_argument("--variant", choices=list(VARIANTS), default="continuous",
+                        help="which folder's sac_tri.py and core_tri.py to benchmark")
+    parser.add_argument("--hidden-sizes", type=str, default="128,128;256,128", help="semicolon separated HIDDEN_SIZES")
+    parser.add_argument("--batch-sizes", type=str, default="128,256")
+    parser.add_argument("--obs-dims", type=str, default="2,3,17")
+    parser.add_argument("--threads", type=str, default="1")
+    parser.add_argument("--modes", type=str, default="eager,fused_adam", help=f"comma separated, among {MODES}")
+    parser.add_argument("--min-time", type=float, default=2., help="seconds spent timing each function")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--act-calls", type=int, default=2000, help="timed single observation policy calls (0 to skip)")
+    parser.add_argument("--ensemble-sizes", type=str, default="4",
+                        help="comma separated sizes of the ensembles of the ensemble benchmark (empty to skip)")
+    parser.add_argument("--macro-steps", type=int, default=2000, help="training steps of the macro benchmark (0 to skip)")
+    parser.add_argument("--output", type=str, default=None, help="output JSON file")
+    args = parser.parse_args()
+
+    import torch
+    sac_tri, extra, env_module = import_variant(args.variant)
+    hidden_sizes_list = parse_hidden_sizes(args.hidden_sizes)
+    batch_sizes = parse_int_list(args.batch_sizes)
+    threads_list = parse_int_list(args.threads)
+    modes = args.modes.split(",")
+
+    #micro benchmarks
+    micro_results = []
+    for mode in modes:
+        for threads in threads_list:
+            for hidden_sizes in hidden_sizes_list:
+                for batch_size in batch_sizes:
+                    for obs_dim in parse_int_list(args.obs_dims):
+                        print(f"micro: mode={mode} threads={threads} hidden={hidden_sizes} batch={batch_size} obs={obs_dim}")
+                        try:
+                            result = micro_benchmark(sac_tri, extra, obs_dim, hidden_sizes, batch_size, threads, mode,
+                                                        args.min_time, args.warmup, args.act_calls)
+                            print(f"  {result['updates_per_sec']:.1f} updates/s")
+                            if "act_latency" in result:
+                                act = result["act_latency"]["act"]
+                                print(f"  act latency p50 {act['p50_us']:.1f} us, p99 {act['p99_us']:.1f} us")
+                        except Exception:
+                            result = {"obs_dim": obs_dim, "hidden_sizes": list(hidden_sizes), "batch_size": batch_size,
+                                        "threads": threads, "mode": mode, "error": traceback.format_exc()}
+                            print(f"  failed: {result['error'].splitlines()[-1]}")
+                        micro_results.append(result)
+
+    #ensemble benchmarks
+    ensemble_results = []
+    for ensemble_size in parse_int_list(args.ensemble_sizes):
+        for threads in threads_list:
+            for hidden_sizes in hidden_sizes_list:
+                for batch_size in batch_sizes:
+                    for obs_dim in parse_int_list(args.obs_dims):
+                        print(f"ensemble: size={ensemble_size} threads={threads} hidden={hidden_sizes} "
+                              f"batch={batch_size} obs={obs_dim}")
+                        try:
+                            result = ensemble_benchmark(sac_tri, extra, obs_dim, hidden_sizes, batch_size, threads,
+                                                        ensemble_size, args.min_time, args.warmup)
+                            print(f"  {result['ensemble_updates_per_sec']:.1f} ensemble updates/s, "
+                                  f"{result['member_updates_per_sec']:.1f} member updates/s")
+                        except Exception:
+                            result = {"obs_dim": obs_dim, "hidden_sizes": list(hidden_sizes), "batch_size": batch_size,
+                                        "threads": threads, "ensemble_size": ensemble_size,
+                                        "error": traceback.format_exc()}
+                            print(f"  failed: {result['error'].splitlines()[-1]}")
+                        ensemble_results.append(result)
+
+    #macro benchmarks
+    macro_results = []
+    if args.macro_steps > 0:
+        _, _, env_name = VARIANTS[args.variant]
+        if args.variant == "projective":
+            env_params = PROJECTIVE_ENV_PARAMS[env_name]
+        else:
+            env_params = env_params_from_script(os.path.join(VARIANTS[args.variant][0], "train_agent.py"))
+        for threads in threads_list:
+            for hidden_sizes in hidden_sizes_list:
+                for batch_size in batch_sizes:
+                    print(f"macro: threads={threads} hidden={hidden_sizes} batch={batch_size}")
+                    try:
+                        result = macro_benchmark(sac_tri, env_module, env_name, env_params, args.macro_steps, threads,
+                                                    hidden_sizes, batch_size)
+                        print(f"  {result['steps_per_sec']:.1f} steps/s")
+                    except Exception:
+                        result = {"env_class": env_name, "threads": threads, "hidden_sizes": list(hidden_sizes),
+                                    "batch_size": batch_size, "error": traceback.format_exc()}
+                        print(f"  failed: {result['error'].splitlines()[-1]}")
+                    macro_results.append(result)
+
+    metadata = {"timestamp": datetime.now().isoformat(), "git_commit": git_commit(), "variant": args.variant,
+                "python": platform.python_version(), "torch": torch.__version__, "numpy": np.__version__,
+                "platform": platform.platform(), "min_time": args.min_time}
+    data = {"metadata": metadata, "micro": micro_results, "ensemble": ensemble_results, "macro": macro_results}
+
+    output = args.output
+    if output is None:
+        output = os.path.join(REPO_DIR, "benchmarks", "results", f"sac_{datetime.now().strftime('%Y_%m_%d-%H_%M_%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
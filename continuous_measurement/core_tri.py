@@ -16,7 +16,7 @@ PROBS_MIN = 2e-5
 PROBS_MAX = 1.
 UNIFORM_SIGMA =3.46
 
-def mlp(sizes, activation, output_activation=nn.Identity):
+def mlp(sizes, activation, output_activation=nn.Identity, ensemble_size=None):
     """
     return a sequential net of fully connected layers
 
@@ -25,6 +25,7 @@ def mlp(sizes, activation, output_activation=nn.Identity):
         activation: activation function for all layers except for the output layer
         output_activation: activation to use for output layer only. It can also be the
             string "soft_max", in which case the soft_max will be performed
+        ensemble_size(int): if specified, each layer is an EnsembleLinear with this many members
 
     Returns:
         stacked fully connected layers
@@ -33,15 +34,46 @@ def mlp(sizes, activation, output_activation=nn.Identity):
     for j in range(len(sizes)-1):
         if j < len(sizes)-2:
             act = activation
-            layers += [nn.Linear(sizes[j], sizes[j+1]), act()]
+            layers += [linear(sizes[j], sizes[j+1], ensemble_size), act()]
         else:
             if output_activation == "soft_max":
-                layers += [nn.Linear(sizes[j], sizes[j+1]), nn.Softmax(dim=-1)]
+                layers += [linear(sizes[j], sizes[j+1], ensemble_size), nn.Softmax(dim=-1)]
             else:
                 act = output_activation
-                layers += [nn.Linear(sizes[j], sizes[j+1]), act()]
+                layers += [linear(sizes[j], sizes[j+1], ensemble_size), act()]
     return nn.Sequential(*layers)
 
+def linear(in_features, out_features, ensemble_size=None):
+    """ returns a nn.Linear layer, or an EnsembleLinear layer with ensemble_size members if it's specified """
+    if ensemble_size is None:
+        return nn.Linear(in_features, out_features)
+    return EnsembleLinear(ensemble_size, in_features, out_features)
+
+class EnsembleLinear(nn.Module):
+    """
+    Stack of ensemble_size independent fully connected layers, evaluated with a single batched matrix
+    multiplication. The input is a batch of ensemble_size*batch elements, where the consecutive blocks of batch
+    elements are processed by the layer of the corresponding member. The parameters have the same names as in
+    nn.Linear, with the member as leftmost index, so the state_dict of a single member can be extracted.
+
+    Args:
+        ensemble_size(int): number of independent layers
+        in_features(int): size of each input
+        out_features(int): size of each output
+    """
+    def __init__(self, ensemble_size, in_features, out_features):
+        super().__init__()
+        self.ensemble_size = ensemble_size
+        #each member is initialized as a nn.Linear
+        layers = [nn.Linear(in_features, out_features) for _ in range(ensemble_size)]
+        self.weight = nn.Parameter(torch.stack([layer.weight.data for layer in layers]))
+        self.bias = nn.Parameter(torch.stack([layer.bias.data for layer in layers]))
+
+    def forward(self, x):
+        out = torch.baddbmm(self.bias.unsqueeze(1), x.reshape(self.ensemble_size, -1, x.shape[-1]),
+                            self.weight.transpose(1,2))
+        return out.reshape(x.shape[:-1] + (self.weight.shape[1],))
+
 def count_vars(module):
     """counts the variables of a module """
     return sum([np.prod(p.shape) for p in module.parameters()])
@@ -72,9 +104,13 @@ class MLPActorCritic(nn.Module):
         hidden_sizes (tuple(int)): size of each of the hidden layers that will be addded to 
             both the value and policy functions
         activation: activation function for all layers except for the output layer
+        ensemble_size (int): if specified, the module contains ensemble_size independent actor-critics, whose
+            layers are evaluated at once (see EnsembleLinear). The inputs are batches of ensemble_size*batch
+            elements, the consecutive blocks of batch elements belonging to the same member, and alpha_d and
+            alpha_c return one value for each member
     """
     def __init__(self, observation_space, action_space, hidden_sizes=(256,256),
-                 activation=nn.ReLU, min_cov_eigen = 1.e-8):
+                 activation=nn.ReLU, min_cov_eigen = 1.e-8, ensemble_size=None):
         super().__init__()
 
         #raise error if the size isn't supported
@@ -83,27 +119,36 @@ class MLPActorCritic(nn.Module):
         
         # build policy and value functions
         self.pi = SquashedGaussianMLPActor(observation_space, action_space, hidden_sizes, activation,
-                    min_cov_eigen=min_cov_eigen)
-        self.q1 = MLPQFunction(observation_space, action_space, hidden_sizes, activation)
-        self.q2 = MLPQFunction(observation_space, action_space, hidden_sizes, activation)
-        self.alpha_d = Alpha()
-        self.alpha_c = Alpha()
-        
-        #create tensors that will be used to determine the discrete action
-        self.zero_float = torch.tensor(0., dtype=torch.float32)
-        self.one_float = torch.tensor(1., dtype=torch.float32)
+                    min_cov_eigen=min_cov_eigen, ensemble_size=ensemble_size)
+        self.q1 = MLPQFunction(observation_space, action_space, hidden_sizes, activation, ensemble_size=ensemble_size)
+        self.q2 = MLPQFunction(observation_space, action_space, hidden_sizes, activation, ensemble_size=ensemble_size)
+        self.alpha_d = Alpha(ensemble_size)
+        self.alpha_c = Alpha(ensemble_size)
 
     def act(self, obs, deterministic=False):
-        """ return the action, chosen according to deterministic, given a single unbatched observation obs """
+        """
+        return the action, chosen according to deterministic, given a single unbatched observation obs.
+        It uses SquashedGaussianMLPActor.act, which only evaluates the branch of the chosen discrete action.
+        """
         with torch.no_grad():
-            b_action, pi0_action, pi1_action, pi2_action, _, _, _, _, _= self.pi(obs.view(1,-1), deterministic, False)
-            if torch.isclose(b_action[0],self.zero_float):
-                return (b_action[0], pi0_action[0])
-            elif torch.isclose(b_action[0],self.one_float):
-                return (b_action[0], pi1_action[0])
-            else:
-                return (b_action[0], pi2_action[0])
+            return self.pi.act(obs.view(-1), deterministic)
     
+    def act_batch(self, obs, deterministic=False):
+        """
+        return the actions, chosen according to deterministic, given a batch of observations obs.
+        A single forward pass of the policy is done for the whole batch.
+
+        Returns:
+            b_action (torch.Tensor): the discrete actions, with shape (batch,)
+            pi_action (torch.Tensor): the continuous actions corresponding to the chosen discrete actions,
+                with shape (batch, act_dim)
+        """
+        with torch.no_grad():
+            b_action, pi0_action, pi1_action, pi2_action, _, _, _, _, _= self.pi(obs, deterministic, False)
+            pi_actions = torch.stack([pi0_action, pi1_action, pi2_action], dim=1)
+            b_index = torch.round(b_action).long()
+            return (b_action, pi_actions[torch.arange(b_index.shape[0], device=b_index.device), b_index])
+
     def alpha_d_no_grad(self):
         """
         returns the current value of alpha without gradients
@@ -118,6 +163,23 @@ class MLPActorCritic(nn.Module):
         with torch.no_grad():
             return self.alpha_c()
 
+    def member_state_dict(self, index):
+        """
+        For an ensemble (see ensemble_size), returns the state_dict of the member index, which can be loaded
+        into an MLPActorCritic without ensemble_size.
+        """
+        params = dict(self.named_parameters())
+        return {key: value[index].clone() if key in params else value for key, value in self.state_dict().items()}
+
+    def load_member_state_dicts(self, state_dicts):
+        """
+        For an ensemble (see ensemble_size), loads the state_dict of each member, e.g. of an MLPActorCritic
+        without ensemble_size. The buffers, which are the same for all members, are taken from the first one.
+        """
+        params = dict(self.named_parameters())
+        self.load_state_dict({key: torch.stack([state_dict[key] for state_dict in state_dicts]) if key in params
+                                else value for key, value in state_dicts[0].items()})
+
 class MLPQFunction(nn.Module):
     """
     Class representing a q-value function, implemented with fully connected layers
@@ -128,8 +190,9 @@ class MLPQFunction(nn.Module):
         act_dim(int): number of continuous actions
         hidden_sizes(tuple(int)): list of sizes of hidden layers
         activation: activation function for all layers except for output
+        ensemble_size(int): if specified, number of members of an ensemble (see MLPActorCritic)
     """
-    def __init__(self, observation_space, action_space, hidden_sizes, activation):
+    def __init__(self, observation_space, action_space, hidden_sizes, activation, ensemble_size=None):
         super().__init__()
 
         #determine action and observation spaces
@@ -140,7 +203,7 @@ class MLPQFunction(nn.Module):
         
         #define the input layer that places data in a bound
         self.rescale_input = RescaleInput(obs_act_lower_bounds, obs_act_upper_bounds)
-        self.q = mlp([obs_dim + act_dim] + list(hidden_sizes) + [3], activation)
+        self.q = mlp([obs_dim + act_dim] + list(hidden_sizes) + [3], activation, ensemble_size=ensemble_size)
 
 
     def forward(self, obs, act):
@@ -171,9 +234,10 @@ class SquashedGaussianMLPActor(nn.Module):
         activation: activation function for all layers except for output
         act_lower_limit (float): minimum value of the single continuous action
         act_upper_limit (float): maximum value of the single continuous action
+        ensemble_size(int): if specified, number of members of an ensemble (see MLPActorCritic)
     """
     def __init__(self, observation_space, action_space, hidden_sizes, activation,
-                    min_cov_eigen=1.e-8):
+                    min_cov_eigen=1.e-8, ensemble_size=None):
         super().__init__()
 
         #load state and action dimensions and bounds
@@ -189,16 +253,16 @@ class SquashedGaussianMLPActor(nn.Module):
         self.rescale_input = RescaleInput(obs_lower_bounds, obs_upper_bounds)
         
         #main network taking the state as input, and passing it through all hidden layers
-        self.net = mlp([obs_dim] + list(hidden_sizes), activation, activation)
+        self.net = mlp([obs_dim] + list(hidden_sizes), activation, activation, ensemble_size=ensemble_size)
         
         #output layer producing the average of the three conditional probability densities
-        self.mu0_layer = nn.Linear(hidden_sizes[-1], act_dim)
-        self.mu1_layer = nn.Linear(hidden_sizes[-1], act_dim)
-        self.mu2_layer = nn.Linear(hidden_sizes[-1], act_dim)
+        self.mu0_layer = linear(hidden_sizes[-1], act_dim, ensemble_size)
+        self.mu1_layer = linear(hidden_sizes[-1], act_dim, ensemble_size)
+        self.mu2_layer = linear(hidden_sizes[-1], act_dim, ensemble_size)
         #output layer producing log(sigma) of the three conditional probability densities
-        self.m0_layer = nn.Linear(hidden_sizes[-1], act_dim*act_dim)
-        self.m1_layer = nn.Linear(hidden_sizes[-1], act_dim*act_dim)
-        self.m2_layer = nn.Linear(hidden_sizes[-1], act_dim*act_dim)
+        self.m0_layer = linear(hidden_sizes[-1], act_dim*act_dim, ensemble_size)
+        self.m1_layer = linear(hidden_sizes[-1], act_dim*act_dim, ensemble_size)
+        self.m2_layer = linear(hidden_sizes[-1], act_dim*act_dim, ensemble_size)
         #I create the matrix l_id = lambda *Id for the covariance matrix
         self.register_buffer("l_id", torch.eye(act_dim)*min_cov_eigen)
         #i compute the quantity to subtract to the log_probs because of the action rescaling
@@ -208,7 +272,8 @@ class SquashedGaussianMLPActor(nn.Module):
         #              torch.log(0.5*(self.act_upper_bounds-self.act_lower_bounds)).sum())
         #output layer producing the marginal probability of each of the 3 discrete actions
         p_activation = "soft_max"
-        self.p_layer = mlp(sizes=[hidden_sizes[-1], 3], activation=p_activation, output_activation=p_activation)
+        self.p_layer = mlp(sizes=[hidden_sizes[-1], 3], activation=p_activation, output_activation=p_activation,
+                            ensemble_size=ensemble_size)
         
     def forward(self, obs, deterministic=False, with_logprob=True):
         """
@@ -302,16 +367,58 @@ class SquashedGaussianMLPActor(nn.Module):
 
         return b_action, pi0_action, pi1_action, pi2_action, p, p_entropy, logp_pi0, logp_pi1, logp_pi2
 
+    def act(self, obs, deterministic=False):
+        """
+        Chooses an action like forward(), but for a single unbatched observation, and only for acting: the
+        discrete action is chosen first, and then only the mean (and covariance if not deterministic) of the
+        corresponding continuous action are computed. No distribution object is created and no log probability
+        is computed, so it should be called under torch.no_grad().
+
+        Args:
+            obs(torch.Tensor): a single observation, with shape (obs_dim,)
+            deterministic(bool): if the actions should be chosen deterministally or not
+
+        Returns:
+            b_action(torch.Tensor): the chosen discrete action (0,1,2), as a float32 scalar
+            pi_action(torch.Tensor): the chosen continuous action, with shape (act_dim,)
+        """
+        #run the state through the network
+        net_out = self.net(self.rescale_input(obs))
+        p = torch.clamp(self.p_layer(net_out), PROBS_MIN, PROBS_MAX)
+
+        #choose the discrete action. torch.multinomial doesn't need normalized probabilities
+        if deterministic:
+            b_index = torch.argmax(p)
+        else:
+            b_index = torch.multinomial(p, 1)[0]
+        b = int(b_index)
+
+        #compute the continuous action of the chosen branch only
+        mu = (self.mu0_layer, self.mu1_layer, self.mu2_layer)[b](net_out)
+        if deterministic:
+            pi_action = mu
+        else:
+            m = (self.m0_layer, self.m1_layer, self.m2_layer)[b](net_out).view(self.act_dim,self.act_dim)
+            cov_mat = (m.T @ m) + self.l_id
+            pi_action = mu + torch.linalg.cholesky(cov_mat) @ torch.randn(self.act_dim, device=mu.device)
+
+        #apply tanh and shift the action to the correct interval
+        pi_action = self.act_lower_bounds + 0.5*(torch.tanh(pi_action) + 1.)*(self.act_upper_bounds-self.act_lower_bounds)
+        return b_index.to(torch.float32), pi_action
+
 class Alpha(nn.Module):
     """
 
     Args:
-       
+        ensemble_size(int): if specified, there is an independent value for each of the ensemble_size members
     """
-    def __init__(self):
+    def __init__(self, ensemble_size=None):
         super().__init__()
         #initialize it to some "large" initial value
-        self.log_alpha_val = nn.Parameter(torch.tensor(1., dtype=torch.float32))
+        if ensemble_size is None:
+            self.log_alpha_val = nn.Parameter(torch.tensor(1., dtype=torch.float32))
+        else:
+            self.log_alpha_val = nn.Parameter(torch.ones(ensemble_size, dtype=torch.float32))
         
     def forward(self):
         """
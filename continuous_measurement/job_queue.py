@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import traceback
+import uuid
+from pathlib import Path
+import sac_tri
+import sac_tri_envs_con
+
+"""
+This module contains a work queue for training sweeps run on several nodes that only share a filesystem.
+The jobs are files in a queue folder, and moving a job between the subfolders pending, running, done and failed
+with an atomic rename acts as a lock, so no external service is needed. Each node runs one or more workers:
+    python job_queue.py queue_dir
+Jobs are added with JobQueue.add_job. A worker claims a pending job, trains it with SacTrain writing a heartbeat,
+and moves it to done. A job whose heartbeat stops (e.g. the node died) is moved back to pending by any worker, and
+it is resumed from the latest state saved by SacTrain.save_full_state.
+"""
+
+class JobQueue(object):
+    """
+    Shared-filesystem queue of training jobs. Each job is a json file with the environment class name, env_params,
+    training_hyperparams, log_info and the number of training steps. It is in one of the subfolders PENDING, RUNNING,
+    DONE and FAILED of queue_dir. The heartbeats of the running jobs are in HEARTBEATS, and the log folder and the
+    steps done by each job are in PROGRESS. A running job file also contains the owner token of the worker that
+    claimed it, so a worker can check that a job that was requeued and claimed again is no longer its own. The
+    clocks of the nodes should agree within a small fraction of dead_after.
+
+    Args:
+        queue_dir (str): folder of the queue, on the shared filesystem
+        dead_after (float): a running job whose heartbeat is older than this many seconds is requeued
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    HEARTBEATS = "heartbeats"
+    PROGRESS = "progress"
+
+    def __init__(self, queue_dir, dead_after=600.):
+        self.queue_dir = queue_dir
+        self.dead_after = dead_after
+        for folder in [self.PENDING, self.RUNNING, self.DONE, self.FAILED, self.HEARTBEATS, self.PROGRESS]:
+            Path(os.path.join(queue_dir, folder)).mkdir(parents=True, exist_ok=True)
+
+    def add_job(self, env_class, env_params, training_hyperparams, steps, log_info=None, job_id=None):
+        """
+        Adds a job to the queue.
+
+        Args:
+            env_class: class of the environment, defined in sac_tri_envs_con
+            env_params (dict): parameters of the environment
+            training_hyperparams (dict): training hyperparameters (see SacTrain.initialize_new_train). Tuples are
+                saved as lists
+            steps (int): number of training steps
+            log_info (dict): logging info (see SacTrain.initialize_new_train). If None, all logs are written in
+                headless mode, with the job id as extra_str, and without updating the catalog of the data folder,
+                which can't be written by several nodes at once
+            job_id (str): name of the job, which must be unique. If None, it's generated from the time
+
+        Returns:
+            (str): the job id
+        """
+        if job_id is None:
+            job_id = f"{time.strftime('%Y_%m_%d-%H_%M_%S')}_{socket.gethostname()}_{os.getpid()}_{time.time_ns()}"
+        if log_info is None:
+            log_info = {"log_running_reward": True, "log_running_loss": True, "log_actions": True,
+                        "extra_str": f"_{job_id}", "headless": True, "catalog": False}
+        job = {"env_class": env_class.__name__, "env_params": env_params, "training_hyperparams": training_hyperparams,
+               "log_info": log_info, "steps": steps}
+        self.write_json(self.job_file(self.PENDING, job_id), job)
+        return job_id
+
+    def claim_job(self, worker_id):
+        """
+        Claims a pending job, moving it to running, and writes in it an owner token made of worker_id and a random
+        nonce. Only one worker can succeed in moving a given job.
+
+        Args:
+            worker_id (str): identifier of the worker claiming the job
+
+        Returns:
+            (str, str): the id of the claimed job and the owner token, or None if there are no pending jobs
+        """
+        for job_id in self.job_ids(self.PENDING):
+            if self.move_job(job_id, self.PENDING, self.RUNNING):
+                owner = f"{worker_id}_{uuid.uuid4().hex}"
+                job = self.job(job_id, self.RUNNING)
+                self.write_json(self.job_file(self.RUNNING, job_id), dict(job, owner=owner))
+                return job_id, owner
+        return None
+
+    def owns(self, job_id, owner):
+        """ returns True if job_id is running with the owner token owner, i.e. it wasn't requeued meanwhile """
+        job = self.job(job_id, self.RUNNING)
+        if job is None:
+            #the job could be renamed while requeue_dead_jobs checks it
+            jobs = [self.read_json(file) for file in self.requeue_files(job_id)]
+            return any(job is not None and job.get("owner") == owner for job in jobs)
+        return job.get("owner") == owner
+
+    def requeue_dead_jobs(self):
+        """
+        Moves back to pending the running jobs whose heartbeat is older than dead_after seconds, or that never
+        wrote a heartbeat in dead_after seconds since they were claimed. Since another worker could requeue and
+        claim a job again after it was found dead, the job is first renamed to a unique name, so that only one
+        worker can requeue it, and it's checked again: if it has a new owner or a recent heartbeat, it's put back.
+
+        Returns:
+            (list(str)): the ids of the requeued jobs
+        """
+        requeued = []
+        for job_id in self.job_ids(self.RUNNING):
+            job = self.job(job_id, self.RUNNING)
+            if job is None or not self.is_dead(self.job_file(self.RUNNING, job_id), job_id):
+                continue
+            requeue_file = os.path.join(self.queue_dir, self.RUNNING, f"{job_id}.{uuid.uuid4().hex}.requeue")
+            try:
+                os.rename(self.job_file(self.RUNNING, job_id), requeue_file)
+            except FileNotFoundError:
+                continue
+            renamed_job = self.read_json(requeue_file)
+            if renamed_job.get("owner") == job.get("owner") and self.is_dead(requeue_file, job_id):
+                os.rename(requeue_file, self.job_file(self.PENDING, job_id))
+                requeued.append(job_id)
+            else:
+                #puts the job back, unless the new owner already replaced it
+                try:
+                    os.link(requeue_file, self.job_file(self.RUNNING, job_id))
+                except FileExistsError:
+                    pass
+                os.remove(requeue_file)
+        return requeued
+
+    def status(self):
+        """ returns a dictionary with the ids of the jobs in each state """
+        return {state: self.job_ids(state) for state in [self.PENDING, self.RUNNING, self.DONE, self.FAILED]}
+
+    def job(self, job_id, state):
+        """ returns the job dictionary of job_id, currently in state, or None if it's not there """
+        return self.read_json(self.job_file(state, job_id))
+
+    def progress(self, job_id):
+        """ returns the progress of job_id (log folder, steps done, and eventually the error), or None """
+        return self.read_json(self.progress_file(job_id))
+
+    #Methods that should only be used internally:
+
+    def job_ids(self, state):
+        """ returns the sorted ids of the jobs in state """
+        return sorted(file.stem for file in Path(os.path.join(self.queue_dir, state)).glob("*.json"))
+
+    def job_file(self, state, job_id):
+        return os.path.join(self.queue_dir, state, f"{job_id}.json")
+
+    def heartbeat_file(self, job_id):
+        return os.path.join(self.queue_dir, self.HEARTBEATS, f"{job_id}.json")
+
+    def progress_file(self, job_id):
+        return os.path.join(self.queue_dir, self.PROGRESS, f"{job_id}.json")
+
+    def requeue_files(self, job_id):
+        """ returns the files of job_id renamed by requeue_dead_jobs while checking it """
+        return [str(file) for file in Path(os.path.join(self.queue_dir, self.RUNNING)).glob(f"{job_id}.*.requeue")]
+
+    def is_dead(self, file, job_id):
+        """
+        returns True if the running job in file, claimed at the modification time of file, has no heartbeat
+        in the last dead_after seconds
+        """
+        try:
+            last_beat = os.path.getmtime(file)
+        except FileNotFoundError:
+            return False
+        #a heartbeat older than the claim time was left by a previous worker
+        heartbeat = self.read_json(self.heartbeat_file(job_id))
+        if heartbeat is not None:
+            last_beat = max(last_beat, heartbeat["time"])
+        return time.time() - last_beat > self.dead_after
+
+    def move_job(self, job_id, from_state, to_state):
+        """ atomically moves a job between states. Returns False if the job was not in from_state """
+        try:
+            os.rename(self.job_file(from_state, job_id), self.job_file(to_state, job_id))
+        except FileNotFoundError:
+            return False
+        #the modification time is used as claim time by requeue_dead_jobs
+        try:
+            os.utime(self.job_file(to_state, job_id))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def write_json(self, file, data):
+        """ writes data to file atomically, writing a temporary file and renaming it """
+        tmp_file = f"{file}.{socket.gethostname()}_{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f, default=lambda obj: obj.tolist())
+        os.replace(tmp_file, file)
+
+    def read_json(self, file):
+        """ returns the content of a json file, or None if it doesn't exist """
+        try:
+            with open(file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+class Worker(object):
+    """
+    Worker that trains the jobs of a JobQueue. The training is done in chunks ending at the multiples of
+    SAVE_STATE_STEPS, where the full state is saved: after each chunk the worker checks, with the owner token
+    written when it claimed the job, that the job is still its own (it could have been requeued and claimed by
+    another worker if the heartbeats were delayed). Otherwise it stops working on the job without touching the
+    queue: it doesn't write progress or heartbeats, move the job, or remove the heartbeat.
+
+    Args:
+        queue (JobQueue): the queue
+        heartbeat_interval (float): seconds between the heartbeats. Must be much smaller than queue.dead_after
+        data_dir (str): folder where the training sessions are saved. If None, the folder "data" in the queue folder
+    """
+    def __init__(self, queue, heartbeat_interval=30., data_dir=None):
+        self.queue = queue
+        self.heartbeat_interval = heartbeat_interval
+        self.data_dir = data_dir if data_dir is not None else os.path.join(queue.queue_dir, "data")
+        self.worker_id = f"{socket.gethostname()}_{os.getpid()}"
+
+    def run(self, max_jobs=None, wait=False):
+        """
+        Trains jobs until there are no pending jobs.
+
+        Args:
+            max_jobs (int): if specified, stops after this many jobs
+            wait (bool): if True, while there are running jobs it waits for them to be done or requeued, instead of
+                stopping when there are no pending jobs
+
+        Returns:
+            (list(str)): the ids of the jobs that were worked on
+        """
+        jobs = []
+        while max_jobs is None or len(jobs) < max_jobs:
+            self.queue.requeue_dead_jobs()
+            claim = self.queue.claim_job(self.worker_id)
+            if claim is None:
+                if wait and len(self.queue.job_ids(JobQueue.RUNNING)) > 0:
+                    time.sleep(self.heartbeat_interval)
+                    continue
+                break
+            job_id, owner = claim
+            self.work(job_id, owner)
+            jobs.append(job_id)
+        return jobs
+
+    def work(self, job_id, owner):
+        """
+        Trains job_id, which was claimed by this worker with the owner token owner, sending heartbeats meanwhile.
+        If the job is lost to another worker, the queue is left untouched.
+        """
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self.send_heartbeats, args=(job_id, owner, stop_heartbeat), daemon=True)
+        heartbeat.start()
+        try:
+            finished = self.train(job_id, owner)
+            if finished and self.queue.owns(job_id, owner):
+                self.queue.move_job(job_id, JobQueue.RUNNING, JobQueue.DONE)
+        except Exception:
+            if self.queue.owns(job_id, owner):
+                progress = dict(self.queue.progress(job_id) or {}, error=traceback.format_exc(), worker=self.worker_id)
+                self.queue.write_json(self.queue.progress_file(job_id), progress)
+                self.queue.move_job(job_id, JobQueue.RUNNING, JobQueue.FAILED)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            #the heartbeat of a job lost to another worker belongs to that worker
+            heartbeat_data = self.queue.read_json(self.queue.heartbeat_file(job_id))
+            if heartbeat_data is not None and heartbeat_data.get("owner") == owner:
+                try:
+                    os.remove(self.queue.heartbeat_file(job_id))
+                except FileNotFoundError:
+                    pass
+
+    def train(self, job_id, owner):
+        """
+        Trains job_id, creating a new training session, or loading the latest saved state if the job was requeued.
+
+        Args:
+            job_id (str): the job
+            owner (str): the owner token written when the job was claimed
+
+        Returns:
+            (bool): True if the job was completed, False if it was lost to another worker meanwhile
+        """
+        job = self.queue.job(job_id, JobQueue.RUNNING)
+        progress = self.queue.progress(job_id)
+        train = sac_tri.SacTrain()
+        if progress is not None and self.has_saved_state(progress["log_dir"]):
+            train.load_train(progress["log_dir"])
+        else:
+            train.SAVE_DATA_DIR = self.data_dir
+            env_class = getattr(sac_tri_envs_con, job["env_class"], None)
+            if env_class is None:
+                raise NameError(f"Environment named {job['env_class']} not found in sac_tri_envs_con")
+            train.initialize_new_train(env_class, job["env_params"], job["training_hyperparams"], job["log_info"])
+        if not self.queue.owns(job_id, owner):
+            return False
+        self.write_progress(job_id, train)
+
+        #train in chunks ending at the multiples of SAVE_STATE_STEPS, where the state is saved
+        save_steps = train.s.training_hyperparams["SAVE_STATE_STEPS"]
+        while train.s.steps_done < job["steps"]:
+            chunk = min(save_steps - train.s.steps_done % save_steps, job["steps"] - train.s.steps_done)
+            train.train(chunk, output_plots=False)
+            if train.s.steps_done % save_steps != 0:
+                train.save_full_state()
+            if not self.queue.owns(job_id, owner):
+                return False
+            self.write_progress(job_id, train)
+        return True
+
+    def send_heartbeats(self, job_id, owner, stop):
+        """
+        writes the heartbeat of job_id every heartbeat_interval seconds, until stop is set, or the job is lost
+        to another worker
+        """
+        while self.queue.owns(job_id, owner):
+            self.queue.write_json(self.queue.heartbeat_file(job_id), {"worker": self.worker_id, "owner": owner,
+                                                                       "time": time.time()})
+            if stop.wait(self.heartbeat_interval):
+                return
+
+    def write_progress(self, job_id, train):
+        """ writes the current log folder and steps done of job_id """
+        self.queue.write_json(self.queue.progress_file(job_id), {"log_dir": train.s.log_session.log_dir,
+                                "steps_done": train.s.steps_done, "worker": self.worker_id})
+
+    def has_saved_state(self, log_dir):
+        """ returns True if the training session in log_dir has a saved state that can be loaded """
+        state_dir = Path(os.path.join(log_dir, sac_tri.SacTrain.STATE_FOLDER_NAME))
+        return state_dir.is_dir() and any(folder.is_dir() for folder in state_dir.iterdir())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a worker training the jobs of a shared-filesystem queue.")
+    parser.add_argument("queue_dir", type=str, help="folder of the queue")
+    parser.add_argument("--data-dir", type=str, default=None, help="folder where the training sessions are saved")
+    parser.add_argument("--heartbeat", type=float, default=30., help="seconds between heartbeats")
+    parser.add_argument("--dead-after", type=float, default=600., help="seconds after which a silent job is requeued")
+    parser.add_argument("--wait", action="store_true", help="wait for running jobs that could be requeued")
+    args = parser.parse_args()
+    worker = Worker(JobQueue(args.queue_dir, args.dead_after), args.heartbeat, args.data_dir)
+    done = worker.run(wait=args.wait)
+    print(f"Worker {worker.worker_id} worked on {len(done)} jobs")
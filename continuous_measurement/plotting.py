@@ -6,9 +6,10 @@ import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.animation as ani
 import matplotlib.gridspec as gridspec
+from matplotlib.collections import LineCollection
 from pathlib import Path
-from IPython import display
-from IPython.display import Video
+import warnings
+import concurrent.futures
 
 import sys
 sys.path.append(os.path.join('..','lib'))
@@ -17,6 +18,10 @@ import sac_tri
 #some constants
 ANIMATION_DIR_NAME = "anims"
 PLOT_DIR_NAME = "plots" 
+LOG_CACHE_DIR_NAME = ".log_cache"
+#if True, the parsed log files are cached (see cached_log_file_data). It's turned on by build_figures and when
+#this module is run as a script, but not during training, where the log files change at every log
+USE_LOG_CACHE = False
 
 """
 This module contains functions to visualize data that was logged with sac.SacTrain and by
@@ -34,12 +39,18 @@ def plot_sac_logs(log_dir, is_tri=False, actions_per_log=1000, running_reward_fi
     and the last chosen actions. This function can also save the plot to .pdf in the PLOT_DIR_NAME folder
 
     Args:
-        log_dir (str): location of the folder with all the logging
+        log_dir (str): location of the folder with all the logging. It can be None if all the data is passed in
+            as numpy arrays (in which case save_plot must be False)
         is_tri (bool): if the logged data has the discrete action (True) or not (False)
         actions_per_log (int): number of actions taken between logs. Corresponds to LOG_STEPS hyperparam while training
-        running_reward_file (str): location of the txt file with the running reward. If None, default location is used
-        running_loss_file (str): location of the txt file with the loss function. If None, default location is used
-        actions_file (str): location of the txt file with the actions. If None, default location is used
+        running_reward_file (str or np.array): location of the txt file with the running reward, or the running reward
+            as a numpy array. If None, default location is used
+        running_loss_file (str or np.array): location of the txt file with the loss function, or the loss function
+            as a numpy array. If None, default location is used
+        running_multi_obj_file (str or np.array): location of the txt file with the running multi objectives, or the
+            running multi objectives as a numpy array. If None, default location is used
+        actions_file (str or np.array): location of the txt file with the actions, or the actions as a numpy array.
+            If None, default location is used
         actions_to_plot (int): how many of the last actions to show
         plot_to_file_lin (int): plots logs only up to a given file line. In None, all data is used
         suppress_show (bool): if True, it won't display the plot
@@ -54,10 +65,10 @@ def plot_sac_logs(log_dir, is_tri=False, actions_per_log=1000, running_reward_fi
                         sac_logs_file_location(log_dir, is_tri, running_reward_file, running_loss_file,
                                                  running_multi_obj_file, actions_file)
     
-    #i check if the files exist
-    running_reward_exists = Path(running_reward_file).exists()
-    running_loss_exists = Path(running_loss_file).exists()
-    actions_exists = Path(actions_file).exists()
+    #i check if the files exist (or if the data was passed in as arrays)
+    running_reward_exists = log_data_exists(running_reward_file)
+    running_loss_exists = log_data_exists(running_loss_file)
+    actions_exists = log_data_exists(actions_file)
     running_multi_obj_quantities = count_quantities(running_multi_obj_file)
     loss_elements = count_quantities(running_loss_file)
     
@@ -107,11 +118,65 @@ def plot_sac_logs(log_dir, is_tri=False, actions_per_log=1000, running_reward_fi
     
     #display the plot if requested
     if not suppress_show:
+        from IPython import display
         if not dont_clear_output:
             display.clear_output(wait=True)
         display.display(plt.gcf())
     plt.close() 
 
+def save_sac_logs_plots(log_dirs, actions_to_plot=80, extra_str="", processes=1):
+    """
+    Saves the plot of the running reward, the loss function and the last chosen actions of one or more
+    training sessions as a pdf in the PLOT_DIR_NAME folder of each session, without displaying it.
+    It is meant to plot offline the logs of trainings done in headless mode. It can also be run as
+    "python plotting.py log_dir [log_dir ...]".
+
+    Args:
+        log_dirs (list(str)): locations of the folders with the logging. If a folder doesn't contain a
+            training session, all the training sessions in its subfolders are plotted
+        actions_to_plot (int): how many of the last actions to show
+        extra_str (str): string to append to the file name of the saved plots
+        processes (int): number of processes used to make the plots (see build_figures). If None, the number of CPUs
+
+    Returns:
+        plotted_dirs (list(str)): the log folders that were plotted
+    """
+    plotted_dirs = []
+    for log_dir in log_dirs:
+        #if log_dir is not a training session, i plot the training sessions in it
+        if Path(os.path.join(log_dir, sac_tri.SacTrain.PARAMS_FILE_NAME)).exists():
+            session_dirs = [log_dir]
+        else:
+            session_dirs = sorted(str(path.parent) for path in Path(log_dir).glob(f"*/{sac_tri.SacTrain.PARAMS_FILE_NAME}"))
+        plotted_dirs += session_dirs
+    figures = [(plot_sac_logs, (session_dir,), {"is_tri": True, "actions_to_plot": actions_to_plot,
+                "suppress_show": True, "save_plot": True, "extra_str": extra_str}) for session_dir in plotted_dirs]
+    if processes == 1:
+        for function, args, kwargs in figures:
+            function(*args, **kwargs)
+    else:
+        build_figures(figures, processes)
+    return plotted_dirs
+
+def build_figures(figures, processes=None):
+    """
+    Makes many figures in parallel in a pool of processes, e.g. to produce again all the panels of the paper after
+    changing their style. Each figure is made calling a plotting function that saves it to file (e.g. sac_paper_plot
+    with plot_file_name, or plot_sac_logs with save_plot=True). Nothing is displayed. The log files are read through
+    the cache of load_log_data, so they are only parsed the first time.
+
+    Args:
+        figures (list(tuple)): the figures to make. Each one is a tuple (function, args, kwargs), and the figure is
+            made calling function(*args, **kwargs). The function must be defined at the top level of a module
+        processes (int): number of processes. If None, the number of CPUs
+
+    Returns:
+        (list): the values returned by the plotting functions, in the same order as figures
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=initialize_figure_process) as pool:
+        futures = [pool.submit(build_figure, function, args, kwargs) for function, args, kwargs in figures]
+        return [future.result() for future in futures]
+
 def sac_paper_plot(log_dir, det_policy_sublocation,act_0,act_1,act_2,is_tri,actions_to_plot_large=10,
                     actions_to_plot_small = 100,actions_per_log = 6000, custom_colors=None,prot_linewidth=2.7,
                     reward_linewidth = None,plot_file_name = None,small_action_ylim=None,large_action_ylim=None,
@@ -243,10 +308,10 @@ def animate_sac_plot_logs(log_dir, is_tri=False, actions_per_log=6000, running_r
     running_reward_file, running_loss_file, actions_file = \
                         sac_logs_file_location(log_dir, is_tri, running_reward_file, running_loss_file, actions_file)
     
-    #i check if the files exist
-    running_reward_exists = Path(running_reward_file).exists()
-    running_loss_exists = Path(running_loss_file).exists()
-    actions_exists = Path(actions_file).exists()
+    #i check if the files exist (or if the data was passed in as arrays)
+    running_reward_exists = log_data_exists(running_reward_file)
+    running_loss_exists = log_data_exists(running_loss_file)
+    actions_exists = log_data_exists(actions_file)
 
     #count the number of plots
     quantities_to_log = int(running_reward_exists) + 2*int(running_loss_exists) + int(actions_exists)
@@ -278,7 +343,8 @@ def animate_sac_plot_logs(log_dir, is_tri=False, actions_per_log=6000, running_r
 
     #show the video if requested
     if not suppress_show:
-        display.display(Video(anim_file_name))
+        from IPython import display
+        display.display(display.Video(anim_file_name))
 
 #functions mainly used internally
 
@@ -300,6 +366,10 @@ def sac_logs_file_location(log_dir, is_tri, running_reward_file, running_loss_fi
         actions_file (str): location of actions file
     """
 
+    #if there is no logging folder (the data is passed in directly), there are no default locations
+    if log_dir is None:
+        return (running_reward_file, running_loss_file, running_multi_obj_file, actions_file)
+
     sac_module = sac_tri
     if running_reward_file is None:
         running_reward_file = os.path.join(log_dir, sac_module.SacTrain.RUNNING_REWARD_FILE_NAME)
@@ -345,7 +415,7 @@ def plot_running_reward_on_axis(file_location, axis, plot_to_file_line = None,yl
     Produces a plot of the running reward on a given matplot lib axis
 
     Args:
-        file_location (str): location of the file with the running reward
+        file_location (str or np.array): location of the file with the running reward, or the data as a numpy array
         axis (matplotlib axis): the axis on which to do the plot
         plot_to_file_line (int): plot data up to this file line. If None, plots till the end
         ylabel (str): custom string for y axis
@@ -374,7 +444,7 @@ def plot_running_reward_on_axis(file_location, axis, plot_to_file_line = None,yl
     if xlabel is None:
         xlabel = "step"
     #load the data
-    plot_data = np.loadtxt(file_location).reshape(-1,2)
+    plot_data = load_log_data(file_location).reshape(-1,2)
     if lines_to_mark is not None:
         points_to_mark = plot_data[lines_to_mark]
     if plot_to_file_line is not None:
@@ -412,12 +482,12 @@ def plot_running_multi_obj_on_axes(file_location, axes, plot_to_file_line = None
     axes must contain the correct number of axis.
 
     Args:
-        file_location (str): location of the file with the running reward
+        file_location (str or np.array): location of the file with the running reward, or the data as a numpy array
         axes (matplotlib axis): list of axis for each objective
         plot_to_file_line (int): plot data up to this file line. If None, plots till the end
     """
     #load the data
-    plot_data = np.loadtxt(file_location)
+    plot_data = load_log_data(file_location)
     if len(plot_data.shape) == 1:
         plot_data = plot_data.reshape(1,-1)
     if plot_to_file_line is not None:
@@ -435,13 +505,13 @@ def plot_running_loss_on_axis(file_location, axes, plot_to_file_line = None,is_t
     """
     Produces a plot of the running losses on the 2 given matplot lib axis
     Args:
-        file_location (str): location of the file with the running loss
+        file_location (str or np.array): location of the file with the running loss, or the data as a numpy array
         axis1 (matplotlib axis): the axis on which to do the first loss function
         axis2 (matplotlib axis): the axis on which to do the second loss function
         plot_to_file_lin (int): plot data up to this file line. If None, plots till the end
     """
     #load data
-    plot_data = np.loadtxt(file_location).reshape(-1,len(axes)+1)
+    plot_data = load_log_data(file_location).reshape(-1,len(axes)+1)
     if plot_to_file_line is not None:
         plot_data = plot_data[:plot_to_file_line+1]
     #plot q loss on first axis
@@ -501,7 +571,7 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
     Produces a plot of the last chosen actions on a given matplot lib axis
 
     Args:
-        file_location (str): location of the file with the actions
+        file_location (str or np.array): location of the file with the actions, or the data as a numpy array
         axis (matplotlib axis): the axis on which to do the plot
         actions_to_plot (int): how many actions to display in the plot
         plot_to_file_line (int): plot data up to this file line. If None, plots till the end
@@ -562,7 +632,7 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
     axis.ticklabel_format(useOffset=False)
 
     #load data
-    plot_data = np.loadtxt(file_location)
+    plot_data = load_log_data(file_location)
     if plot_to_file_line is None:
         plot_to_file_line = plot_data.shape[0]-1
     plot_to_file_line = min(plot_to_file_line,plot_data.shape[0]-1)
@@ -580,19 +650,17 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
     if is_tri:
         if line_style == "constant":
             #load colors
-            tri_colors = [next_color(color_iter),next_color(color_iter),next_color(color_iter)]
+            tri_colors = next_colors(color_iter, 3)
             #compute the step to draw the length of the last point
             dt = data_to_plot[-1,0] - data_to_plot[-2,0]
             #first I do the vertical dahsed line, so they get covered
             if not hide_gray_vertical_line:
-                for i in range(data_to_plot.shape[0]-1):
-                    axis.plot([data_to_plot[i+1,0],data_to_plot[i+1,0]],[data_to_plot[i,2],data_to_plot[i+1,2]], color="lightgray",
-                            linewidth=0.8)
-            #horizontal lines
+                add_vertical_connectors(axis, data_to_plot[:,0], data_to_plot[:,2])
+            #horizontal lines, colored according to the discrete action
             data_to_plot = np.concatenate( (data_to_plot, np.array([[data_to_plot[-1,0]+dt,0.,0.]]) ))
-            for i in range(data_to_plot.shape[0]-1):   
-                    axis.plot([data_to_plot[i,0],data_to_plot[i+1,0]],[data_to_plot[i,2],data_to_plot[i,2]], 
-                                color=tri_colors[nearest_int(data_to_plot[i,1])], linewidth=linewidth)
+            segment_colors = [tri_colors[i] for i in np.rint(data_to_plot[:-1,1]).astype(int)]
+            add_line_collection(axis, segments_between(data_to_plot[:-1,0], data_to_plot[:-1,2], data_to_plot[1:,0],
+                                data_to_plot[:-1,2]), segment_colors, linewidth=linewidth)
         elif line_style == "scatter":
             tri_act_data = data_to_plot[:,1]
             zero_mask = np.abs(tri_act_data) < 0.00001
@@ -607,26 +675,30 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
                 axis.scatter(two_data[:,0],two_data[:,i], color = next_color(color_iter),s=linewidth)
         elif line_style == "plot":
             #assume only one continuous action
-            last_daction = int(data_to_plot[0,1])
-            last_i = 0
-            three_colors = [next_color(color_iter) for _ in range(3)]
-            for i in range(data_to_plot.shape[0]):
-                new_daction = int(data_to_plot[i,1])
-                if new_daction != last_daction or i ==data_to_plot.shape[0]-1:
-                    x_vals = data_to_plot[last_i:i,0]
-                    y_vals = data_to_plot[last_i:i,2]
-                    if x_vals.shape[0]>1:
-                        axis.plot(x_vals,y_vals,linewidth=linewidth, color = three_colors[last_daction])
-                    else:
-                        axis.scatter(x_vals,y_vals,s=40, color = three_colors[last_daction])
-                    last_daction = new_daction
-                    last_i = i
+            three_colors = next_colors(color_iter, 3)
+            dactions = data_to_plot[:,1].astype(int)
+            #each run of equal discrete actions is joined by a line. A run ends where the discrete action changes,
+            #or at the last point (which is not included in any run)
+            run_ends = np.unique(np.append(np.flatnonzero(dactions[1:] != dactions[:-1]) + 1, data_to_plot.shape[0]-1))
+            run_starts = np.concatenate(([0], run_ends[:-1]))
+            lines, line_colors, dot_indices = [], [], []
+            for start, end in zip(run_starts, run_ends):
+                if end-start > 1:
+                    lines.append(data_to_plot[start:end][:,[0,2]])
+                    line_colors.append(three_colors[dactions[start]])
+                elif end-start == 1:
+                    #runs with a single action are represented by a dot
+                    dot_indices.append(start)
+            add_line_collection(axis, lines, line_colors, linewidth=linewidth)
+            #the dots are drawn with one scatter per discrete action
+            dot_indices = np.array(dot_indices, dtype=int)
+            for i in np.unique(dactions[dot_indices]):
+                dots = data_to_plot[dot_indices[dactions[dot_indices] == i]]
+                axis.scatter(dots[:,0],dots[:,2],s=40, color = three_colors[i])
         elif line_style == "scatter_plot":
             dt = data_to_plot[-1,0] - data_to_plot[-2,0]
             #first I do the vertical dahsed line, so they get covered
-            for i in range(data_to_plot.shape[0]-1):
-                axis.plot([data_to_plot[i+1,0],data_to_plot[i+1,0]],[data_to_plot[i,2],data_to_plot[i+1,2]], color="lightgray",
-                        linewidth=0.8)
+            add_vertical_connectors(axis, data_to_plot[:,0], data_to_plot[:,2])
             tri_act_data = data_to_plot[:,1]
             zero_mask = np.abs(tri_act_data) < 0.00001
             one_mask = np.abs(tri_act_data-1.) < 0.00001
@@ -643,19 +715,16 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
     #main plotting if there is only a continuous action
     else:
         if line_style == "constant":
-            color = next_color(color_iter)
+            color = next_colors(color_iter, 1)[0]
             #compute the step to draw the length of the last point
             dt = data_to_plot[-1,0] - data_to_plot[-2,0]
             #first I do the vertical dahsed line, so they get covered
             if not hide_gray_vertical_line:
-                for i in range(data_to_plot.shape[0]-1):
-                    axis.plot([data_to_plot[i+1,0],data_to_plot[i+1,0]],[data_to_plot[i,1],data_to_plot[i+1,1]], color="lightgray",
-                        linewidth=0.8)
+                add_vertical_connectors(axis, data_to_plot[:,0], data_to_plot[:,1])
             #horizontal lines
             data_to_plot = np.concatenate( (data_to_plot, np.array([[data_to_plot[-1,0]+dt,0.]]) ))
-            for i in range(data_to_plot.shape[0]-1):  
-                axis.plot([data_to_plot[i,0],data_to_plot[i+1,0]],[data_to_plot[i,1],data_to_plot[i,1]], color=color, linewidth=linewidth,
-                        solid_capstyle = "butt")
+            add_line_collection(axis, segments_between(data_to_plot[:-1,0], data_to_plot[:-1,1], data_to_plot[1:,0],
+                                data_to_plot[:-1,1]), color, linewidth=linewidth, capstyle="butt")
         elif line_style == "scatter":
             for i in range(1,data_to_plot.shape[1]):
                 axis.scatter(data_to_plot[:,0],data_to_plot[:,i], color = next_color(color_iter),s=linewidth)
@@ -664,9 +733,7 @@ def plot_actions_on_axis(file_location, axis, actions_to_plot=1200, plot_to_file
         elif line_style == "scatter_plot":
             dt = data_to_plot[-1,0] - data_to_plot[-2,0]
             #first I do the vertical dahsed line, so they get covered
-            for i in range(data_to_plot.shape[0]-1):
-                axis.plot([data_to_plot[i+1,0],data_to_plot[i+1,0]],[data_to_plot[i,1],data_to_plot[i+1,1]], color="lightgray",
-                    linewidth=0.8)
+            add_vertical_connectors(axis, data_to_plot[:,0], data_to_plot[:,1])
             for i in range(1,data_to_plot.shape[1]):
                 axis.scatter(data_to_plot[:,0],data_to_plot[:,i], color = next_color(color_iter),s=linewidth,zorder=100) 
         else:
@@ -731,10 +798,134 @@ def num_to_k_notation(tick, tex=True):
     tick_str += "k"
     return tick_str
 
+def load_log_data(data):
+    """
+    Returns logged data as a numpy array. data can be the location of a txt file with the data
+    (as written by sac_tri.SacTrain), or the data itself as a numpy array (or list of rows). In the
+    latter case a copy is returned, so the plotting functions don't modify the data passed in.
+    If USE_LOG_CACHE, files are read with cached_log_file_data.
+
+    Args:
+        data (str or np.array): location of the file with the data, or the data itself
+    """
+    if isinstance(data, (str, os.PathLike)):
+        if USE_LOG_CACHE:
+            return cached_log_file_data(data)
+        return np.loadtxt(data)
+    return np.array(data, dtype=np.float64)
+
+def cached_log_file_data(file):
+    """
+    Returns the data of a txt log file as a numpy array, parsing it only if it changed since it was last parsed.
+    The parsed array is saved as a binary .npy file in the folder LOG_CACHE_DIR_NAME next to the log file, named
+    with the name, size and modification time of the log file, so a log file that is appended to during training
+    is parsed again. If the cache can't be written (e.g. in a read only folder), the file is just parsed.
+
+    Args:
+        file (str): location of the txt file with the data
+
+    Returns:
+        (np.array): the data, as returned by np.loadtxt
+    """
+    file = Path(file)
+    stat = file.stat()
+    cache_dir = file.parent / LOG_CACHE_DIR_NAME
+    cache_file = cache_dir / f"{file.name}.{stat.st_size}_{stat.st_mtime_ns}.npy"
+    if cache_file.exists():
+        return np.load(cache_file)
+    data = np.loadtxt(file)
+    try:
+        cache_dir.mkdir(exist_ok=True)
+        #remove the cache of the previous versions of the file
+        for old_cache_file in cache_dir.glob(f"{file.name}.*.npy"):
+            old_cache_file.unlink(missing_ok=True)
+        #the cache is written to a temporary file and renamed, so other processes never read it partially written
+        tmp_file = cache_dir / f"{cache_file.name}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return data
+
+def log_data_exists(data):
+    """ returns True if data is a numpy array (or list), or the location of an existing file """
+    if data is None:
+        return False
+    if isinstance(data, (str, os.PathLike)):
+        return Path(data).exists()
+    return True
+
+def initialize_figure_process():
+    """
+    initializes a process of build_figures: no display is used, so the figures are not shown, and the parsed
+    log files are cached
+    """
+    global USE_LOG_CACHE
+    USE_LOG_CACHE = True
+    matplotlib.use("Agg")
+    warnings.filterwarnings("ignore", message=".*non-interactive.*")
+
+def build_figure(function, args, kwargs):
+    """ makes a figure in a process of build_figures, calling function(*args, **kwargs), and closes it """
+    try:
+        return function(*args, **kwargs)
+    finally:
+        plt.close("all")
+
 def nearest_int(num):
     """ return the nearest integer to the float number num """
     return int(np.round(num))
 
+def next_colors(color_iterator, n):
+    """
+    Returns a list with the next n colors of color_iterator. If color_iterator is None, it returns
+    the first n colors of the matplotlib property cycle.
+
+    Args:
+        color_iterator(iterator): None or an iterator of colors
+        n (int): number of colors to return
+    """
+    if color_iterator is None:
+        cycle_colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+        return [cycle_colors[i % len(cycle_colors)] for i in range(n)]
+    else:
+        return [next(color_iterator) for _ in range(n)]
+
+def segments_between(x_start, y_start, x_end, y_end):
+    """ returns an array with shape (n,2,2) with the n segments from (x_start,y_start) to (x_end,y_end) """
+    return np.stack([np.column_stack([x_start, y_start]), np.column_stack([x_end, y_end])], axis=1)
+
+def add_line_collection(axis, lines, colors, linewidth=None, capstyle=None, zorder=2):
+    """
+    Draws many lines on an axis as a single LineCollection. It looks like calling axis.plot once per line,
+    but it is much faster to draw when there are many lines.
+
+    Args:
+        axis (matplotlib axis): the axis on which to draw the lines
+        lines: array with shape (n,2,2) (e.g. from segments_between), or list of (k,2) arrays with the points of each line
+        colors: a single color, or a list with the color of each line
+        linewidth (float): width of the lines. If None, the default width of lines is used
+        capstyle (str): cap style of the lines. If None, the default cap style of lines is used
+        zorder (float): the zorder of the lines. The default is the same as lines produced by axis.plot
+
+    Returns:
+        (LineCollection): the collection added to the axis
+    """
+    if linewidth is None:
+        linewidth = matplotlib.rcParams["lines.linewidth"]
+    if capstyle is None:
+        capstyle = matplotlib.rcParams["lines.solid_capstyle"]
+    collection = LineCollection(lines, colors=colors, linewidths=linewidth, capstyle=capstyle,
+                                joinstyle=matplotlib.rcParams["lines.solid_joinstyle"], zorder=zorder)
+    axis.add_collection(collection)
+    axis.autoscale_view()
+    return collection
+
+def add_vertical_connectors(axis, x_vals, y_vals):
+    """ draws the thin gray vertical lines connecting the actions y_vals[i] and y_vals[i+1] at x_vals[i+1] """
+    add_line_collection(axis, segments_between(x_vals[1:], y_vals[:-1], x_vals[1:], y_vals[1:]), "lightgray", linewidth=0.8)
+
 def next_color(color_iterator):
     """
     It returns the next color if a non Non iterator is passed in. Otherwise
@@ -855,13 +1046,13 @@ def get_number_lines(running_reward_file, running_loss_file, action_count_file):
         lines (int): number of lines in the file
      """
     if Path(running_reward_file).exists():
-        data = np.loadtxt(running_reward_file).reshape(-1,2)
+        data = load_log_data(running_reward_file).reshape(-1,2)
         return data.shape[0]
     if Path(running_loss_file).exists():
-        data = np.loadtxt(running_loss_file).reshape(-1,2)
+        data = load_log_data(running_loss_file).reshape(-1,2)
         return data.shape[0]
     if Path(action_count_file).exists():
-        data = np.loadtxt(action_count_file).reshape(-1,2)
+        data = load_log_data(action_count_file).reshape(-1,2)
         return data.shape[0]
     raise NameError("No files to count lines")
 
@@ -872,17 +1063,32 @@ def count_quantities(running_multi_obj_file):
     return 0.
     
     Args:
-        running_multi_obj_file (str): file location
+        running_multi_obj_file (str or np.array): file location, or the data as a numpy array
 
     Returns:
         quantities (int): number of quantities
     """
-    if Path(running_multi_obj_file).exists():
-        loaded_data = np.loadtxt(running_multi_obj_file)
+    if log_data_exists(running_multi_obj_file):
+        loaded_data = load_log_data(running_multi_obj_file)
         if len(loaded_data.shape) == 1:
             quantities = loaded_data.shape[0] - 1
         else:
             quantities = loaded_data.shape[1] - 1
     else:
         quantities = 0
-    return quantities
\ No newline at end of file
+    return quantities
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Saves the plots of the logs of training sessions as pdf files.")
+    parser.add_argument("log_dirs", nargs="+", help="training session folders, or folders containing them")
+    parser.add_argument("--actions-to-plot", type=int, default=80, help="how many of the last actions to show")
+    parser.add_argument("--extra-str", type=str, default="", help="string to append to the file name of the plots")
+    parser.add_argument("--processes", type=int, default=1, help="number of processes making the plots")
+    args = parser.parse_args()
+    #no display is needed to save the plots
+    matplotlib.use("Agg")
+    USE_LOG_CACHE = True
+    for plotted_dir in save_sac_logs_plots(args.log_dirs, actions_to_plot=args.actions_to_plot, extra_str=args.extra_str,
+                                                processes=args.processes):
+        print(f"Saved plot of {plotted_dir}")
@@ -9,11 +9,51 @@ from __future__ import print_function
 import gym
 import numpy as np
 import dataclasses
-import random
 import scipy.linalg as sci
 from scipy.special import xlogy
 import os
 
+#torch is only used by the Torch environments, so it is imported by import_torch() the first time it is needed
+torch = None
+
+def import_torch():
+    """ imports torch (if it wasn't already imported) as the module variable torch, and returns it """
+    global torch
+    if torch is None:
+        import torch as torch_module
+        torch = torch_module
+    return torch
+
+def rng_from_env_params(env_params):
+    """
+    Returns the numpy.random.Generator from which an environment draws all its random numbers. It is seeded
+    with env_params["seed"], so an environment is reproducible if the seed is specified. If env_params has
+    no "seed", or it is None, the generator is seeded with fresh entropy from the OS.
+
+    Args:
+        env_params (dict): the parameters of the environment
+
+    Returns:
+        (numpy.random.Generator): the random number generator
+    """
+    return np.random.default_rng(env_params.get("seed", None))
+
+def spawn_env_params(env_params, n):
+    """
+    Returns n copies of env_params whose "seed" entries generate independent random streams, e.g. to
+    initialize the environments of parallel workers. The seeds are spawned from env_params["seed"],
+    so they are reproducible if it is specified.
+
+    Args:
+        env_params (dict): the parameters of the environment
+        n (int): number of copies
+
+    Returns:
+        (list(dict)): the n copies of env_params, each one with its own "seed"
+    """
+    children = np.random.SeedSequence(env_params.get("seed", None)).spawn(n)
+    return [dict(env_params, seed=int(child.generate_state(1, np.uint64)[0])) for child in children]
+
 
 """
 This module contains gym.Env environments that can be trained using sac.SacTrain. We implemented a single bath
@@ -21,10 +61,17 @@ diagonal qubit (operated e.g. as a heater), and the coherent qubit fridge.
 These environments, besides being proper gym.Env, MUST satisfy these additional requirements:
     1) __init__ must accept a single dict with all the parameters necessary to define the environment.
     2) implement set_current_state(state). Functions that takes a state as input, and sets the environment to that state
+Optionally, they can implement step_fast(d_act, u_act, obs), a version of step() that doesn't check the action and
+writes the new state into obs. When available, it is used by sac_tri.SacTrain.train() and extra.test_policy().
 
 If the environment is multiobjective, the reward will be the convex combination that is intended to be 
 optimized. However, the individual objectives must be returd in the info dictionry of step() (see gym.Env), as a numpy
 array with key "multi_obj".
+
+The BatchedTwoLevelDemonCon subclasses are batched counterparts of the TwoLevelDemonConPowDiss classes, evolving
+many replicas at once.
+TorchTwoLevelBosonicFeedbackDemonPowDissContMeas is a torch implementation of TwoLevelBosonicFeedbackDemonPowDissContMeas,
+which takes and returns torch tensors.
 """
 
 #1
@@ -76,6 +123,8 @@ class TwoLevelDemonConPowDissX(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -105,11 +154,29 @@ class TwoLevelDemonConPowDissX(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -120,9 +187,6 @@ class TwoLevelDemonConPowDissX(gym.Env):
         gam_ge = self.g0 * (-1+np.exp(self.b0 * self.e0))**(-1)
         gsig = gam_eg + gam_ge
         
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
     
 
         #initialize null multi objectives
@@ -155,10 +219,8 @@ class TwoLevelDemonConPowDissX(gym.Env):
             prb0 = (1-sx_av)/2
             prb1 = (1+sx_av)/2
             if prb0 >= 0 and prb1 >= 0:
-                dis1 = np.random.normal(-1,np.sqrt(self.tau/self.dt),10000)
-                dis2 = np.random.normal(1,np.sqrt(self.tau/self.dt),10000)
-                elements = [dis1,dis2]
-                rr = np.random.choice(elements[np.random.choice([0,1],p=[prb0,prb1])])
+                #the outcome is gaussian, centered in -1 or +1 with probability prb0 or prb1
+                rr = (1. if self.rng.random() < prb1 else -1.) + np.sqrt(self.tau/self.dt)*self.rng.standard_normal()
                 rr_pow = np.linalg.matrix_power((rr*iden-sigmax),2)
                 mpl = ((self.dt/(2*np.pi*self.tau))**(1/4))*sci.expm(-0.25*(self.dt/self.tau)*rr_pow)
                 prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl))    
@@ -185,9 +247,9 @@ class TwoLevelDemonConPowDissX(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -211,10 +273,14 @@ class TwoLevelDemonConPowDissX(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -276,6 +342,8 @@ class TwoLevelDemonConPowDissZ(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -305,11 +373,29 @@ class TwoLevelDemonConPowDissZ(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -320,9 +406,6 @@ class TwoLevelDemonConPowDissZ(gym.Env):
         gam_ge = self.g0 * (-1+np.exp(self.b0 * self.e0))**(-1)
         gsig = gam_eg + gam_ge
         
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
     
 
         #initialize null multi objectives
@@ -354,10 +437,8 @@ class TwoLevelDemonConPowDissZ(gym.Env):
             prb0 = (1-sx_av)/2
             prb1 = (1+sx_av)/2
             if prb0 >= 0 and prb1 >= 0:
-                dis1 = np.random.normal(-1,np.sqrt(self.tau/self.dt),10000)
-                dis2 = np.random.normal(1,np.sqrt(self.tau/self.dt),10000)
-                elements = [dis1,dis2]
-                rr = np.random.choice(elements[np.random.choice([0,1],p=[prb0,prb1])])
+                #the outcome is gaussian, centered in -1 or +1 with probability prb0 or prb1
+                rr = (1. if self.rng.random() < prb1 else -1.) + np.sqrt(self.tau/self.dt)*self.rng.standard_normal()
                 rr_pow = np.linalg.matrix_power((rr*iden-sigmaz),2)
                 mpl = ((self.dt/(2*np.pi*self.tau))**(1/4))*sci.expm(-0.25*(self.dt/self.tau)*rr_pow)
                 prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl))   
@@ -382,9 +463,9 @@ class TwoLevelDemonConPowDissZ(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -408,10 +489,14 @@ class TwoLevelDemonConPowDissZ(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -473,6 +558,8 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -502,11 +589,29 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -517,9 +622,6 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
         gam_ge = self.g0 * (-1+np.exp(self.b0 * self.e0))**(-1)
         gsig = gam_eg + gam_ge
         
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
     
 
         #initialize null multi objectives
@@ -561,10 +663,8 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
             prb0 = (1-sx_av)/2
             prb1 = (1+sx_av)/2
             if prb0 >= 0 and prb1 >= 0:
-                dis1 = np.random.normal(-1,np.sqrt(self.tau/self.dt),10000)
-                dis2 = np.random.normal(1,np.sqrt(self.tau/self.dt),10000)
-                elements = [dis1,dis2]
-                rr = np.random.choice(elements[np.random.choice([0,1],p=[prb0,prb1])])
+                #the outcome is gaussian, centered in -1 or +1 with probability prb0 or prb1
+                rr = (1. if self.rng.random() < prb1 else -1.) + np.sqrt(self.tau/self.dt)*self.rng.standard_normal()
                 rr_pow = np.linalg.matrix_power((rr*iden-sigma),2)
                 mpl = ((self.dt/(2*np.pi*self.tau))**(1/4))*sci.expm(-0.25*(self.dt/self.tau)*rr_pow)
                 prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl))    
@@ -590,9 +690,9 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -616,10 +716,14 @@ class TwoLevelDemonConPowDissTheta(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -668,6 +772,8 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
         
 
         #set the observation and action spaces
@@ -697,15 +803,29 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-        
-        #load action 
-        d_act = action[0]
-        u_act = action[1][0]
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
 
         #initialize null multi objectives
         pow = 0.
@@ -731,10 +851,8 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
             prb0 = (1-sx_av)/2
             prb1 = (1+sx_av)/2
             if prb0 >= 0 and prb1 >= 0:
-                dis1 = np.random.normal(-1,np.sqrt(self.tau/self.dt),10000)
-                dis2 = np.random.normal(1,np.sqrt(self.tau/self.dt),10000)
-                elements = [dis1,dis2]
-                rr = np.random.choice(elements[np.random.choice([0,1],p=[prb0,prb1])])
+                #the outcome is gaussian, centered in -1 or +1 with probability prb0 or prb1
+                rr = (1. if self.rng.random() < prb1 else -1.) + np.sqrt(self.tau/self.dt)*self.rng.standard_normal()
                 rr_pow = np.linalg.matrix_power((rr*iden-sigmaz),2)
                 mpl = ((self.dt/(2*np.pi*self.tau))**(1/4))*sci.expm(-0.25*(self.dt/self.tau)*rr_pow)
                 prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl))   
@@ -752,9 +870,9 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
         #compute reward
         reward = self.a*pow - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([pow, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(pow), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -773,11 +891,15 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.p, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1] = self.state.p, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
         #set initial population to average temperature and choose random action b
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         
         #set the 2 state variables
         self.state.p = self.peq( self.de(random_u) ,self.b)
@@ -817,4 +939,384 @@ class TwoLevelBosonicFeedbackDemonPowDissContMeas(gym.Env):
     
     
     
-    
\ No newline at end of file
+    
+
+
+
+class TorchTwoLevelBosonicFeedbackDemonPowDissContMeas(object):
+    """
+    Torch implementation of TwoLevelBosonicFeedbackDemonPowDissContMeas that evolves num_envs replicas at once. The actions
+    are passed, and the states, rewards and multi objectives are returned, as torch tensors on device, so that a
+    rollout (e.g. in sac_tri.SacTrain.train_vectorized) stays inside torch without conversions to numpy.
+    The actions are not checked to be in bound, since it would require a synchronization with the host.
+
+    Args:
+        env_params (dict): the parameters of TwoLevelBosonicFeedbackDemonPowDissContMeas
+        num_envs (int): number of replicas
+        seed (int): seed of the torch random number generator used for the measurements and the resets. If None,
+            env_params["seed"] is used
+        device (torch.device): device where the state is stored. Defaults to cpu
+    """
+
+    single_env_class = TwoLevelBosonicFeedbackDemonPowDissContMeas
+    torch_native = True
+
+    def __init__(self, env_params, num_envs, seed=None, device=None):
+        import_torch()
+        self.num_envs = num_envs
+        self.device = torch.device("cpu") if device is None else torch.device(device)
+        self.rng = torch.Generator(device=self.device)
+        if seed is None:
+            seed = env_params.get("seed", None)
+        if seed is None:
+            self.rng.seed()
+        else:
+            self.rng.manual_seed(seed)
+        self.load_env_params(env_params)
+
+    def load_env_params(self, env_params):
+        """
+        Initializes the environment
+        
+        Args:
+            env_params: environment parameters as passed to __init__()
+        """
+        #load the environment parameters
+        self.g = env_params["g0"]
+        self.b = env_params["b0"]
+        self.min_u = env_params["min_u"]
+        self.max_u = env_params["max_u"]
+        self.e0 = env_params["e0"]
+        self.dt = env_params["dt"]
+        self.a = env_params["a"]
+        self.tau = env_params["tau"]
+        self.pow_coeff = env_params["pow_coeff"]
+        self.diss_coeff = env_params["diss_coeff"]
+
+        #observation and action spaces of a single replica
+        self.observation_space = (gym.spaces.Box( low=np.array([0., self.min_u],dtype=np.float32),
+                                    high=np.array([1.,self.max_u],dtype=np.float32), dtype=np.float32))
+        self.action_space = (gym.spaces.Discrete(3), gym.spaces.Box(low=np.array([self.min_u],dtype=np.float32),
+                              high=np.array([self.max_u],dtype=np.float32), dtype=np.float32))
+ 
+        #reset the state of the environment
+        self.reset_internal_state_variables()
+
+    def reset(self):
+        """ resets the state of all the replicas """
+        self.reset_internal_state_variables()
+        return self.current_state()
+
+    def step(self, action):
+        """ Evolves all the replicas for a timestep depending on the chosen actions
+
+        Args:
+            action (tuple): (d_act, u_act), torch tensors with the discrete actions, with shape (num_envs,),
+                and the continuous actions, with shape (num_envs,1)
+
+        Returns:
+            state(torch.Tensor): new states after the step, with shape (num_envs,2)
+            reward(torch.Tensor): the rewards, with shape (num_envs,)
+            end(torch.Tensor): whether the episodes ended (these environments never end)
+            additional_info(dict): "multi_obj" contains the power and minus the dissipation, with shape (num_envs,2)
+        """
+        #load action 
+        d_act = torch.round(torch.as_tensor(action[0], device=self.device)).view(-1)
+        u_act = torch.as_tensor(action[1], device=self.device).view(-1).to(torch.float64)
+
+        #thermalization (d_act=0): evolve the state according to the master equation
+        de = self.de(u_act)
+        peq = self.peq(de, self.b)
+        thermal_p = (self.p - peq)*torch.exp(-self.g*self.dt/torch.tanh(0.5*torch.abs(de)*self.b)) + peq
+        pow = torch.where(d_act == 0, self.pow_coeff*de*(thermal_p - self.p)/self.dt, torch.zeros_like(de))
+
+        #continuous measurement of sigmaz (d_act=1). The measurement record is gaussian with mean +1 or -1, chosen
+        #with probabilities p and 1-p. The measurement operator is proportional to iden + tanh(0.5*(dt/tau)*rr)*sigmaz
+        rr = torch.where(torch.rand(self.num_envs, generator=self.rng, device=self.device, dtype=torch.float64) < self.p,
+                        1., -1.)
+        rr = rr + np.sqrt(self.tau/self.dt)*torch.randn(self.num_envs, generator=self.rng, device=self.device,
+                                                        dtype=torch.float64)
+        t = torch.tanh(0.5*(self.dt/self.tau)*rr)
+        p_plus = self.p*(1.+t)**2
+        measured_p = p_plus / (p_plus + (1.-self.p)*(1.-t)**2)
+        diss = torch.zeros_like(pow)
+
+        #complete state evolution
+        self.p = torch.where(d_act == 0, thermal_p, torch.where(d_act == 1, measured_p, self.p))
+        self.u = u_act
+
+        #compute reward
+        reward = self.a*pow - (1.-self.a)*diss
+
+        #return        
+        return self.current_state(), reward.to(torch.float32), torch.zeros(self.num_envs, dtype=torch.bool,
+            device=self.device), {"multi_obj": torch.stack([pow, -diss], dim=1).to(torch.float32)}
+
+    def set_current_state(self, state):
+        """
+        Sets the current state of all the replicas.
+
+        Args:
+            state (torch.Tensor or np.Array): states of the replicas, with shape (num_envs,2)
+        """
+        state = torch.as_tensor(state, device=self.device).to(torch.float64).view(self.num_envs, 2)
+        self.p = state[:,0].clone()
+        self.u = state[:,1].clone()
+
+    def current_state(self):
+        """ Returns the current states of the replicas as a torch.float32 tensor with shape (num_envs,2) """
+        return torch.stack([self.p, self.u], dim=1).to(torch.float32)
+
+    def reset_internal_state_variables(self):
+        """ sets initial values for the state of all the replicas """
+        #set initial population to average temperature and choose random action u
+        random_u = self.min_u + (self.max_u-self.min_u)*torch.rand(self.num_envs, generator=self.rng,
+                                                                    device=self.device, dtype=torch.float64)
+        self.p = self.peq(self.de(random_u), self.b)
+        self.u = random_u
+
+    def peq(self, eps, b):
+        """ Equilibrium probability of being in excited state at energy gap eps and inverse temperature b """
+        return 1. / (1. + torch.exp(b*eps) )
+
+    def de(self, u):
+        """ Energy gap of the qubit given the control u """
+        return self.e0 * u
+
+
+# Batched environments
+class BatchedTwoLevelDemonCon(object):
+    """
+    Batched counterpart of the environments of this module. It evolves num_envs independent replicas of
+    single_env_class at once: the density matrices are stored in a single array of shape (num_envs,2,2), the
+    discrete action chosen by each replica is applied through masked vectorized updates, and the measurement
+    outcomes of all replicas are drawn at once. It is not a gym.Env: step() takes the actions of all the
+    replicas and returns the stacked states, rewards and multi objectives.
+    Subclasses must set single_env_class and the measured Pauli operator SIGMA, or override measurement_sigma().
+
+    Args:
+        env_params (dict): the parameters of single_env_class
+        num_envs (int): number of replicas
+        seed (int): seed of the random number generator used for the measurements and the resets. If None,
+            env_params["seed"] is used
+    """
+
+    single_env_class = None
+    SIGMA = None
+
+    def __init__(self, env_params, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed if seed is not None else env_params.get("seed", None))
+        self.load_env_params(env_params)
+
+    def load_env_params(self, env_params):
+        """
+        Initializes the environment
+
+        Args:
+            env_params: environment parameters as passed to __init__()
+        """
+        #load the environment parameters
+        self.g0 = env_params["g0"]
+        self.b0 = env_params["b0"]
+        self.min_u = env_params["min_u"]
+        self.max_u = env_params["max_u"]
+        self.e0 = env_params["e0"]
+        self.dt = env_params["dt"]
+        self.tau = env_params["tau"]
+        self.a = env_params["a"]
+        self.pow_coeff = env_params["pow_coeff"]
+        self.diss_coeff = env_params["diss_coeff"]
+
+        #observation and action spaces of a single replica
+        self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
+                                    high=np.array([1.,1.,self.max_u],dtype=np.float32), dtype=np.float32))
+        self.action_space = (gym.spaces.Discrete(3), gym.spaces.Box(low=np.array([self.min_u],dtype=np.float32),
+                              high=np.array([self.max_u],dtype=np.float32), dtype=np.float32))
+
+        #reset the state of the environment
+        self.reset_internal_state_variables()
+
+    def reset(self):
+        """ resets the state of all the replicas """
+        self.reset_internal_state_variables()
+        return self.current_state()
+
+    def step(self, action):
+        """ Evolves all the replicas for a timestep depending on the chosen actions
+
+        Args:
+            action (tuple): (d_act, u_act), where d_act are the discrete actions, with shape (num_envs,),
+                and u_act are the continuous actions, with shape (num_envs,1)
+
+        Raises:
+            Exception: action out of bound
+
+        Returns:
+            state(np.Array): new states after the step, with shape (num_envs,3)
+            reward(np.Array): the rewards, with shape (num_envs,)
+            end(np.Array): whether the episodes ended (these environments never end)
+            additional_info(dict): "multi_obj" contains the power and minus the dissipation, with shape (num_envs,2)
+        """
+        #load and check the actions
+        d_act = np.asarray(action[0]).reshape(self.num_envs)
+        u_act = np.asarray(action[1], dtype=np.float32).reshape(self.num_envs)
+        if (np.any((d_act < 0) | (d_act >= self.action_space[0].n)) or np.any(u_act < self.action_space[1].low[0])
+            or np.any(u_act > self.action_space[1].high[0])):
+            raise Exception(f"Action {action} out of bound")
+        u_act = u_act.astype(np.float64)
+
+        #initialize null multi objectives
+        poww = np.zeros(self.num_envs)
+        diss = np.zeros(self.num_envs)
+
+        #each discrete action is applied to the replicas that chose it
+        idx = np.flatnonzero(d_act == 0)
+        if len(idx) > 0:
+            poww[idx] = self.thermalize(idx, u_act[idx])
+        idx = np.flatnonzero(d_act == 1)
+        if len(idx) > 0:
+            diss[idx] = self.measure(idx, u_act[idx])
+        idx = np.flatnonzero(d_act == 2)
+        if len(idx) > 0:
+            self.feedback(idx, u_act[idx])
+
+        #complete state evolution
+        self.update_state(u_act)
+
+        #compute reward
+        reward = self.a*poww - (1.-self.a)*diss
+
+        #return
+        return self.current_state(), reward, np.zeros(self.num_envs, dtype=bool), {"multi_obj":
+            np.stack([poww, -diss], axis=1).astype(np.float32)}
+
+    def gaps(self, u_act):
+        """ returns the qubit gap of the replicas that chose the continuous actions u_act """
+        return np.full(len(u_act), self.e0)
+
+    def measurement_sigma(self, u_act):
+        """ returns the measured Pauli operator, either with shape (2,2) or (len(u_act),2,2) """
+        return self.SIGMA
+
+    def feedback(self, idx, u_act):
+        """ performs the feedback on the replicas idx, rotating them to the negative z axis """
+        self.rotate_to_negative_z(idx)
+
+    def thermalize(self, idx, u_act):
+        """
+        Performs the thermalization on the replicas idx, and returns their power
+
+        Args:
+            idx (np.Array): indices of the replicas that are thermalized
+            u_act (np.Array): continuous actions chosen by these replicas
+
+        Returns:
+            poww (np.Array): the power of each of these replicas
+        """
+        e = self.gaps(u_act)
+        gam_eg = self.g0 * (1 + (-1+np.exp(self.b0 * e))**(-1))
+        gam_ge = self.g0 * (-1+np.exp(self.b0 * e))**(-1)
+        gsig = gam_eg + gam_ge
+
+        pe_old = np.real(self.rho[idx,0,0])
+        peg_dt = self.rho[idx,0,1] * np.exp(-(gsig/2+1j*e)*self.dt)
+        pe = np.exp(-gsig * self.dt)*((-1+np.exp(gsig * self.dt))*gam_ge + gsig * pe_old)/gsig
+        self.rho[idx,0,0] = pe
+        self.rho[idx,0,1] = peg_dt
+        self.rho[idx,1,0] = np.conjugate(peg_dt)
+        self.rho[idx,1,1] = 1 - pe
+        return (self.pow_coeff/self.dt)*e*(pe - pe_old)
+
+    def measure(self, idx, u_act):
+        """
+        Performs the continuous measurement on the replicas idx, and returns their dissipation
+
+        Args:
+            idx (np.Array): indices of the replicas that are measured
+            u_act (np.Array): continuous actions chosen by these replicas
+
+        Returns:
+            diss (np.Array): the dissipation of each of these replicas (always zero)
+        """
+        sigma = self.measurement_sigma(u_act)
+        rho = self.rho[idx]
+        sx_av = np.real(np.trace(sigma @ rho, axis1=-2, axis2=-1))
+        prb0 = (1-sx_av)/2
+        prb1 = (1+sx_av)/2
+        #as in the single replica environments, replicas with an invalid probability are not measured
+        valid = (prb0 >= 0) & (prb1 >= 0)
+
+        #the measurement record is gaussian with mean -1 or +1, chosen with probabilities prb0 and prb1
+        rr = np.where(self.rng.random(len(idx)) < prb1, 1., -1.)
+        rr = rr + np.sqrt(self.tau/self.dt)*self.rng.standard_normal(len(idx))
+        #since sigma^2 = iden, expm(-0.25*(dt/tau)*(rr*iden-sigma)^2) is proportional to
+        #iden + tanh(0.5*(dt/tau)*rr)*sigma, and the proportionality factor cancels in the normalization
+        mpl = np.eye(2) + np.tanh(0.5*(self.dt/self.tau)*rr)[:,None,None]*sigma
+        rho_meas = mpl @ rho @ mpl
+        prob_mpl = np.real(np.trace(rho_meas, axis1=1, axis2=2))
+        self.rho[idx[valid]] = rho_meas[valid] / prob_mpl[valid,None,None]
+        return np.zeros(len(idx))
+
+    def rotate_to_negative_z(self, idx):
+        """ rotates the Bloch vector of the replicas idx to the negative z axis """
+        xx = np.real(self.rho[idx,0,1] + self.rho[idx,1,0])
+        zz = np.real(self.rho[idx,0,0] - self.rho[idx,1,1])
+        z3 = np.sqrt(xx**2+zz**2)
+        self.rho[idx] = 0.
+        self.rho[idx,0,0] = 0.5*(1 - z3)
+        self.rho[idx,1,1] = 0.5*(1 + z3)
+
+    def set_current_state(self, state):
+        """
+        Sets the current state of all the replicas.
+
+        Args:
+            state (np.Array): states of the replicas, with shape (num_envs,3)
+        """
+        self.state = np.array(state, dtype=np.float32).reshape(self.num_envs, 3)
+
+    def current_state(self):
+        """ Returns the current states of the replicas, with shape (num_envs,3) """
+        return self.state.copy()
+
+    def update_state(self, u_act):
+        """ sets the states of the replicas from their density matrices and the last continuous actions """
+        self.state = np.stack([np.real(self.rho[:,0,1] + self.rho[:,1,0]), np.real(self.rho[:,0,0] - self.rho[:,1,1]),
+                                u_act], axis=1).astype(np.float32)
+
+    def reset_internal_state_variables(self):
+        """ sets initial values for the state of all the replicas """
+        random_u = self.rng.uniform(self.action_space[1].low[0], self.action_space[1].high[0],
+                                    size=self.num_envs).astype(np.float32)
+        #thermal state of the Hamiltonian [[e,0],[0,0]]
+        boltz = np.exp(-self.b0*self.gaps(random_u.astype(np.float64)))
+        self.rho = np.zeros((self.num_envs,2,2), dtype=np.complex128)
+        self.rho[:,0,0] = boltz/(1.+boltz)
+        self.rho[:,1,1] = 1./(1.+boltz)
+        self.update_state(random_u)
+
+#1
+class BatchedTwoLevelDemonConPowDissX(BatchedTwoLevelDemonCon):
+    """ Batched TwoLevelDemonConPowDissX: continuous measurement of sigmaX """
+
+    single_env_class = TwoLevelDemonConPowDissX
+    SIGMA = np.array([[0.,1.],[1.,0.]])
+
+# 2
+class BatchedTwoLevelDemonConPowDissZ(BatchedTwoLevelDemonCon):
+    """ Batched TwoLevelDemonConPowDissZ: continuous measurement of sigmaZ """
+
+    single_env_class = TwoLevelDemonConPowDissZ
+    SIGMA = np.array([[1.,0.],[0.,-1.]])
+
+# 3
+class BatchedTwoLevelDemonConPowDissTheta(BatchedTwoLevelDemonCon):
+    """ Batched TwoLevelDemonConPowDissTheta: continuous measurement at the angle u*3.6-0.3 """
+
+    single_env_class = TwoLevelDemonConPowDissTheta
+
+    def measurement_sigma(self, u_act):
+        theta = u_act * 3.6 - 0.3
+        return np.stack([np.stack([np.cos(theta), np.sin(theta)], axis=1),
+                         np.stack([np.sin(theta), -np.cos(theta)], axis=1)], axis=1)
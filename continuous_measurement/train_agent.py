@@ -56,7 +56,8 @@ log_info = {
     "log_running_reward": True,     #log running reward 
     "log_running_loss": True,       #log running loss
     "log_actions": True,            #log chosen actions
-    "extra_str": "_test_run" #extra string to append to training folder
+    "extra_str": "_test_run", #extra string to append to training folder
+    "headless": False               #if True, no plots while training. Plot offline with "python plotting.py log_dir"
 }
 
 # Instantiate and train the agent
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+from contextlib import closing
+
+"""
+This module contains RunCatalog, an SQLite database in the data folder indexing the training sessions it contains.
+SacTrain updates it at log time with the parameters, the latest running reward and multi objectives, and the
+location of the latest saved state, so that extra.log_dirs_given_criteria and extra.ret_last_rewards_and_avg don't
+need to parse the log files of every training session.
+"""
+
+class RunCatalog(object):
+    """
+    Catalog of the training sessions in a data folder. Each training session is identified by the name of its log
+    folder. The parameters are stored both as the strings written in the params file, and as numbers if they are
+    numeric, so they can be queried with either. Since SQLite relies on file locks, on network filesystems the
+    catalog should only be written by one node at a time.
+
+    Args:
+        db_file (str): location of the SQLite database. It's created if it doesn't exist
+        last_rewards (int): number of latest logged running rewards kept for each training session
+    """
+
+    def __init__(self, db_file, last_rewards=10):
+        self.db_file = db_file
+        self.last_rewards = last_rewards
+        with closing(self.connect()) as conn, conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS runs (name TEXT PRIMARY KEY, log_dir TEXT, steps_done INTEGER,
+                            running_reward REAL, last_rewards TEXT, running_multi_obj TEXT, latest_state TEXT,
+                            updated REAL)""")
+            conn.execute("CREATE TABLE IF NOT EXISTS params (name TEXT, key TEXT, value TEXT, num REAL, "
+                            "PRIMARY KEY (name, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS params_value ON params (key, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS params_num ON params (key, num)")
+
+    def update_run(self, log_dir, params=None, steps_done=None, running_reward=None, running_multi_obj=None,
+                    latest_state=None):
+        """
+        Adds or updates a training session. Only the specified fields are updated.
+
+        Args:
+            log_dir (str): log folder of the training session
+            params (dict): the parameters (env_params and training_hyperparams), replacing the stored ones
+            steps_done (int): steps done at the latest log
+            running_reward (float): running reward at the latest log. It's added to the last rewards at steps_done
+            running_multi_obj (np.array): running multi objectives at the latest log
+            latest_state (str): folder of the latest saved state
+        """
+        name = os.path.basename(os.path.normpath(log_dir))
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO runs (name, log_dir, last_rewards) VALUES (?, ?, '[]')", (name, log_dir))
+            conn.execute("UPDATE runs SET log_dir = ?, updated = ? WHERE name = ?", (log_dir, time.time(), name))
+            if params is not None:
+                conn.execute("DELETE FROM params WHERE name = ?", (name,))
+                conn.executemany("INSERT INTO params VALUES (?, ?, ?, ?)",
+                                    [(name, key, f"{value}", self.to_number(value)) for key, value in params.items()])
+            if steps_done is not None:
+                conn.execute("UPDATE runs SET steps_done = ? WHERE name = ?", (int(steps_done), name))
+            if running_reward is not None:
+                last_rewards = json.loads(conn.execute("SELECT last_rewards FROM runs WHERE name = ?",
+                                                        (name,)).fetchone()[0])
+                last_rewards = (last_rewards + [[int(steps_done), float(running_reward)]])[-self.last_rewards:]
+                conn.execute("UPDATE runs SET running_reward = ?, last_rewards = ? WHERE name = ?",
+                                (float(running_reward), json.dumps(last_rewards), name))
+            if running_multi_obj is not None:
+                conn.execute("UPDATE runs SET running_multi_obj = ? WHERE name = ?",
+                                (json.dumps(np.asarray(running_multi_obj, dtype=float).tolist()), name))
+            if latest_state is not None:
+                conn.execute("UPDATE runs SET latest_state = ? WHERE name = ?", (latest_state, name))
+
+    def query(self, conditions_dict):
+        """
+        Returns the names of the training sessions satisfying all conditions. A condition given as a string is
+        compared with the string in the params file, while a number is compared numerically.
+
+        Args:
+            conditions_dict (dict): dictionary with all parameter requests to be satisfied
+
+        Returns:
+            (set(str)): names of the log folders satisfying the requests
+        """
+        sql = "SELECT name FROM runs"
+        args = []
+        for key, value in conditions_dict.items():
+            number = None if isinstance(value, str) else self.to_number(value)
+            column, value = ("value", f"{value}") if number is None else ("num", number)
+            sql += f" INTERSECT SELECT name FROM params WHERE key = ? AND {column} = ?"
+            args += [key, value]
+        with closing(self.connect()) as conn:
+            return set(row[0] for row in conn.execute(sql, args))
+
+    def run(self, name):
+        """
+        Returns:
+            (dict): the catalog entry of the log folder name, with the parameters as strings, or None if it's not
+                in the catalog. last_rewards is an array with the steps and the running rewards in the columns
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT log_dir, steps_done, running_reward, last_rewards, running_multi_obj, "
+                                "latest_state, updated FROM runs WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            params = dict(conn.execute("SELECT key, value FROM params WHERE name = ?", (name,)))
+        return {"name": name, "log_dir": row[0], "steps_done": row[1], "running_reward": row[2],
+                "last_rewards": np.array(json.loads(row[3])).reshape(-1, 2),
+                "running_multi_obj": None if row[4] is None else np.array(json.loads(row[4])),
+                "latest_state": row[5], "updated": row[6], "params": params}
+
+    def names(self):
+        """ returns the set of names of the log folders in the catalog """
+        with closing(self.connect()) as conn:
+            return set(row[0] for row in conn.execute("SELECT name FROM runs"))
+
+    def remove_runs(self, names):
+        """ removes the training sessions with the given log folder names from the catalog """
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("DELETE FROM runs WHERE name = ?", [(name,) for name in names])
+            conn.executemany("DELETE FROM params WHERE name = ?", [(name,) for name in names])
+
+    #Methods that should only be used internally:
+
+    def connect(self):
+        return sqlite3.connect(self.db_file, timeout=60.)
+
+    def to_number(self, value):
+        """ returns value as a float if it's a number (including strings of numbers), otherwise None """
+        if isinstance(value, (bool, np.bool_)):
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
@@ -8,16 +8,20 @@ import shutil
 import sys
 import warnings
 import logging
+import atexit
+import multiprocessing
+import sqlite3
 from itertools import chain
 from datetime import datetime
 from pathlib import Path
 from copy import deepcopy
 
 sys.path.append(os.path.join('..','lib'))
-import plotting
 import core_tri
 import sac_tri_envs_dis
 import extra
+import run_catalog
+import policy_snapshots
 
 """
 This module contains the objects used to train quantum thermal machine environments with 1 continuous action
@@ -35,18 +39,24 @@ class ReplayBuffer:
         act_dim (int): number of continuous parameters of action space.
         size (int): size of the buffer.
         device (torch.device): which torch device to use.
+        multi_obj_dim (int): number of multi objectives stored with each transition. If 0, they are not stored.
     """
 
-    def __init__(self, obs_dim, act_dim, size, device):  
+    #buffer of the multi objectives (None if they are not stored)
+    multi_obj_buf = None
+
+    def __init__(self, obs_dim, act_dim, size, device, multi_obj_dim=0):  
         self.obs_buf = torch.zeros((size, obs_dim), dtype=torch.float32, device=device)
         self.obs2_buf = torch.zeros((size, obs_dim), dtype=torch.float32, device=device)
         self.tri_act_buf = torch.zeros(size, dtype=torch.float32, device=device)
         self.act_buf = torch.zeros((size, act_dim), dtype=torch.float32, device=device)
         self.rew_buf = torch.zeros(size, dtype=torch.float32, device=device)
+        if multi_obj_dim > 0:
+            self.multi_obj_buf = torch.zeros((size, multi_obj_dim), dtype=torch.float32, device=device)
         self.ptr, self.size, self.max_size = 0, 0, size
         self.device = device
 
-    def store(self, obs, tri_act, act, rew, next_obs):
+    def store(self, obs, tri_act, act, rew, next_obs, multi_obj=None):
         """
         stores a transition into the buffer. All args are torch.float32.
 
@@ -56,7 +66,10 @@ class ReplayBuffer:
             act (torch.tensor): the continuous action
             rew (torch.tensor): the rewards
             next_obs (torch.tensor): the next state        
+            multi_obj (torch.tensor): the multi objectives. Only stored if the buffer was created with multi_obj_dim > 0
         """
+        if self.multi_obj_buf is not None and multi_obj is not None:
+            self.multi_obj_buf[self.ptr] = torch.as_tensor(multi_obj, dtype=torch.float32)
         self.obs_buf[self.ptr] = obs
         self.obs2_buf[self.ptr] = next_obs
         self.tri_act_buf[self.ptr] = tri_act
@@ -65,6 +78,35 @@ class ReplayBuffer:
         self.ptr = (self.ptr+1) % self.max_size
         self.size = min(self.size+1, self.max_size)
 
+    def store_batch(self, obs, tri_act, act, rew, next_obs, multi_obj=None):
+        """
+        stores a batch of transitions into the buffer with a single slice assignment.
+        All args are torch.float32, with the batch index as leftmost index.
+
+        Args:
+            obs (torch.tensor): the initial states
+            tri_act (torch.tensor): the discrete actions (0,1,2)
+            act (torch.tensor): the continuous actions
+            rew (torch.tensor): the rewards
+            next_obs (torch.tensor): the next states
+            multi_obj (torch.tensor): the multi objectives. Only stored if the buffer was created with multi_obj_dim > 0
+        """
+        n = obs.shape[0]
+        if self.ptr + n <= self.max_size:
+            idxs = slice(self.ptr, self.ptr + n)
+        else:
+            #the batch wraps around the end of the buffer
+            idxs = torch.arange(self.ptr, self.ptr + n, device=self.device) % self.max_size
+        self.obs_buf[idxs] = obs
+        self.obs2_buf[idxs] = next_obs
+        self.tri_act_buf[idxs] = tri_act
+        self.act_buf[idxs] = act
+        self.rew_buf[idxs] = rew
+        if self.multi_obj_buf is not None and multi_obj is not None:
+            self.multi_obj_buf[idxs] = multi_obj
+        self.ptr = (self.ptr+n) % self.max_size
+        self.size = min(self.size+n, self.max_size)
+
     def sample_batch(self, batch_size):
         """
         Return a random batch of experience from the buffer.
@@ -79,8 +121,46 @@ class ReplayBuffer:
                      tri_act=self.tri_act_buf[idxs],
                      act=self.act_buf[idxs],
                      rew=self.rew_buf[idxs])
+        if self.multi_obj_buf is not None:
+            batch["multi_obj"] = self.multi_obj_buf[idxs]
         return batch
 
+    def relabel_rewards(self, a, pow_scale=1., diss_scale=1.):
+        """
+        Rescales the stored multi objectives [pow, -diss] of all the stored transitions by pow_scale and
+        diss_scale, and recomputes their rewards as a*pow - (1-a)*diss, so that both are in the units of new
+        transitions.
+
+        Args:
+            a (float): the power-dissipation trade-off
+            pow_scale (float): factor multiplying the stored power
+            diss_scale (float): factor multiplying the stored dissipation
+
+        Raises:
+            NameError: if the buffer doesn't store the multi objectives
+        """
+        if self.multi_obj_buf is None:
+            raise NameError("The replay buffer doesn't store the multi objectives, so the rewards can't be relabeled")
+        self.multi_obj_buf[:self.size,0] *= pow_scale
+        self.multi_obj_buf[:self.size,1] *= diss_scale
+        self.rew_buf[:self.size] = a*self.multi_obj_buf[:self.size,0] + (1.-a)*self.multi_obj_buf[:self.size,1]
+
+    def store_from(self, memory):
+        """
+        Stores all the transitions of another buffer, from the oldest to the newest. If they don't fit,
+        only the newest ones are kept.
+
+        Args:
+            memory (ReplayBuffer): the buffer to copy the transitions from
+        """
+        #indices of the transitions of memory in chronological order
+        idxs = (torch.arange(memory.size, device=memory.device) + memory.ptr - memory.size) % memory.max_size
+        idxs = idxs[-self.max_size:]
+        multi_obj = None if memory.multi_obj_buf is None else memory.multi_obj_buf[idxs].to(self.device)
+        self.store_batch(memory.obs_buf[idxs].to(self.device), memory.tri_act_buf[idxs].to(self.device),
+                            memory.act_buf[idxs].to(self.device), memory.rew_buf[idxs].to(self.device),
+                            memory.obs2_buf[idxs].to(self.device), multi_obj)
+
 def state_to_tensor(state, device):
     """ Coverts a numpy state to a torch.tensor with the right dimension """
     return torch.as_tensor(state, device=device, dtype=torch.float32).view(-1)
@@ -89,6 +169,78 @@ def action_to_tensor(state, device):
     """ Coverts a numpy action to a torch.tensor with the right dimension """
     return torch.as_tensor(state, device=device, dtype=torch.float32)
 
+def states_to_tensor(states, device):
+    """ Coverts a numpy batch of states to a torch.tensor with shape (batch, obs_dim) """
+    states = torch.as_tensor(states, device=device, dtype=torch.float32)
+    return states.view(states.shape[0], -1)
+
+def evaluation_worker(actor, env_class, env_params, trade_off, gamma, steps, evaluation_file, snapshots):
+    """
+    Target of the process started by AsyncEvaluator. For each snapshot of the parameters of the policy received
+    from the queue snapshots, it evaluates the policy in a deterministic and in a stochastic way on a new instance
+    of the environment (see extra.test_policy), and appends a line to evaluation_file with the training steps, and
+    for both evaluations the running return followed by the running multi objectives (if any). It stops when it
+    receives None.
+    """
+    #the evaluations shouldn't compete with the training for the cpus
+    torch.set_num_threads(1)
+
+    def policy(o, deterministic):
+        o = torch.as_tensor(o, dtype=torch.float32)
+        #a trade-off conditioned policy takes the trade-off as last observation
+        if trade_off is not None:
+            o = torch.cat([o, torch.tensor([trade_off], dtype=torch.float32)])
+        with torch.no_grad():
+            b, a = actor.act(o, deterministic)
+        return (int(np.round(b.numpy())), a.numpy())
+
+    for steps_done, params in iter(snapshots.get, None):
+        try:
+            actor.load_state_dict({key: torch.from_numpy(value) for key, value in params.items()})
+            line = [steps_done]
+            for deterministic in [True, False]:
+                running_reward, objectives, _ = extra.test_policy(env_class, env_params,
+                                        lambda o: policy(o, deterministic), gamma, True, steps=steps, suppress_show=True,
+                                        fast_step=True)
+                line += list(objectives) if isinstance(objectives, np.ndarray) else [running_reward]
+            with open(evaluation_file, "a") as f:
+                f.write("\t".join(str(value) for value in line) + "\n")
+        except Exception as e:
+            logging.error(f"Exception evaluating the policy at step {steps_done}: {e}")
+
+class AsyncEvaluator(object):
+    """
+    Evaluates snapshots of a policy in a background process while the training continues (see EVAL_STEPS in
+    SacTrain.initialize_new_train). Where possible the process is forked, so the training script doesn't need to
+    be importable by the process.
+
+    Args:
+        actor (core_tri.SquashedGaussianMLPActor): the policy. A copy on the cpu is used by the process
+        env_class: class of the environment
+        env_params (dict): parameters of the environment
+        trade_off (float): if not None, the trade-off appended to the observations of a trade-off conditioned policy
+        gamma (float): the exponential average factor to compute the return
+        steps (int): number of steps of the environment of each evaluation
+        evaluation_file (str): file where the results are appended
+    """
+    def __init__(self, actor, env_class, env_params, trade_off, gamma, steps, evaluation_file):
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        self.snapshots = context.Queue()
+        self.process = context.Process(target=evaluation_worker, args=(deepcopy(actor).cpu(), env_class, env_params,
+                                        trade_off, gamma, steps, evaluation_file, self.snapshots), daemon=True)
+        self.process.start()
+
+    def submit(self, steps_done, actor):
+        """ sends a snapshot of the parameters of actor, after steps_done training steps, to be evaluated """
+        self.snapshots.put((steps_done, {key: value.detach().cpu().numpy().copy()
+                                            for key, value in actor.state_dict().items()}))
+
+    def close(self):
+        """ waits until all the submitted snapshots are evaluated, and stops the process """
+        self.snapshots.put(None)
+        self.process.join()
+
+
 class SacTrain(object):
     """
     Main class to train the RL agent on a quantum thermal machine environment
@@ -118,15 +270,20 @@ class SacTrain(object):
     RUNNING_MULTI_OBJ_FILE_NAME = "running_multi_obj.txt"
     ACTIONS_FILE_NAME = "actions.txt"
     SAVED_POLICY_DIR_NAME = "saved_policies"
+    CATALOG_FILE_NAME = "catalog.sqlite"
+    EVALUATION_FILE_NAME = "evaluation.txt"
 
     #internal variables used during training.
+    evaluator = None
+    snapshot_writer = None
     zero_float = None
     one_float = None
     two_float = None
 
     #Methods that can be called:
 
-    def initialize_new_train(self, env_class, env_params, training_hyperparams, log_info):
+    def initialize_new_train(self, env_class, env_params, training_hyperparams, log_info, warm_start_folder=None,
+                                warm_start_state_folder=None, warm_start_memory=False):
         """ Initializes a new training session. Should be called right after initialization.
 
         Args:
@@ -148,11 +305,51 @@ class SacTrain(object):
                 "UPDATE_AFTER" (int): start minimizing loss function after initial steps
                 "UPDATE_EVERY" (int): performs this many updates every this many steps
                 "USE_CUDA" (bool): use cuda for computation
+                "UPDATES_PER_STEP" (float): optional, default 1. Number of updates per environment step, i.e.
+                    UPDATE_EVERY*UPDATES_PER_STEP updates are done every UPDATE_EVERY steps. It doesn't depend on NUM_ENVS
+                "NUM_ENVS" (int): optional, default 1. If larger than 1, NUM_ENVS replicas of the environment are
+                    evolved at once using the batched counterpart of env_class (see train_vectorized)
+                "TRADE_OFF_CONDITIONED" (bool): optional, default False. If True, a single agent is trained for all
+                    the values of the power-dissipation trade-off a: the policy and both value functions take a as an
+                    additional input, the multi objectives [pow, -diss] are stored in the replay buffer, and at each
+                    update the rewards a*pow - (1-a)*diss are recomputed for values of a sampled uniformly in
+                    TRADE_OFF_RANGE (see evaluate_pareto_front). The "a" in env_params is only used for logging
+                "TRADE_OFF_RANGE" (tuple(float,float)): optional, default (0.,1.). Range of the trade-off a
+                "TRADE_OFF_RESAMPLE_STEPS" (int): optional, default 1000. The values of a used to choose the actions
+                    (one for each replica of the environment) are resampled every this many steps
+                "EVAL_STEPS" (int): optional, default 0. If positive, every EVAL_STEPS steps a snapshot of the policy
+                    is evaluated in a background process, deterministically and stochastically, on a new instance of
+                    the environment. The training steps and the running return (and multi objectives) of both
+                    evaluations are appended as a line to EVALUATION_FILE_NAME (see AsyncEvaluator). The pending
+                    evaluations are completed at exit, or calling wait_for_evaluations()
+                "EVAL_ENV_STEPS" (int): optional, default 1000. Number of steps of the environment of each evaluation
+                "SNAPSHOT_STEPS" (int): optional, default 0. If positive, every SNAPSHOT_STEPS steps the parameters
+                    of the policy are appended to the stream of policy snapshots in the log folder, which can be read
+                    with policy_snapshots.PolicySnapshots
+                "WARM_START_RANDOM_STEPS" (int): optional, default 0. Only used with warm_start_folder, it replaces
+                    INITIAL_RANDOM_STEPS. UPDATE_AFTER is lowered to the largest of WARM_START_RANDOM_STEPS and
+                    BATCH_SIZE if it's larger
             log_info (dict): specifies logging info. Must contain
                     "log_running_reward": log running reward 
                     "log_running_loss": log running loss
                     "log_actions" (bool): log chosen actions
                     "extra_str" (str): extra string to append to training folder
+                    "headless" (bool): optional, default False. If True, no plot is ever produced, and plotting
+                        (matplotlib and IPython) is never imported. The logs can be plotted offline with
+                        "python plotting.py log_dir"
+                    "catalog" (bool): optional, default True. If True, the training session is added to the catalog
+                        CATALOG_FILE_NAME of the data folder (see run_catalog.RunCatalog), updated at every log
+            warm_start_folder (str): folder of a previous training session of the same environment with the same
+                HIDDEN_SIZES, e.g. at a neighbouring value of a, to warm start from. If specified, the policy, the
+                value functions and the temperatures alpha_d and alpha_c are initialized from its saved state, and
+                the target entropies start from the final values of that session (H_D_START and H_C_START are
+                replaced). Warm starting from the previous session allows to chain sessions along a curriculum
+            warm_start_state_folder (str): specific save of warm_start_folder to load. If None, the latest one
+            warm_start_memory (bool): if True, also the replay buffer is initialized from warm_start_folder, with
+                relabeled rewards (see load_memory_from_run)
+
+        Raises:
+            NameError: if warm_start_folder is a training session of a different environment
         """
         
         #initialize a SacTrainState to store the training state 
@@ -163,6 +360,7 @@ class SacTrain(object):
         self.s.env_params = env_params
         self.s.training_hyperparams = training_hyperparams
         self.s.log_info = log_info 
+        self.initialize_default_hyperparams()
  
         #setup the torch device
         if self.s.training_hyperparams["USE_CUDA"]:
@@ -174,17 +372,25 @@ class SacTrain(object):
         else:
             self.s.device = torch.device("cpu")
 
-        #create environment
-        self.env = env_class(self.s.env_params)
-
         #add the environment name to the env_params dictionary
-        self.s.env_params["env_name"] = self.env.__class__.__name__
+        self.s.env_params["env_name"] = env_class.__name__
+
+        #if warm starting, the schedules are shortened before they are logged
+        if warm_start_folder is not None:
+            warm_start_path = self.saved_state_path(warm_start_folder, warm_start_state_folder)
+            self.shorten_schedules_for_warm_start(warm_start_path)
+
+        #create environment
+        self.env = self.create_env()
 
         #set the training steps_done to zero
         self.s.steps_done = 0
 
         #reset the environment and save the initial state
-        self.s.state = state_to_tensor(self.env.reset(), self.s.device)
+        if self.s.training_hyperparams["NUM_ENVS"] > 1:
+            self.s.state = states_to_tensor(self.env.reset(), self.s.device)
+        else:
+            self.s.state = state_to_tensor(self.env.reset(), self.s.device)
 
         #initialize logging session
         self.s.log_session = self.initialize_log_session()
@@ -192,7 +398,12 @@ class SacTrain(object):
         #setup the memory replay buffer
         obs_dim = self.env.observation_space.shape[0]
         act_dim = self.env.action_space[1].shape[0]
-        self.memory = ReplayBuffer(obs_dim, act_dim, self.s.training_hyperparams["REPLAY_MEMORY_SIZE"],self.s.device)
+        #the multi objectives [pow, -diss] are also stored, so that the rewards can be relabeled
+        self.memory = ReplayBuffer(obs_dim, act_dim, self.s.training_hyperparams["REPLAY_MEMORY_SIZE"],self.s.device,
+                                    multi_obj_dim=2)
+
+        #choose the trade-offs used to choose the actions
+        self.resample_trade_off()
 
         # #initialize the NNs
         self.initialize_nns()
@@ -200,6 +411,15 @@ class SacTrain(object):
         # #setup the optimizer
         self.create_optimizer()
 
+        #if warm starting, load the NNs (including alpha_d and alpha_c) and eventually the replay buffer
+        if warm_start_folder is not None:
+            self.ac.load_state_dict(torch.load(os.path.join(warm_start_path, self.POLICY_NET_FILE_NAME),
+                                                map_location=self.s.device))
+            self.ac_targ.load_state_dict(torch.load(os.path.join(warm_start_path, self.TARGET_NET_FILE_NAME),
+                                                map_location=self.s.device))
+            if warm_start_memory:
+                self.load_memory_from_run(warm_start_folder, warm_start_state_folder)
+
     def load_train(self, log_folder, specific_state_folder = None, no_train=False):
         """
         Loads a training session that had been previously saved. The training
@@ -214,21 +434,12 @@ class SacTrain(object):
         """
 
         #construct the location of the actual saved data
-        save_dir_path = os.path.join(log_folder, self.STATE_FOLDER_NAME)
-        if specific_state_folder is not None:
-            save_dir_path = os.path.join(save_dir_path,specific_state_folder) 
-        else:
-            #must find the latest folder if not specificed
-            path = Path(save_dir_path)
-            folders = [dir.name for dir in path.iterdir() if dir.is_dir()]
-            index = int(folders[0])
-            for folder in folders:
-                index = max(index, int(folder))
-            save_dir_path = os.path.join(save_dir_path, str(index)) 
+        save_dir_path = self.saved_state_path(log_folder, specific_state_folder)
 
         #load self.s
         self.s = extra.unpickle_data(os.path.join(save_dir_path, self.S_FILE_NAME_BZ2),
                                  uncompressed_file = os.path.join(save_dir_path, self.S_FILE_NAME))
+        self.initialize_default_hyperparams()
    
         #load the memory
         if not no_train:
@@ -241,8 +452,7 @@ class SacTrain(object):
                 self.memory = self.s.memory
         
         #load the environment
-        env_method = self.return_env_class_from_name()
-        self.env = env_method(self.s.env_params)
+        self.env = self.create_env()
         try:
             self.env.set_current_state(self.s.state.cpu().numpy())
         except:
@@ -266,6 +476,43 @@ class SacTrain(object):
             for file in Path(os.path.join(save_dir_path, self.SAVED_LOGS_FOLDER)).iterdir():
                 shutil.copy(str(file), os.path.join(self.s.log_session.log_dir, file.name))
 
+    def load_memory_from_run(self, log_folder, specific_state_folder = None):
+        """
+        Warm starts the replay buffer with the experience of a previous training session of the same environment,
+        for example trained with a different trade-off a, or with different pow_coeff and diss_coeff. The rewards
+        are recomputed from the stored multi objectives using the env_params of this training session, so fewer
+        INITIAL_RANDOM_STEPS (possibly zero) are needed. It must be called after initialize_new_train.
+
+        Args:
+            log_folder (str): folder of the previous training session
+            specific_state_folder (str): can load a specific save. If None, loads the latest one.
+
+        Raises:
+            NameError: if the previous session used a different environment, or if its replay buffer was not saved
+                or doesn't store the multi objectives
+        """
+        save_dir_path = self.saved_state_path(log_folder, specific_state_folder)
+        source_s = extra.unpickle_data(os.path.join(save_dir_path, self.S_FILE_NAME_BZ2),
+                                 uncompressed_file = os.path.join(save_dir_path, self.S_FILE_NAME))
+        if source_s.env_params["env_name"] != self.s.env_params["env_name"]:
+            raise NameError(f"The training session in {log_folder} used the environment "
+                            f"{source_s.env_params['env_name']}, not {self.s.env_params['env_name']}")
+
+        #for back compatibility, the memory can also be in the saved state
+        if os.path.exists(os.path.join(save_dir_path, self.MEMORY_FILE_NAME)):
+            memory = extra.unpickle_data(os.path.join(save_dir_path, self.MEMORY_FILE_NAME))
+        else:
+            memory = getattr(source_s, "memory", None)
+        if memory is None:
+            raise NameError(f"The replay buffer of the training session in {log_folder} was not saved")
+
+        #the stored multi objectives are multiplied by the pow_coeff and diss_coeff of the previous session, so
+        #they are rescaled together with the rewards before being stored
+        pow_scale = self.s.env_params["pow_coeff"] / source_s.env_params["pow_coeff"]
+        diss_scale = self.s.env_params["diss_coeff"] / source_s.env_params["diss_coeff"]
+        memory.relabel_rewards(self.s.env_params["a"], pow_scale, diss_scale)
+        self.memory.store_from(memory)
+
     def train(self, steps, output_plots = True):
         """
         Runs "steps" number of training steps. Takes care of saving and logging. It can be called multiple
@@ -274,78 +521,252 @@ class SacTrain(object):
         Args:
             steps (int): number of training steps to perform
             output_plots (bool): if true, it will output a plot with all the running logs every LOG_STEPS.
+                It is ignored in headless mode (see log_info in initialize_new_train).
         """
+        #with more than one replica of the environment, the vectorized training loop is used
+        if self.s.training_hyperparams["NUM_ENVS"] > 1:
+            self.train_vectorized(steps, output_plots)
+            return
+
+        o2_buffers = self.step_buffers()
+
         for _ in range(steps):
             
             #choose an action (random uniform for first INITIAL_RANDOM_STEPS, then according to policy )
             if self.s.steps_done > self.s.training_hyperparams["INITIAL_RANDOM_STEPS"]:
                 tri_a, a = self.get_action(self.s.state)
             else:
-                tri_a = action_to_tensor(self.env.action_space[0].sample(),self.s.device)
-                a = action_to_tensor(self.env.action_space[1].sample(),self.s.device)
+                tri_a, a = self.random_action()
+
+            #perform the action, store the experience and update the running logs
+            self.perform_step(tri_a, a, o2_buffers)
+
+            # Perform NN parameters updates
+            if self.s.steps_done > self.s.training_hyperparams["UPDATE_AFTER"] and \
+                self.s.steps_done % self.s.training_hyperparams["UPDATE_EVERY"] == 0:
+                self.perform_updates(self.updates_per_burst())
+
+            #if it's time, log and save the full training state
+            self.log_and_save(output_plots)
+
+    def train_vectorized(self, steps, output_plots = True):
+        """
+        Training loop used when NUM_ENVS > 1. At each iteration the NUM_ENVS replicas of the batched environment
+        are evolved with the actions chosen by a single batched forward pass of the policy, and the NUM_ENVS
+        transitions are written to the replay buffer at once. Each iteration counts as NUM_ENVS steps, so the
+        step-based hyperparameters (INITIAL_RANDOM_STEPS, UPDATE_AFTER, UPDATE_EVERY, LOG_STEPS, SAVE_STATE_STEPS)
+        refer to the total number of transitions, and the number of updates per transition is UPDATES_PER_STEP
+        independently of NUM_ENVS.
+        The running reward and running multi objectives are exponential averages, in time, of the averages over the
+        replicas, and the actions of the first replica are logged.
+        If the environment is torch_native, actions, states and rewards are exchanged with it as torch tensors on
+        the training device. In all cases the running logs are accumulated as tensors, and moved to the host only
+        when logging or saving, so that a rollout doesn't require a synchronization with the host at every step.
+
+        Args:
+            steps (int): number of training steps to perform, summed over the replicas
+            output_plots (bool): if true, it will output a plot with all the running logs every LOG_STEPS.
+                It is ignored in headless mode (see log_info in initialize_new_train).
+        """
+        num_envs = self.s.training_hyperparams["NUM_ENVS"]
+        gamma = self.s.training_hyperparams["GAMMA"]
+        torch_env = getattr(self.env, "torch_native", False)
+        act_low = action_to_tensor(self.env.action_space[1].low, self.s.device)
+        act_high = action_to_tensor(self.env.action_space[1].high, self.s.device)
+
+        #running logs accumulated as tensors (see store_running_logs)
+        running_reward = torch.tensor(self.s.running_reward, dtype=torch.float32, device=self.s.device)
+        running_multi_obj = None if self.s.running_multi_obj is None else action_to_tensor(self.s.running_multi_obj,
+                                                                                           self.s.device)
+        actions_steps, actions = [], []
+
+        for _ in range(int(np.ceil(steps / num_envs))):
+
+            #choose the actions (random uniform for first INITIAL_RANDOM_STEPS, then according to policy )
+            if self.s.steps_done > self.s.training_hyperparams["INITIAL_RANDOM_STEPS"]:
+                tri_a, a = self.get_action_batch(self.s.state)
+            else:
+                tri_a = torch.randint(self.env.action_space[0].n, (num_envs,), device=self.s.device).type(torch.float32)
+                a = act_low + (act_high-act_low)*torch.rand((num_envs,) + self.env.action_space[1].shape,
+                                                            device=self.s.device)
+
+            #perform the actions on all the replicas of the environment
+            if torch_env:
+                o2, r, _, info_dict = self.env.step( (tri_a, a) )
+                multi_obj = info_dict.get("multi_obj")
+            else:
+                o2_np, r, _, info_dict = self.env.step( (np.round(tri_a.cpu().numpy()).astype(int), a.cpu().numpy()) )
+                o2 = states_to_tensor(o2_np, self.s.device)
+                r = action_to_tensor(r, self.s.device)
+                multi_obj = action_to_tensor(info_dict["multi_obj"], self.s.device) if "multi_obj" in info_dict else None
+
+            # Store the experience of all replicas to replay buffer
+            self.memory.store_batch(self.s.state, tri_a, a, r, o2, multi_obj)
 
-            #perform the action on environment
-            o2_np, r, _, info_dict = self.env.step( (int(np.round(tri_a.cpu().numpy())), a.cpu().numpy()) )
-            o2 = state_to_tensor(o2_np,self.s.device)
-            
-            # Store experience to replay buffer
-            self.memory.store(self.s.state, tri_a, a, r, o2)
-            
             #move to the next state
             self.s.state = o2
 
             #increase the step counter
-            self.s.steps_done += 1
+            previous_steps = self.s.steps_done
+            self.s.steps_done += num_envs
 
-            # Perform NN parameters updates
-            if self.s.steps_done > self.s.training_hyperparams["UPDATE_AFTER"] and \
-                self.s.steps_done % self.s.training_hyperparams["UPDATE_EVERY"] == 0:
-                
-                for _ in range(self.s.training_hyperparams["UPDATE_EVERY"]):
-                    #collect a batch of experience to use for training
-                    batch = self.memory.sample_batch(self.s.training_hyperparams["BATCH_SIZE"])
-                    try:
-                        #perform the update using the batch
-                        q_loss, pi_loss, entropy_d, entropy_c = self.update(data=batch)
-                        #update logging: running loss
-                        self.s.running_loss[0] += (1.-self.s.training_hyperparams["GAMMA"])*(q_loss - self.s.running_loss[0])
-                        self.s.running_loss[1] += (1.-self.s.training_hyperparams["GAMMA"])*(pi_loss - self.s.running_loss[1])
-                        self.s.running_loss[2] += (1.-self.s.training_hyperparams["GAMMA"])*(self.current_alpha_d() - self.s.running_loss[2])
-                        self.s.running_loss[3] += (1.-self.s.training_hyperparams["GAMMA"])*(self.current_alpha_c() - self.s.running_loss[3])
-                        self.s.running_loss[4] += (1.-self.s.training_hyperparams["GAMMA"])*(entropy_d - self.s.running_loss[4])
-                        self.s.running_loss[5] += (1.-self.s.training_hyperparams["GAMMA"])*(entropy_c - self.s.running_loss[5])
-                    except RuntimeError as e:
-                        #there could be an error doing updates, e.g. covariance singular. In such case i log it
-                        logging.error(f"Exception at step {self.s.steps_done} during self.update: {e}")
-
-            #update logging: reward and action
-            self.s.running_reward += (1.-self.s.training_hyperparams["GAMMA"])*(r - self.s.running_reward)
-            self.s.actions.append([self.s.steps_done] + tri_a.view(-1).tolist() + a.tolist() ) 
-            
-            #if present, update running estimate of the multiobjective environments
-            if "multi_obj" in info_dict:
-                if self.s.running_multi_obj is None:
-                    self.s.running_multi_obj = np.zeros(len(info_dict["multi_obj"]) ,dtype=np.float32)
-                self.s.running_multi_obj += (1.-self.s.training_hyperparams["GAMMA"])*(info_dict["multi_obj"]
-                                                                                        -self.s.running_multi_obj  )
+            #if it's time, resample the trade-offs used to choose the actions
+            self.resample_trade_off(previous_steps)
 
-            #if there is something returned from the environment that must be logged
-            if "log_info" in info_dict:
-                logging.error(info_dict["log_info"])
+            # Perform NN parameters updates, once for every multiple of UPDATE_EVERY crossed after UPDATE_AFTER
+            bursts = self.multiples_crossed(max(previous_steps, self.s.training_hyperparams["UPDATE_AFTER"]),
+                                            self.s.training_hyperparams["UPDATE_EVERY"])
+            if bursts > 0:
+                self.perform_updates(bursts * self.updates_per_burst())
+
+            #update logging: reward and action of the first replica
+            running_reward += (1.-gamma)*(r.mean() - running_reward)
+            actions_steps.append(self.s.steps_done)
+            actions.append(torch.cat([tri_a[:1], a[0]]))
+
+            #if present, update running estimate of the multiobjective environments
+            if multi_obj is not None:
+                if running_multi_obj is None:
+                    running_multi_obj = torch.zeros(multi_obj.shape[1], dtype=torch.float32, device=self.s.device)
+                running_multi_obj += (1.-gamma)*(multi_obj.mean(dim=0) - running_multi_obj)
 
             #if its time to log
-            if self.s.steps_done % self.s.training_hyperparams["LOG_STEPS"] == 0 :
+            if self.multiples_crossed(previous_steps, self.s.training_hyperparams["LOG_STEPS"]) > 0:
                 #update log files
+                self.store_running_logs(running_reward, running_multi_obj, actions_steps, actions)
                 self.update_log_files()
-                
+
                 #plot the logs
-                if output_plots:
+                if output_plots and not self.s.log_info["headless"]:
                     self.plot_logs()
-            
+
+            #if it's time, append a snapshot of the policy. It's done before saving, so the saved logs include it
+            self.snapshot_policy(previous_steps)
+
             #if it's time to save the full training state
-            if self.s.steps_done % self.s.training_hyperparams["SAVE_STATE_STEPS"] == 0:
+            if self.multiples_crossed(previous_steps, self.s.training_hyperparams["SAVE_STATE_STEPS"]) > 0:
+                self.store_running_logs(running_reward, running_multi_obj, actions_steps, actions)
                 self.save_full_state()
 
+            #if it's time, evaluate the policy in the background
+            self.evaluate_in_background(previous_steps)
+
+        self.store_running_logs(running_reward, running_multi_obj, actions_steps, actions)
+
+    def step_buffers(self):
+        """
+        If the environment implements step_fast, it's used by perform_step: the actions chosen by the agent are
+        always in bound, and the new state is written into a preallocated buffer. Two buffers are alternated, since
+        self.s.state can share memory with the buffer of the previous step.
+
+        Returns:
+            (list(np.array)): the two buffers to pass to perform_step, or None if step_fast is not implemented
+        """
+        if not hasattr(self.env, "step_fast"):
+            return None
+        return [np.empty(self.env.observation_space.shape, dtype=np.float32) for _ in range(2)]
+
+    def random_action(self):
+        """ returns a uniformly random action, as (discrete action, continuous action) tensors """
+        tri_a = action_to_tensor(self.env.action_space[0].sample(),self.s.device)
+        a = action_to_tensor(self.env.action_space[1].sample(),self.s.device)
+        return tri_a, a
+
+    def perform_step(self, tri_a, a, o2_buffers=None):
+        """
+        Performs the action on the environment, stores the experience in the replay buffer, moves to the next
+        state and updates the running reward, the running multi objectives and the logged actions.
+
+        Args:
+            tri_a (torch.Tensor): the discrete action
+            a (torch.Tensor): the continuous action
+            o2_buffers (list(np.array)): buffers returned by step_buffers. If None, env.step is used
+        """
+        #perform the action on environment
+        if o2_buffers is not None:
+            o2_np = o2_buffers[self.s.steps_done % 2]
+            r, pow, diss = self.env.step_fast(int(np.round(tri_a.cpu().numpy())), a.cpu().numpy()[0], o2_np)
+            info_dict = None
+            multi_obj = (pow, -diss)
+        else:
+            o2_np, r, _, info_dict = self.env.step( (int(np.round(tri_a.cpu().numpy())), a.cpu().numpy()) )
+            multi_obj = info_dict.get("multi_obj", None)
+        o2 = state_to_tensor(o2_np,self.s.device)
+        
+        # Store experience to replay buffer
+        self.memory.store(self.s.state, tri_a, a, r, o2, multi_obj)
+        
+        #move to the next state
+        self.s.state = o2
+
+        #increase the step counter
+        self.s.steps_done += 1
+
+        #if it's time, resample the trade-off used to choose the actions
+        self.resample_trade_off(self.s.steps_done - 1)
+
+        #update logging: reward and action
+        self.s.running_reward += (1.-self.s.training_hyperparams["GAMMA"])*(r - self.s.running_reward)
+        self.s.actions.append([self.s.steps_done] + tri_a.view(-1).tolist() + a.tolist() ) 
+        
+        #if present, update running estimate of the multiobjective environments
+        if multi_obj is not None:
+            if self.s.running_multi_obj is None:
+                self.s.running_multi_obj = np.zeros(len(multi_obj) ,dtype=np.float32)
+            self.s.running_multi_obj += (1.-self.s.training_hyperparams["GAMMA"])*(np.asarray(multi_obj,
+                                                                dtype=np.float32) - self.s.running_multi_obj)
+
+        #if there is something returned from the environment that must be logged
+        if info_dict is not None and "log_info" in info_dict:
+            logging.error(info_dict["log_info"])
+
+    def log_and_save(self, output_plots = True):
+        """
+        Updates the log files (and eventually plots them) every LOG_STEPS steps, and saves the full training
+        state every SAVE_STATE_STEPS steps.
+
+        Args:
+            output_plots (bool): if true, it will output a plot with all the running logs.
+                It is ignored in headless mode (see log_info in initialize_new_train).
+        """
+        #if its time to log
+        if self.s.steps_done % self.s.training_hyperparams["LOG_STEPS"] == 0 :
+            #update log files
+            self.update_log_files()
+            
+            #plot the logs
+            if output_plots and not self.s.log_info["headless"]:
+                self.plot_logs()
+        
+        #if it's time, append a snapshot of the policy. It's done before saving, so the saved logs include it
+        self.snapshot_policy(self.s.steps_done - 1)
+
+        #if it's time to save the full training state
+        if self.s.steps_done % self.s.training_hyperparams["SAVE_STATE_STEPS"] == 0:
+            self.save_full_state()
+
+        #if it's time, evaluate the policy in the background
+        self.evaluate_in_background(self.s.steps_done - 1)
+
+    def store_running_logs(self, running_reward, running_multi_obj, actions_steps, actions):
+        """
+        Moves the running logs accumulated as tensors by train_vectorized to self.s, and empties
+        actions_steps and actions.
+
+        Args:
+            running_reward (torch.Tensor): the running reward
+            running_multi_obj (torch.Tensor): the running multi objectives, or None
+            actions_steps (list(int)): the steps of the actions to log
+            actions (list(torch.Tensor)): the actions to log, each one with the discrete and continuous actions
+        """
+        self.s.running_reward = running_reward.item()
+        if running_multi_obj is not None:
+            self.s.running_multi_obj = running_multi_obj.cpu().numpy()
+        if len(actions) > 0:
+            self.s.actions += [[step] + action for step, action in zip(actions_steps, torch.stack(actions).tolist())]
+        actions_steps.clear()
+        actions.clear()
+
     def save_full_state(self):
         """
         Saves the full state to file, so that training can continue exactly from here by loading the file.
@@ -375,9 +796,12 @@ class SacTrain(object):
         for file in Path(self.s.log_session.log_dir).iterdir():
             if not file.is_dir() :
                 shutil.copy(str(file), os.path.join(saved_logs_path, file.name))
+        #record the latest saved state in the catalog of the data folder
+        self.update_run_catalog(self.s.log_session.log_dir, latest_state=path_location)
 
     def evaluate_current_policy(self, deterministic, steps=1000, suppress_show=False, gamma=None,actions_to_plot=400,
-                                save_policy_to_file_name = None,actions_ylim=None,dont_clear_output=False):
+                                save_policy_to_file_name = None,actions_ylim=None,dont_clear_output=False,
+                                trade_off=None):
         """
         creates a copy of the environment, and evaluates the current policy in a deterministic or probabilistic way.
         It return the final running rewards, and plots the running rewards and actions.
@@ -391,10 +815,15 @@ class SacTrain(object):
             actions_to_plot(int): how many of the latest actions to show in the plots
             save_policy_to_file_name(str): if specified, it will save the chosen actions to file, so they can be plotted
             actions_ylim(tuple(float,float)): the y_lim for plotting the actions
+            trade_off(float): only used if TRADE_OFF_CONDITIONED. The trade-off a on which the policy is conditioned, and
+                used to compute the reward. If None, the "a" in env_params is used
 
         Returns:
             (float): the final value of the running return
         """
+        #in headless mode nothing is plotted
+        if self.s.log_info.get("headless", False):
+            suppress_show = True
         #if gamma is not specified, it will use the one used during training
         if gamma is None:
             gamma = self.s.training_hyperparams["GAMMA"]
@@ -402,18 +831,295 @@ class SacTrain(object):
         if save_policy_to_file_name is not None:
             save_policy_to_file_name = os.path.join(self.s.log_session.log_dir, self.SAVED_POLICY_DIR_NAME, save_policy_to_file_name)
 
+        #with a trade-off conditioned agent, the policy and the environment use the chosen trade-off
+        env_params = self.s.env_params
+        if self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            if trade_off is None:
+                trade_off = self.s.env_params["a"]
+            env_params = dict(self.s.env_params, a=trade_off)
+
         #evaluates the policy
-        return extra.test_policy(self.return_env_class_from_name(), self.s.env_params,
+        return extra.test_policy(self.return_env_class_from_name(), env_params,
                      lambda o: self.action_to_numpy(self.get_action(torch.as_tensor(o,dtype=torch.float32,device=self.s.device),
-                     deterministic=deterministic)), gamma, True, steps=steps, env_state = self.s.state.cpu().numpy(),
+                     deterministic=deterministic, trade_off=trade_off)), gamma, True, steps=steps, env_state = self.single_env_state(),
                      suppress_show=suppress_show,actions_to_plot=actions_to_plot,save_policy_to_file_name=save_policy_to_file_name,
-                     actions_ylim=actions_ylim,dont_clear_output=dont_clear_output)
+                     actions_ylim=actions_ylim,dont_clear_output=dont_clear_output,fast_step=True)
+
 
+    def evaluate_pareto_front(self, trade_offs, deterministic=True, steps=1000, gamma=None):
+        """
+        Evaluates the policy of a trade-off conditioned agent (see TRADE_OFF_CONDITIONED) for each value of the
+        power-dissipation trade-off a in trade_offs, without plotting. Since a single agent is trained for all
+        the values of a, this gives the whole Pareto front of power and dissipation.
+
+        Args:
+            trade_offs (list(float)): the values of a
+            deterministic(bool): if the chosen actions should be deterministic or not
+            steps(int): how many steps of the environment to do to evaluate each policy
+            gamma(float): the exponential average factor to compute the return. If None, the one used for training
+
+        Raises:
+            NameError: if the agent is not trade-off conditioned
+
+        Returns:
+            (np.array): for each value of a, a row with a, the return, the power and minus the dissipation
+        """
+        if not self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            raise NameError("The Pareto front can only be evaluated if TRADE_OFF_CONDITIONED is True")
+        front = []
+        for trade_off in trade_offs:
+            _, objectives, _ = self.evaluate_current_policy(deterministic, steps=steps, suppress_show=True, gamma=gamma,
+                                                            trade_off=trade_off)
+            front.append(np.concatenate([[trade_off], objectives]))
+        return np.array(front)
+
+    def wait_for_evaluations(self):
+        """ waits until the policy snapshots sent to the background evaluation (see EVAL_STEPS) are evaluated """
+        if self.evaluator is not None:
+            self.evaluator.close()
+            self.evaluator = None
+            atexit.unregister(self.wait_for_evaluations)
 
     #Methods that should only be used internally:
     def action_to_numpy(self,action):
         return (int(np.round(action[0].cpu().numpy())), action[1].cpu().numpy())
 
+    def initialize_default_hyperparams(self):
+        """ sets the default value of the optional hyperparameters that are not passed in (for compatibility) """
+        if not "NUM_ENVS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["NUM_ENVS"] = 1
+        if not "UPDATES_PER_STEP" in self.s.training_hyperparams:
+            self.s.training_hyperparams["UPDATES_PER_STEP"] = 1.
+        if not "TRADE_OFF_CONDITIONED" in self.s.training_hyperparams:
+            self.s.training_hyperparams["TRADE_OFF_CONDITIONED"] = False
+        if not "TRADE_OFF_RANGE" in self.s.training_hyperparams:
+            self.s.training_hyperparams["TRADE_OFF_RANGE"] = (0.,1.)
+        if not "TRADE_OFF_RESAMPLE_STEPS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["TRADE_OFF_RESAMPLE_STEPS"] = 1000
+        if not "WARM_START_RANDOM_STEPS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["WARM_START_RANDOM_STEPS"] = 0
+        if not "EVAL_STEPS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["EVAL_STEPS"] = 0
+        if not "EVAL_ENV_STEPS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["EVAL_ENV_STEPS"] = 1000
+        if not "SNAPSHOT_STEPS" in self.s.training_hyperparams:
+            self.s.training_hyperparams["SNAPSHOT_STEPS"] = 0
+
+    def create_env(self):
+        """
+        Creates the environment from self.s.env_params. If NUM_ENVS > 1, it creates the batched counterpart
+        of the environment with NUM_ENVS replicas.
+        """
+        env_class = self.return_env_class_from_name()
+        if self.s.training_hyperparams["NUM_ENVS"] > 1:
+            batched_env_class = self.return_batched_env_class(env_class)
+            if getattr(batched_env_class, "torch_native", False):
+                #torch environments are placed on the training device
+                return batched_env_class(self.s.env_params, self.s.training_hyperparams["NUM_ENVS"], device=self.s.device)
+            return batched_env_class(self.s.env_params, self.s.training_hyperparams["NUM_ENVS"])
+        return env_class(self.s.env_params)
+
+    def return_batched_env_class(self, env_class):
+        """
+        Returns the batched counterpart of env_class, i.e. the class defined in the same module whose
+        single_env_class is env_class.
+
+        Raises:
+            NameError: if env_class has no batched counterpart
+        """
+        for obj in vars(sys.modules[env_class.__module__]).values():
+            if isinstance(obj, type) and getattr(obj, "single_env_class", None) is env_class:
+                return obj
+        raise NameError(f"Environment {env_class.__name__} has no batched counterpart, so NUM_ENVS must be 1")
+
+    def single_env_state(self):
+        """ returns the current state of the environment as a numpy array. With NUM_ENVS > 1, the state of the first replica """
+        return self.s.state.cpu().numpy().reshape(-1, self.env.observation_space.shape[0])[0]
+
+    def shorten_schedules_for_warm_start(self, save_dir_path):
+        """
+        Adapts the training hyperparameters to a warm start from the saved state in save_dir_path: the target
+        entropies start from the values reached by that training session, INITIAL_RANDOM_STEPS is replaced by
+        WARM_START_RANDOM_STEPS, and UPDATE_AFTER is lowered accordingly. The hyperparameters are copied, so the
+        dictionary passed to initialize_new_train is not modified.
+
+        Args:
+            save_dir_path (str): location of the saved state of the training session to warm start from
+
+        Raises:
+            NameError: if the saved training session used a different environment
+        """
+        source = SacTrain()
+        source.s = extra.unpickle_data(os.path.join(save_dir_path, self.S_FILE_NAME_BZ2),
+                                 uncompressed_file = os.path.join(save_dir_path, self.S_FILE_NAME))
+        source.initialize_default_hyperparams()
+        if source.s.env_params["env_name"] != self.s.env_params["env_name"]:
+            raise NameError(f"The saved state in {save_dir_path} is of the environment "
+                            f"{source.s.env_params['env_name']}, not {self.s.env_params['env_name']}")
+
+        hyperparams = dict(self.s.training_hyperparams)
+        hyperparams["H_D_START"] = float(source.current_h_d())
+        hyperparams["H_C_START"] = float(source.current_h_c())
+        hyperparams["INITIAL_RANDOM_STEPS"] = hyperparams["WARM_START_RANDOM_STEPS"]
+        hyperparams["UPDATE_AFTER"] = min(hyperparams["UPDATE_AFTER"],
+                                            max(hyperparams["WARM_START_RANDOM_STEPS"], hyperparams["BATCH_SIZE"]))
+        self.s.training_hyperparams = hyperparams
+
+    def saved_state_path(self, log_folder, specific_state_folder = None):
+        """
+        Returns the location of a saved training state of the training session in log_folder. The states are
+        saved as folders numbered as "0", "1",...
+
+        Args:
+            log_folder (str): folder of the training session
+            specific_state_folder (str): a specific save. If None, the latest one.
+        """
+        save_dir_path = os.path.join(log_folder, self.STATE_FOLDER_NAME)
+        if specific_state_folder is not None:
+            return os.path.join(save_dir_path,specific_state_folder) 
+        #must find the latest folder if not specificed
+        path = Path(save_dir_path)
+        folders = [dir.name for dir in path.iterdir() if dir.is_dir()]
+        index = int(folders[0])
+        for folder in folders:
+            index = max(index, int(folder))
+        return os.path.join(save_dir_path, str(index)) 
+
+    def multiples_crossed(self, previous_steps, every):
+        """ returns how many multiples of every are in the interval (previous_steps, self.s.steps_done] """
+        return max(self.s.steps_done // every - previous_steps // every, 0)
+
+    def evaluate_in_background(self, previous_steps):
+        """
+        If a multiple of EVAL_STEPS is in the interval (previous_steps, self.s.steps_done], sends a snapshot of the
+        policy to the background evaluation process, starting it if necessary (see AsyncEvaluator)
+        """
+        eval_steps = self.s.training_hyperparams["EVAL_STEPS"]
+        if eval_steps <= 0 or self.multiples_crossed(previous_steps, eval_steps) == 0:
+            return
+        if self.evaluator is None:
+            trade_off = self.s.env_params["a"] if self.s.training_hyperparams["TRADE_OFF_CONDITIONED"] else None
+            self.evaluator = AsyncEvaluator(self.ac.pi, self.return_env_class_from_name(), self.s.env_params,
+                                trade_off, self.s.training_hyperparams["GAMMA"],
+                                self.s.training_hyperparams["EVAL_ENV_STEPS"],
+                                os.path.join(self.s.log_session.log_dir, self.EVALUATION_FILE_NAME))
+            #the pending evaluations are completed before exiting
+            atexit.register(self.wait_for_evaluations)
+        self.evaluator.submit(self.s.steps_done, self.ac.pi)
+
+    def snapshot_policy(self, previous_steps):
+        """
+        If a multiple of SNAPSHOT_STEPS is in the interval (previous_steps, self.s.steps_done], appends the
+        parameters of the policy to the stream of policy snapshots of the log folder
+        (see policy_snapshots.PolicySnapshotWriter)
+        """
+        snapshot_steps = self.s.training_hyperparams["SNAPSHOT_STEPS"]
+        if snapshot_steps <= 0 or self.multiples_crossed(previous_steps, snapshot_steps) == 0:
+            return
+        if self.snapshot_writer is None or self.snapshot_writer.log_dir != self.s.log_session.log_dir:
+            self.snapshot_writer = policy_snapshots.PolicySnapshotWriter(self.s.log_session.log_dir, self.ac.pi,
+                                    self.network_observation_space(), self.env.action_space,
+                                    self.s.training_hyperparams["HIDDEN_SIZES"],
+                                    self.s.training_hyperparams["MIN_COV_EIGEN"])
+        self.snapshot_writer.append(self.s.steps_done, self.ac.pi)
+
+    def updates_per_burst(self):
+        """ returns the number of updates done every UPDATE_EVERY steps """
+        return int(round(self.s.training_hyperparams["UPDATE_EVERY"] * self.s.training_hyperparams["UPDATES_PER_STEP"]))
+
+    def network_observation_space(self):
+        """
+        Returns the observation space of the NNs. It's the one of the environment, with the trade-off a
+        appended as last variable if TRADE_OFF_CONDITIONED.
+        """
+        space = self.env.observation_space
+        if not self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            return space
+        low, high = self.s.training_hyperparams["TRADE_OFF_RANGE"]
+        return type(space)(low=np.append(space.low, np.float32(low)), high=np.append(space.high, np.float32(high)),
+                            dtype=np.float32)
+
+    def sample_trade_offs(self, n):
+        """ returns a torch.Tensor with n values of the trade-off a, sampled uniformly in TRADE_OFF_RANGE """
+        low, high = self.s.training_hyperparams["TRADE_OFF_RANGE"]
+        return low + (high-low)*torch.rand(n, dtype=torch.float32, device=self.s.device)
+
+    def resample_trade_off(self, previous_steps=None):
+        """
+        If TRADE_OFF_CONDITIONED, it samples the trade-offs used to choose the actions (one for each replica of
+        the environment) if they were never chosen or if a multiple of TRADE_OFF_RESAMPLE_STEPS was crossed
+        since previous_steps.
+
+        Args:
+            previous_steps (int): value of steps_done before the last step
+        """
+        if not self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            return
+        if self.s.trade_off is None or (previous_steps is not None and
+                    self.multiples_crossed(previous_steps, self.s.training_hyperparams["TRADE_OFF_RESAMPLE_STEPS"]) > 0):
+            self.s.trade_off = self.sample_trade_offs(self.s.training_hyperparams["NUM_ENVS"])
+
+    def condition_on_trade_off(self, o, trade_off):
+        """
+        Appends the trade-off a to the states, as required by the NNs if TRADE_OFF_CONDITIONED.
+
+        Args:
+            o (torch.Tensor): a single state, with shape (obs_dim,), or a batch of states, with shape (batch, obs_dim)
+            trade_off (float or torch.Tensor): a single value of a, or one value for each state of the batch
+
+        Returns:
+            (torch.Tensor): the states with the trade-off as last variable
+        """
+        trade_off = torch.as_tensor(trade_off, dtype=torch.float32, device=o.device)
+        if o.dim() == 1:
+            return torch.cat([o, trade_off.view(1)])
+        return torch.cat([o, trade_off.view(-1,1).expand(o.shape[0],1)], dim=1)
+
+    def condition_batch(self, data):
+        """
+        Conditions a batch of experience drawn from the replay buffer on random values of the trade-off a: a value
+        of a is sampled for each transition, it is appended to the states, and the reward is recomputed from the
+        stored multi objectives [pow, -diss] as a*pow - (1-a)*diss.
+
+        Args:
+            data (dict): batch of experience drawn from the replay buffer, with the multi objectives
+
+        Returns:
+            (dict): the conditioned batch of experience
+        """
+        trade_off = self.sample_trade_offs(data["obs"].shape[0])
+        data["obs"] = self.condition_on_trade_off(data["obs"], trade_off)
+        data["obs2"] = self.condition_on_trade_off(data["obs2"], trade_off)
+        data["rew"] = trade_off*data["multi_obj"][:,0] + (1.-trade_off)*data["multi_obj"][:,1]
+        return data
+
+    def perform_updates(self, num_updates):
+        """
+        Performs num_updates updates of the NN parameters, each one on a batch sampled from the replay buffer,
+        and updates the running loss.
+
+        Args:
+            num_updates (int): number of updates to perform
+        """
+        for _ in range(num_updates):
+            #collect a batch of experience to use for training
+            batch = self.memory.sample_batch(self.s.training_hyperparams["BATCH_SIZE"])
+            if self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+                batch = self.condition_batch(batch)
+            try:
+                #perform the update using the batch
+                q_loss, pi_loss, entropy_d, entropy_c = self.update(data=batch)
+                #update logging: running loss
+                self.s.running_loss[0] += (1.-self.s.training_hyperparams["GAMMA"])*(q_loss - self.s.running_loss[0])
+                self.s.running_loss[1] += (1.-self.s.training_hyperparams["GAMMA"])*(pi_loss - self.s.running_loss[1])
+                self.s.running_loss[2] += (1.-self.s.training_hyperparams["GAMMA"])*(self.current_alpha_d() - self.s.running_loss[2])
+                self.s.running_loss[3] += (1.-self.s.training_hyperparams["GAMMA"])*(self.current_alpha_c() - self.s.running_loss[3])
+                self.s.running_loss[4] += (1.-self.s.training_hyperparams["GAMMA"])*(entropy_d - self.s.running_loss[4])
+                self.s.running_loss[5] += (1.-self.s.training_hyperparams["GAMMA"])*(entropy_c - self.s.running_loss[5])
+            except RuntimeError as e:
+                #there could be an error doing updates, e.g. covariance singular. In such case i log it
+                logging.error(f"Exception at step {self.s.steps_done} during self.update: {e}")
+
     def initialize_log_session(self, reset_running_vars = True):
         """
         creates a folder, named with the current time and date, for logging and saving a training session,
@@ -464,6 +1170,16 @@ class SacTrain(object):
         #set default value for logging multiobjective if it's not passed in (for compatibility)
         if not "log_running_multi_obj" in self.s.log_info:
             self.s.log_info["log_running_multi_obj"] = True
+        #set default value for headless mode if it's not passed in (for compatibility)
+        if not "headless" in self.s.log_info:
+            self.s.log_info["headless"] = False
+        #set default value for the catalog if it's not passed in (for compatibility)
+        if not "catalog" in self.s.log_info:
+            self.s.log_info["catalog"] = True
+
+        #add the training session to the catalog of the data folder
+        self.update_run_catalog(log_dir, params=dict(chain(self.s.env_params.items(),
+                                                            self.s.training_hyperparams.items())))
 
         return extra.LogSession(log_dir, state_dir, self.s.log_info["log_running_reward"], self.s.log_info["log_running_loss"],
                              self.s.log_info["log_running_multi_obj"],self.s.log_info["log_actions"], running_reward_file,
@@ -472,7 +1188,7 @@ class SacTrain(object):
     def initialize_nns(self):
         """ Initializes the NNs for the soft actor critic method """
         #create the main NNs
-        self.ac = core_tri.MLPActorCritic(self.env.observation_space, self.env.action_space,
+        self.ac = core_tri.MLPActorCritic(self.network_observation_space(), self.env.action_space,
                                      hidden_sizes=self.s.training_hyperparams["HIDDEN_SIZES"],
                                      min_cov_eigen=self.s.training_hyperparams["MIN_COV_EIGEN"]).to(self.s.device)
         #create the target NNs
@@ -481,11 +1197,12 @@ class SacTrain(object):
         for p in self.ac_targ.parameters():
             p.requires_grad = False
 
-        # List of parameters for both Q-networks (saved for convenience)
-        self.q_params = chain(self.ac.q1.parameters(), self.ac.q2.parameters())
+        # List of parameters for both Q-networks (saved for convenience). It must be a list and not an iterator, since
+        # it's used by the optimizer and then at every update to freeze the Q-networks during the policy update
+        self.q_params = list(chain(self.ac.q1.parameters(), self.ac.q2.parameters()))
 
         #list for both alpha (continuous and discrete) params
-        self.alpha_params = chain(self.ac.alpha_d.parameters(),self.ac.alpha_c.parameters())
+        self.alpha_params = list(chain(self.ac.alpha_d.parameters(),self.ac.alpha_c.parameters()))
 
         # Count and print number of variables 
         var_counts = tuple(core_tri.count_vars(module) for module in [self.ac.pi, self.ac.q1, self.ac.q2])
@@ -518,16 +1235,36 @@ class SacTrain(object):
     def current_alpha_c(self):
         return self.ac.alpha_c_no_grad()
 
-    def get_action(self, o, deterministic=False):
+    def get_action(self, o, deterministic=False, trade_off=None):
         """ Returns an on-policy action based on the state passed in.
         This computation does not compute the gradients.
 
         Args:
             o (torch.Tensor): state from which to compute action
             deterministic (bool): wether the action should be sampled or deterministic  
+            trade_off (float): only used if TRADE_OFF_CONDITIONED. The trade-off a on which the policy is conditioned.
+                If None, the one currently used for training
         """
+        if self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            o = self.condition_on_trade_off(o, self.s.trade_off if trade_off is None else trade_off)
         return self.ac.act(o, deterministic)
 
+    def get_action_batch(self, o, deterministic=False):
+        """ Returns on-policy actions based on a batch of states, with a single forward pass of the policy.
+        This computation does not compute the gradients.
+
+        Args:
+            o (torch.Tensor): batch of states, with shape (batch, obs_dim)
+            deterministic (bool): wether the actions should be sampled or deterministic
+
+        Returns:
+            (torch.Tensor, torch.Tensor): the discrete actions, with shape (batch,), and the continuous
+                actions, with shape (batch, act_dim)
+        """
+        if self.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+            o = self.condition_on_trade_off(o, self.s.trade_off)
+        return self.ac.act_batch(o, deterministic)
+
     def is_zero(self,tens):
         """ Checks which elements of tens are nearly zero.
         Args:
@@ -689,7 +1426,8 @@ class SacTrain(object):
         self.q_optimizer.step()
 
         #update of the policy function
-        # Freeze Q-networks since they will not be updated
+        # Freeze Q-networks since they will not be updated. This way loss_pi.backward() only propagates the gradient
+        # through the Q-networks to the actions, without computing the gradient of their parameters
         for p in self.q_params:
             p.requires_grad = False
 
@@ -737,6 +1475,23 @@ class SacTrain(object):
             np.savetxt(f, self.s.actions)
             f.close()
             self.s.actions = []
+        #update the catalog of the data folder
+        self.update_run_catalog(self.s.log_session.log_dir, steps_done=self.s.steps_done,
+                                running_reward=self.s.running_reward, running_multi_obj=self.s.running_multi_obj)
+
+    def update_run_catalog(self, log_dir, **fields):
+        """
+        Updates the entry of the training session log_dir in the catalog CATALOG_FILE_NAME of the data folder
+        containing it (see run_catalog.RunCatalog.update_run for the fields), unless log_info["catalog"] is False.
+        Errors accessing the catalog are logged, and don't stop the training.
+        """
+        if not self.s.log_info["catalog"]:
+            return
+        try:
+            catalog_file = os.path.join(os.path.dirname(os.path.normpath(log_dir)), self.CATALOG_FILE_NAME)
+            run_catalog.RunCatalog(catalog_file).update_run(log_dir, **fields)
+        except sqlite3.Error as e:
+            logging.error(f"Exception at step {self.s.steps_done} updating the run catalog: {e}")
 
     def append_log_line(self, data, file, count):
         """appends count and data to file as plain text """
@@ -746,6 +1501,8 @@ class SacTrain(object):
 
     def plot_logs(self):
         """ displays a plot of the current running reward, losses and actions """
+        #imported here, so that training without plots doesn't import matplotlib and IPython
+        import plotting
         plotting.plot_sac_logs(self.s.log_session.log_dir, is_tri=True, 
                 plot_to_file_line = None, suppress_show=False, save_plot = False, extra_str="", actions_to_plot=80)
 
@@ -767,4 +1524,319 @@ class SacTrain(object):
             raise NameError(f"Environment named {self.s.env_params['env_name']} not found in sac_tri_envs_dis")
 
 
+class EnsembleSacTrain(object):
+    """
+    Trains an ensemble of independent agents in a single process, e.g. with different seeds, or with neighbouring
+    values of the trade-off a. Each member is a SacTrain, with its own environment, replay buffer, logging folder
+    and saved states, so each member can be later loaded alone with SacTrain.load_train. The NNs of all the members
+    are stacked into a single core_tri.MLPActorCritic with ensemble_size members: the actions of all the members are
+    chosen with a single forward pass, and all the members are updated at once with batched matrix multiplications.
+    Since the optimizers act elementwise, each member is updated as if it were trained alone.
+    All the members share the training hyperparameters, must have NUM_ENVS = 1 and TRADE_OFF_CONDITIONED False, and
+    their env_params must give the same observation and action spaces.
+
+    Usage:
+        After initialization either
+        - call initialize_new_train() to initialize a new ensemble of training sessions
+        - call load_train() to load existing training sessions
+        The members, e.g. to evaluate their policies, are in self.members. As in SacTrain, the folder where
+        new training sessions are saved is SAVE_DATA_DIR.
+    """
+
+    #folder where the training sessions of new members are saved
+    SAVE_DATA_DIR = SacTrain.SAVE_DATA_DIR
+
+    #Methods that can be called:
+
+    def initialize_new_train(self, env_class, env_params_list, training_hyperparams, log_info):
+        """
+        Initializes a new training session for each member of the ensemble.
+
+        Args:
+            env_class (gym.Env): class representing the quantum thermal machine environment to learn
+            env_params_list (list(dict)): the env_params of each member. See SacTrain.initialize_new_train
+            training_hyperparams (dict): training hyperparameters shared by all the members.
+                See SacTrain.initialize_new_train
+            log_info (dict): logging info. See SacTrain.initialize_new_train. The index of the member is appended
+                to "extra_str"
+        """
+        self.members = []
+        for i, env_params in enumerate(env_params_list):
+            member = SacTrain()
+            member.SAVE_DATA_DIR = self.SAVE_DATA_DIR
+            member.initialize_new_train(env_class, env_params, dict(training_hyperparams),
+                                        dict(log_info, extra_str=f"{log_info['extra_str']}_member{i}"))
+            self.members.append(member)
+        self.initialize_ensemble()
+
+    def load_train(self, log_folders, specific_state_folder = None):
+        """
+        Loads a training session for each member of the ensemble, e.g. saved by a previous ensemble.
+
+        Args:
+            log_folders (list(str)): folder of the training session of each member
+            specific_state_folder (str): can load a specific save. If None, loads the latest one.
+        """
+        self.members = []
+        for log_folder in log_folders:
+            member = SacTrain()
+            member.load_train(log_folder, specific_state_folder)
+            self.members.append(member)
+        self.initialize_ensemble()
+
+    def train(self, steps, output_plots = True):
+        """
+        Runs "steps" number of training steps for each member. Takes care of saving and logging. It can be called
+        multiple times and it will keep training the same models. At the end, the NNs of the members are updated.
+
+        Args:
+            steps (int): number of training steps to perform
+            output_plots (bool): if true, it will output a plot with all the running logs of each member every
+                LOG_STEPS. It is ignored in headless mode (see log_info in initialize_new_train).
+        """
+        hyperparams = self.members[0].s.training_hyperparams
+        o2_buffers = [member.step_buffers() for member in self.members]
+
+        for _ in range(steps):
+            steps_done = self.members[0].s.steps_done
+
+            #choose the actions of all the members (random uniform for first INITIAL_RANDOM_STEPS, then according
+            #to the policies)
+            if steps_done > hyperparams["INITIAL_RANDOM_STEPS"]:
+                tri_a, a = self.ac.act_batch(torch.stack([member.s.state for member in self.members]))
+            else:
+                tri_a, a = zip(*[member.random_action() for member in self.members])
+
+            #perform the actions, store the experience and update the running logs
+            for i, member in enumerate(self.members):
+                member.perform_step(tri_a[i], a[i], o2_buffers[i])
+            steps_done += 1
+
+            # Perform NN parameters updates
+            if steps_done > hyperparams["UPDATE_AFTER"] and steps_done % hyperparams["UPDATE_EVERY"] == 0:
+                self.perform_updates(self.members[0].updates_per_burst())
+
+            #if it's time, log, save the full training state, snapshot and evaluate the policies. The NNs of the
+            #members must be updated first
+            if steps_done % hyperparams["SAVE_STATE_STEPS"] == 0 or \
+                (hyperparams["EVAL_STEPS"] > 0 and steps_done % hyperparams["EVAL_STEPS"] == 0) or \
+                (hyperparams["SNAPSHOT_STEPS"] > 0 and steps_done % hyperparams["SNAPSHOT_STEPS"] == 0):
+                self.sync_members()
+            for member in self.members:
+                member.log_and_save(output_plots)
+
+        self.sync_members()
+
+    def sync_members(self):
+        """ copies the parameters of the ensemble into the NNs of each member """
+        for i, member in enumerate(self.members):
+            member.ac.load_state_dict(self.ac.member_state_dict(i))
+            member.ac_targ.load_state_dict(self.ac_targ.member_state_dict(i))
+
+    #Methods that should only be used internally:
+
+    def initialize_ensemble(self):
+        """
+        Checks that the members can be trained together, and creates the NNs of the ensemble, initialized
+        with the ones of the members, and the optimizers.
+
+        Raises:
+            NameError: if the members can't be trained together
+        """
+        first = self.members[0]
+        hyperparams = first.s.training_hyperparams
+        for member in self.members:
+            if member.s.training_hyperparams["NUM_ENVS"] != 1 or member.s.training_hyperparams["TRADE_OFF_CONDITIONED"]:
+                raise NameError("The members of an ensemble must have NUM_ENVS = 1 and TRADE_OFF_CONDITIONED False")
+            if member.s.steps_done != first.s.steps_done:
+                raise NameError("The members of an ensemble must have done the same number of steps")
+            same_spaces = member.env.action_space[0].n == first.env.action_space[0].n and all(
+                np.array_equal(getattr(member_space, bound), getattr(first_space, bound))
+                for member_space, first_space in [(member.env.observation_space, first.env.observation_space),
+                                                  (member.env.action_space[1], first.env.action_space[1])]
+                for bound in ["low", "high"])
+            if not same_spaces:
+                raise NameError("The members of an ensemble must have the same observation and action spaces")
+
+        #create the NNs of the ensemble, initialized with the ones of the members
+        self.device = first.s.device
+        self.ac = core_tri.MLPActorCritic(first.env.observation_space, first.env.action_space,
+                                     hidden_sizes=hyperparams["HIDDEN_SIZES"],
+                                     min_cov_eigen=hyperparams["MIN_COV_EIGEN"],
+                                     ensemble_size=len(self.members)).to(self.device)
+        self.ac.load_member_state_dicts([member.ac.state_dict() for member in self.members])
+        self.ac_targ = deepcopy(self.ac)
+        self.ac_targ.load_member_state_dicts([member.ac_targ.state_dict() for member in self.members])
+        for p in self.ac_targ.parameters():
+            p.requires_grad = False
+        self.q_params = list(chain(self.ac.q1.parameters(), self.ac.q2.parameters()))
+        self.alpha_params = list(chain(self.ac.alpha_d.parameters(),self.ac.alpha_c.parameters()))
+
+        #setup the optimizers, as in SacTrain.create_optimizer
+        self.pi_optimizer = optim.Adam(self.ac.pi.parameters(), lr=hyperparams["LR"])
+        self.q_optimizer = optim.Adam(self.q_params, lr=hyperparams["LR"]) 
+        self.alpha_optimizer = optim.SGD(self.alpha_params, lr=hyperparams["ALPHA_LR"])
+
+    def per_sample(self, member_values, batch_size):
+        """ repeats the value of each member for each of the batch_size elements of its batch """
+        return member_values.repeat_interleave(batch_size)
+
+    def sample_batch(self, batch_size):
+        """ returns the concatenation of a batch of experience sampled from the replay buffer of each member """
+        batches = [member.memory.sample_batch(batch_size) for member in self.members]
+        return {key: torch.cat([member_batch[key] for member_batch in batches]) for key in batches[0]}
+
+    def perform_updates(self, num_updates):
+        """
+        Performs num_updates updates of the NN parameters of all the members, each one on a batch sampled from the
+        replay buffer of each member, and updates the running loss of each member.
+
+        Args:
+            num_updates (int): number of updates to perform
+        """
+        gamma = self.members[0].s.training_hyperparams["GAMMA"]
+        batch_size = self.members[0].s.training_hyperparams["BATCH_SIZE"]
+        for _ in range(num_updates):
+            #collect a batch of experience from each member
+            batch = self.sample_batch(batch_size)
+            try:
+                #perform the update using the batch
+                losses = self.update(data=batch)
+                #update logging: running loss of each member
+                running_losses = np.stack([losses[0], losses[1], self.ac.alpha_d_no_grad().cpu().numpy(),
+                                    self.ac.alpha_c_no_grad().cpu().numpy(), losses[2], losses[3]], axis=1)
+                for i, member in enumerate(self.members):
+                    member.s.running_loss += (1.-gamma)*(running_losses[i] - member.s.running_loss)
+            except RuntimeError as e:
+                #there could be an error doing updates, e.g. covariance singular. In such case i log it
+                logging.error(f"Exception at step {self.members[0].s.steps_done} during self.update: {e}")
+
+    def compute_loss_q(self, data):
+        """
+        Compute the loss function of the q-value functions of each member given the concatenated batches of data.
+        See SacTrain.compute_loss_q.
+
+        Returns:
+            (torch.Tensor): the sum of the loss function for both q-values, for each member
+        """
+        #unpack the batched data
+        o, tri_a, a, r, o2 = data['obs'], data['tri_act'], data['act'], data['rew'], data['obs2']
+        num_members = len(self.members)
+        batch_size = o.shape[0] // num_members
+
+        #value Q(s,d,u) of the tri_a in the batch. Gradients will be computed respect to this.
+        tri_a_index = torch.round(tri_a).long().view(-1,1)
+        q1_vals = self.ac.q1(o,a).gather(1, tri_a_index).view(-1)
+        q2_vals = self.ac.q2(o,a).gather(1, tri_a_index).view(-1)
+
+        # Bellman backup for Q functions. The gradient is not taken respect to the target
+        with torch.no_grad():
+            # Target actions come from *current* policy
+            _, a2_given_0, a2_given_1, a2_given_2, p, p_entropy, logp_0, logp_1, logp_2 =  self.ac.pi(o2)
+
+            #target Q-values. Average over discrete actions is computed explicitly
+            q1_pi_targ = p[:,0] * self.ac_targ.q1(o2, a2_given_0)[:,0] + p[:,1] * self.ac_targ.q1(o2, a2_given_1)[:,1] +\
+                            p[:,2]* self.ac_targ.q1(o2, a2_given_2)[:,2]
+            q2_pi_targ = p[:,0] * self.ac_targ.q2(o2, a2_given_0)[:,0] + p[:,1] * self.ac_targ.q2(o2, a2_given_1)[:,1] +\
+                            p[:,2]* self.ac_targ.q2(o2, a2_given_2)[:,2]
+            q_pi_targ = torch.min(q1_pi_targ, q2_pi_targ)
+            logp_a2 = p[:,0] * logp_0 + p[:,1]*logp_1 + p[:,2]*logp_2
+            backup = r + self.members[0].s.training_hyperparams["GAMMA"] * (q_pi_targ +
+                    self.per_sample(self.ac.alpha_d_no_grad(), batch_size)*p_entropy
+                    - self.per_sample(self.ac.alpha_c_no_grad(), batch_size) * logp_a2)
+ 
+        # MSE loss against Bellman backup, for each member
+        loss_q1 = ((q1_vals - backup)**2).view(num_members, -1).mean(dim=1)
+        loss_q2 = ((q2_vals - backup)**2).view(num_members, -1).mean(dim=1)
+        return loss_q1 + loss_q2
+
+    def compute_loss_pi(self, data):
+        """
+        Compute the loss function for the policy of each member given the concatenated batches of data.
+        See SacTrain.compute_loss_pi.
+
+        Returns:
+            (torch.Tensor, torch.Tensor, torch.Tensor): the loss function for the policy, the discrete entropy and
+                the continuous entropy of each member
+        """
+        o = data['obs']
+        num_members = len(self.members)
+        batch_size = o.shape[0] // num_members
+        _, a_given_0, a_given_1, a_given_2, p, p_entropy, logp_0, logp_1, logp_2 = self.ac.pi(o)
+
+        #compute the average over the discrete states
+        q1_pi = p[:,0] * self.ac.q1(o, a_given_0)[:,0] + p[:,1] * self.ac.q1(o, a_given_1)[:,1] +\
+                p[:,2] * self.ac.q1(o, a_given_2)[:,2]
+        q2_pi = p[:,0] * self.ac.q2(o, a_given_0)[:,0] + p[:,1] * self.ac.q2(o, a_given_1)[:,1] +\
+                p[:,2] * self.ac.q2(o, a_given_2)[:,2]
+        q_pi = torch.min(q1_pi, q2_pi)
+        entropy_c = -p[:,0] * logp_0 - p[:,1]*logp_1 - p[:,2]*logp_2
+
+        loss_pi = -self.per_sample(self.ac.alpha_d_no_grad(), batch_size) * p_entropy \
+                    -self.per_sample(self.ac.alpha_c_no_grad(), batch_size) * entropy_c  - q_pi
+        return tuple(x.view(num_members, -1).mean(dim=1) for x in [loss_pi, p_entropy, entropy_c])
+
+    def compute_loss_alpha(self, data):
+        """
+        Compute the loss function for the temperatures of each member given the concatenated batches of data.
+        See SacTrain.compute_loss_alpha.
+
+        Returns:
+            (torch.Tensor): the loss function for the temperatures, summed over the members
+        """
+        o = data['obs']
+        num_members = len(self.members)
+
+        with torch.no_grad():
+            # Target actions come from *current* policy
+            _, _, _, _, p, p_entropy, logp_0, logp_1, logp_2 =  self.ac.pi(o)
+            entropy_c = -p[:,0] * logp_0 - p[:,1]*logp_1 - p[:,2]*logp_2
+            
+        # alpha loss function
+        loss_alpha = self.ac.alpha_d()*(p_entropy.view(num_members, -1).mean(dim=1) - self.members[0].current_h_d()) + \
+                     self.ac.alpha_c()*(entropy_c.view(num_members, -1).mean(dim=1) - self.members[0].current_h_c()) 
+        return loss_alpha.sum()
+
+    def update(self, data):
+        """
+        Performs an update of the parameters of both Q and Pi of all the members. The losses of the members are
+        summed, so the gradient respect to the parameters of each member is the one of its own loss.
+        See SacTrain.update.
+
+        Args:
+            data (dict): concatenated batches of experience drawn from the replay buffer of each member
+        
+        Return:
+             (np.array, np.array, np.array, np.array): loss_q, loss_pi, discrete and continuous entropy of each member
+        """
+        #update of the two value functions
+        self.q_optimizer.zero_grad()
+        loss_q = self.compute_loss_q(data) 
+        loss_q.sum().backward()
+        self.q_optimizer.step()
+
+        #update of the policy function, with frozen Q-networks (see SacTrain.update)
+        for p in self.q_params:
+            p.requires_grad = False
+        self.pi_optimizer.zero_grad()
+        loss_pi, entropy_d, entropy_c = self.compute_loss_pi(data)
+        loss_pi.sum().backward()
+        self.pi_optimizer.step()
+        for p in self.q_params:
+            p.requires_grad = True
+
+        #optimize the temperature alpha
+        self.alpha_optimizer.zero_grad()
+        loss_alpha = self.compute_loss_alpha(data)
+        loss_alpha.backward()
+        self.alpha_optimizer.step()
+
+        # Update target networks by polyak averaging
+        polyak = self.members[0].s.training_hyperparams["POLYAK"]
+        with torch.no_grad():
+            for p, p_targ in zip(self.ac.parameters(), self.ac_targ.parameters()):
+                # in-place operations
+                p_targ.data.mul_(polyak)
+                p_targ.data.add_((1 - polyak) * p.data)
 
+        return tuple(x.detach().cpu().numpy() for x in [loss_q, loss_pi, entropy_d, entropy_c])
@@ -9,9 +9,38 @@ from __future__ import print_function
 import gym
 import numpy as np
 import dataclasses
-import random
 import scipy.linalg as sci
 
+def rng_from_env_params(env_params):
+    """
+    Returns the numpy.random.Generator from which an environment draws all its random numbers. It is seeded
+    with env_params["seed"], so an environment is reproducible if the seed is specified. If env_params has
+    no "seed", or it is None, the generator is seeded with fresh entropy from the OS.
+
+    Args:
+        env_params (dict): the parameters of the environment
+
+    Returns:
+        (numpy.random.Generator): the random number generator
+    """
+    return np.random.default_rng(env_params.get("seed", None))
+
+def spawn_env_params(env_params, n):
+    """
+    Returns n copies of env_params whose "seed" entries generate independent random streams, e.g. to
+    initialize the environments of parallel workers. The seeds are spawned from env_params["seed"],
+    so they are reproducible if it is specified.
+
+    Args:
+        env_params (dict): the parameters of the environment
+        n (int): number of copies
+
+    Returns:
+        (list(dict)): the n copies of env_params, each one with its own "seed"
+    """
+    children = np.random.SeedSequence(env_params.get("seed", None)).spawn(n)
+    return [dict(env_params, seed=int(child.generate_state(1, np.uint64)[0])) for child in children]
+
 
 """
 This module contains gym.Env environments that can be trained using sac_tri.SacTrain(). We implemented a single bath
@@ -19,6 +48,8 @@ diagonal qubit fridge.
 These environments, besides being proper gym.Env, MUST satisfy these additional requirements:
     1) __init__ must accept a single dict with all the parameters necessary to define the environment.
     2) implement set_current_state(state). Functions that takes a state as input, and sets the environment to that state
+Optionally, they can implement step_fast(d_act, u_act, obs), a version of step() that doesn't check the action and
+writes the new state into obs. When available, it is used by sac_tri.SacTrain.train() and extra.test_policy().
 
 If the environment is multiobjective, the reward will be the convex combination that is intended to be 
 optimized. However, the individual objectives must be returned in the info dictionry of step() (see gym.Env), as a numpy
@@ -29,6 +60,9 @@ This module contains the following classes:
     2. `TwoLevelDemonDisPowDiss2` - cooling cycle powered by sigmaZ measurement
     3. `TwoLevelDemonDisPowDissTheta` - cooling cycle powered by measurement
         with an arbitrary angle
+    4. `TwoLevelDemonDisPowDisse0` - cooling cycle with the qubit gap as continuous action
+    5. `BatchedTwoLevelDemonDis` and its subclasses - batched counterparts of the classes above, evolving
+        many replicas at once
 """
 
 #1
@@ -80,6 +114,8 @@ class TwoLevelDemonDisPowDiss(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -109,11 +145,29 @@ class TwoLevelDemonDisPowDiss(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -125,9 +179,6 @@ class TwoLevelDemonDisPowDiss(gym.Env):
         gsig = gam_eg + gam_ge
         
             
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
     
 
         #initialize null multi objectives
@@ -155,7 +206,7 @@ class TwoLevelDemonDisPowDiss(gym.Env):
             mpl = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden + 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmax
             mmi = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden - 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmax
             prob_mpl = np.abs(np.trace(mpl.dot(self.rho).dot(mpl))) #Probability of "plus" result
-            test_rand = random.random()
+            test_rand = self.rng.random()
             if prob_mpl < test_rand:
                 meas = mpl
             else:
@@ -189,9 +240,9 @@ class TwoLevelDemonDisPowDiss(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -215,10 +266,14 @@ class TwoLevelDemonDisPowDiss(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -282,6 +337,8 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -311,11 +368,29 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -327,9 +402,6 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
         gsig = gam_eg + gam_ge
         
             
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
     
 
         #initialize null multi objectives
@@ -364,7 +436,7 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
             mpl = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden + 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmaz
             mmi = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden - 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmaz
             prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl)) #Probability of "plus" result
-            test_rand = random.random()
+            test_rand = self.rng.random()
             if prob_mpl < test_rand:
                 meas = mpl
             else:
@@ -398,9 +470,9 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -424,10 +496,14 @@ class TwoLevelDemonDisPowDiss2(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -492,6 +568,8 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -521,11 +599,29 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
@@ -537,9 +633,6 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
         gsig = gam_eg + gam_ge
         
             
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
         
         # # Choose range of measurement angles
         theta = u_act * 3.6 - 0.2
@@ -583,7 +676,7 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
             mpl = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden + 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigma
             mmi = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden - 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigma
             prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl)) #Probability of "plus" result
-            test_rand = random.random()
+            test_rand = self.rng.random()
             if prob_mpl < test_rand:
                 meas = mpl
             else:
@@ -615,9 +708,9 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -641,10 +734,14 @@ class TwoLevelDemonDisPowDissTheta(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[self.e0,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -706,6 +803,8 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
     
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
@@ -735,18 +834,33 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-    
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-            
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
         sigmax = np.array([[0,1],[1,0]])
         sigmaz = np.array([[1,0],[0,-1]])
         iden = np.array([[1,0],[0,1]])
         
-        #load action
-        d_act = action[0]
-        u_act = action[1][0]
         
         
         ham = np.array([[u_act,0],[0,0]])
@@ -779,7 +893,7 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
             mpl = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden + 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmaz
             mmi = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden - 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigmaz
             prob_mpl = np.trace(mpl.dot(self.rho).dot(mpl)) #Probability of "plus" result
-            test_rand = random.random()
+            test_rand = self.rng.random()
             if prob_mpl < test_rand:
                 meas = mpl
             else:
@@ -809,10 +923,10 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
     
         #compute reward
         reward = self.a*poww - (1.-self.a)*diss
-    
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([poww, -diss], dtype=np.float32)}
+
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(poww), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -836,10 +950,14 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.rhofx,self.state.rhofz, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1], obs[2] = self.state.rhofx, self.state.rhofz, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         ham = np.array([[random_u,0],[0,0]])
         exp_ham = sci.expm(-self.b0*ham)
         Zz = np.trace(exp_ham)
@@ -851,3 +969,291 @@ class TwoLevelDemonDisPowDisse0(gym.Env):
         self.state.rhofx = np.real(np.trace(self.rho.dot(sigmax)))
         self.state.rhofz = np.real(np.trace(self.rho.dot(sigmaz)))
         self.state.u = random_u
+
+
+# Batched environments
+class BatchedTwoLevelDemonDis(object):
+    """
+    Batched counterpart of the environments of this module. It evolves num_envs independent replicas of
+    single_env_class at once: the density matrices are stored in a single array of shape (num_envs,2,2), the
+    discrete action chosen by each replica is applied through masked vectorized updates, and the measurement
+    outcomes of all replicas are drawn at once. It is not a gym.Env: step() takes the actions of all the
+    replicas and returns the stacked states, rewards and multi objectives.
+    Subclasses must set single_env_class and the measured Pauli operator SIGMA, or override measurement_sigma().
+    By default the feedback rotates the replicas to the negative z axis.
+
+    Args:
+        env_params (dict): the parameters of single_env_class
+        num_envs (int): number of replicas
+        seed (int): seed of the random number generator used for the measurements and the resets. If None,
+            env_params["seed"] is used
+    """
+
+    single_env_class = None
+    SIGMA = None
+
+    def __init__(self, env_params, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed if seed is not None else env_params.get("seed", None))
+        self.load_env_params(env_params)
+
+    def load_env_params(self, env_params):
+        """
+        Initializes the environment
+
+        Args:
+            env_params: environment parameters as passed to __init__()
+        """
+        #load the environment parameters
+        self.g0 = env_params["g0"]
+        self.b0 = env_params["b0"]
+        self.min_u = env_params["min_u"]
+        self.max_u = env_params["max_u"]
+        self.dt = env_params["dt"]
+        self.a = env_params["a"]
+        self.pow_coeff = env_params["pow_coeff"]
+        self.diss_coeff = env_params["diss_coeff"]
+
+        #observation and action spaces of a single replica
+        self.observation_space = (gym.spaces.Box( low=np.array([0., 0., self.min_u],dtype=np.float32),
+                                    high=np.array([1.,1.,self.max_u],dtype=np.float32), dtype=np.float32))
+        self.action_space = (gym.spaces.Discrete(3), gym.spaces.Box(low=np.array([self.min_u],dtype=np.float32),
+                              high=np.array([self.max_u],dtype=np.float32), dtype=np.float32))
+
+        #reset the state of the environment
+        self.reset_internal_state_variables()
+
+    def reset(self):
+        """ resets the state of all the replicas """
+        self.reset_internal_state_variables()
+        return self.current_state()
+
+    def step(self, action):
+        """ Evolves all the replicas for a timestep depending on the chosen actions
+
+        Args:
+            action (tuple): (d_act, u_act), where d_act are the discrete actions, with shape (num_envs,),
+                and u_act are the continuous actions, with shape (num_envs,1)
+
+        Raises:
+            Exception: action out of bound
+
+        Returns:
+            state(np.Array): new states after the step, with shape (num_envs,3)
+            reward(np.Array): the rewards, with shape (num_envs,)
+            end(np.Array): whether the episodes ended (these environments never end)
+            additional_info(dict): "multi_obj" contains the power and minus the dissipation, with shape (num_envs,2)
+        """
+        #load and check the actions
+        d_act = np.asarray(action[0]).reshape(self.num_envs)
+        u_act = np.asarray(action[1], dtype=np.float32).reshape(self.num_envs)
+        if (np.any((d_act < 0) | (d_act >= self.action_space[0].n)) or np.any(u_act < self.action_space[1].low[0])
+            or np.any(u_act > self.action_space[1].high[0])):
+            raise Exception(f"Action {action} out of bound")
+        u_act = u_act.astype(np.float64)
+
+        #initialize null multi objectives
+        poww = np.zeros(self.num_envs)
+        diss = np.zeros(self.num_envs)
+
+        #each discrete action is applied to the replicas that chose it
+        idx = np.flatnonzero(d_act == 0)
+        if len(idx) > 0:
+            poww[idx] = self.thermalize(idx, u_act[idx])
+        idx = np.flatnonzero(d_act == 1)
+        if len(idx) > 0:
+            diss[idx] = self.measure(idx, u_act[idx])
+        idx = np.flatnonzero(d_act == 2)
+        if len(idx) > 0:
+            self.feedback(idx, u_act[idx])
+
+        #complete state evolution
+        self.update_state(u_act)
+
+        #compute reward
+        reward = self.a*poww - (1.-self.a)*diss
+
+        #return
+        return self.current_state(), reward, np.zeros(self.num_envs, dtype=bool), {"multi_obj":
+            np.stack([poww, -diss], axis=1).astype(np.float32)}
+
+    def gaps(self, u_act):
+        """ returns the qubit gap of the replicas that chose the continuous actions u_act """
+        return np.full(len(u_act), self.e0)
+
+    def measurement_kappa(self):
+        """ returns the measurement strength """
+        return self.kappa
+
+    def measurement_sigma(self, u_act):
+        """ returns the measured Pauli operator, either with shape (2,2) or (len(u_act),2,2) """
+        return self.SIGMA
+
+    def feedback(self, idx, u_act):
+        """ performs the feedback on the replicas idx that chose the continuous actions u_act """
+        self.rotate_to_negative_z(idx)
+
+    def thermalize(self, idx, u_act):
+        """
+        Performs the thermalization on the replicas idx, and returns their power
+
+        Args:
+            idx (np.Array): indices of the replicas that are thermalized
+            u_act (np.Array): continuous actions chosen by these replicas
+
+        Returns:
+            poww (np.Array): the power of each of these replicas
+        """
+        e = self.gaps(u_act)
+        gam_eg = self.g0 * (1 + (-1+np.exp(self.b0 * e))**(-1))
+        gam_ge = self.g0 * (-1+np.exp(self.b0 * e))**(-1)
+        gsig = gam_eg + gam_ge
+
+        pe_old = np.real(self.rho[idx,0,0])
+        peg_dt = self.rho[idx,0,1] * np.exp(-(gsig/2+1j*e)*self.dt)
+        pe = np.exp(-gsig * self.dt)*((-1+np.exp(gsig * self.dt))*gam_ge + gsig * pe_old)/gsig
+        self.rho[idx,0,0] = pe
+        self.rho[idx,0,1] = peg_dt
+        self.rho[idx,1,0] = np.conjugate(peg_dt)
+        self.rho[idx,1,1] = 1 - pe
+        return (self.pow_coeff/self.dt)*e*(pe - pe_old)
+
+    def measure(self, idx, u_act):
+        """
+        Performs the measurement on the replicas idx, and returns their dissipation
+
+        Args:
+            idx (np.Array): indices of the replicas that are measured
+            u_act (np.Array): continuous actions chosen by these replicas
+
+        Returns:
+            diss (np.Array): the dissipation of each of these replicas
+        """
+        kap = self.measurement_kappa()
+        sigma = self.measurement_sigma(u_act)
+        iden = np.eye(2)
+        mpl = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden + 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigma
+        mmi = 0.5*(np.sqrt(kap)+np.sqrt(1-kap))*iden - 0.5*(np.sqrt(kap)-np.sqrt(1-kap))*sigma
+
+        rho = self.rho[idx]
+        prob_mpl = np.real(np.trace(mpl @ rho @ mpl, axis1=1, axis2=2))
+        #as in the single replica environments, mpl is chosen when prob_mpl is smaller than the random number
+        meas = np.where((prob_mpl < self.rng.random(len(idx)))[:,None,None], mpl, mmi)
+        rho_meas = meas @ rho @ meas
+        prob_for = np.real(np.trace(rho_meas, axis1=1, axis2=2))
+        self.rho[idx] = rho_meas / prob_for[:,None,None]
+        return self.diss_coeff*self.calculate_measurement_penalty(prob_for)
+
+    def rotate(self, idx, angle):
+        """ rotates the density matrix of the replicas idx by the given angles """
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+        unit = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+        self.rho[idx] = unit @ self.rho[idx] @ np.transpose(unit, (0,2,1))
+
+    def rotate_to_negative_z(self, idx):
+        """ rotates the Bloch vector of the replicas idx to the negative z axis """
+        xx = np.real(self.rho[idx,0,1] + self.rho[idx,1,0])
+        zz = np.real(self.rho[idx,0,0] - self.rho[idx,1,1])
+        z3 = np.sqrt(xx**2+zz**2)
+        self.rho[idx] = 0.
+        self.rho[idx,0,0] = 0.5*(1 - z3)
+        self.rho[idx,1,1] = 0.5*(1 + z3)
+
+    def calculate_measurement_penalty(self, p):
+        """
+        Calculates the measurement penalty accorting to the Landauer's rule
+        """
+        return - p * np.log(p) - (1-p)*np.log(1-p)
+
+    def set_current_state(self, state):
+        """
+        Sets the current state of all the replicas.
+
+        Args:
+            state (np.Array): states of the replicas, with shape (num_envs,3)
+        """
+        self.state = np.array(state, dtype=np.float32).reshape(self.num_envs, 3)
+
+    def current_state(self):
+        """ Returns the current states of the replicas, with shape (num_envs,3) """
+        return self.state.copy()
+
+    def update_state(self, u_act):
+        """ sets the states of the replicas from their density matrices and the last continuous actions """
+        self.state = np.stack([np.real(self.rho[:,0,1] + self.rho[:,1,0]), np.real(self.rho[:,0,0] - self.rho[:,1,1]),
+                                u_act], axis=1).astype(np.float32)
+
+    def reset_internal_state_variables(self):
+        """ sets initial values for the state of all the replicas """
+        random_u = self.rng.uniform(self.action_space[1].low[0], self.action_space[1].high[0],
+                                    size=self.num_envs).astype(np.float32)
+        #thermal state of the Hamiltonian [[e,0],[0,0]]
+        boltz = np.exp(-self.b0*self.gaps(random_u.astype(np.float64)))
+        self.rho = np.zeros((self.num_envs,2,2), dtype=np.complex128)
+        self.rho[:,0,0] = boltz/(1.+boltz)
+        self.rho[:,1,1] = 1./(1.+boltz)
+        self.update_state(random_u)
+
+#1
+class BatchedTwoLevelDemonDisPowDiss(BatchedTwoLevelDemonDis):
+    """ Batched TwoLevelDemonDisPowDiss: sigmaX measurement, and feedback rotation by the angle 2*pi*u """
+
+    single_env_class = TwoLevelDemonDisPowDiss
+    SIGMA = np.array([[0.,1.],[1.,0.]])
+
+    def load_env_params(self, env_params):
+        self.kappa = env_params["kappa"]
+        self.e0 = env_params["e0"]
+        super(BatchedTwoLevelDemonDisPowDiss, self).load_env_params(env_params)
+
+    def feedback(self, idx, u_act):
+        self.rotate(idx, 2 * np.pi * u_act)
+
+#1.2
+class BatchedTwoLevelDemonDisPowDiss2(BatchedTwoLevelDemonDis):
+    """ Batched TwoLevelDemonDisPowDiss2: sigmaZ measurement, and feedback rotation by the angle 2*pi*u """
+
+    single_env_class = TwoLevelDemonDisPowDiss2
+    SIGMA = np.array([[1.,0.],[0.,-1.]])
+
+    def load_env_params(self, env_params):
+        self.kappa = env_params["kappa"]
+        self.e0 = env_params["e0"]
+        super(BatchedTwoLevelDemonDisPowDiss2, self).load_env_params(env_params)
+
+    def feedback(self, idx, u_act):
+        self.rotate(idx, 2 * np.pi * u_act)
+
+#1.3
+class BatchedTwoLevelDemonDisPowDissTheta(BatchedTwoLevelDemonDis):
+    """ Batched TwoLevelDemonDisPowDissTheta: measurement at the angle u*3.6-0.2, and feedback to the negative z axis """
+
+    single_env_class = TwoLevelDemonDisPowDissTheta
+
+    def load_env_params(self, env_params):
+        self.kappa = env_params["kappa"]
+        self.e0 = env_params["e0"]
+        super(BatchedTwoLevelDemonDisPowDissTheta, self).load_env_params(env_params)
+
+    def measurement_sigma(self, u_act):
+        theta = u_act * 3.6 - 0.2
+        return np.stack([np.stack([np.cos(theta), np.sin(theta)], axis=1),
+                         np.stack([np.sin(theta), -np.cos(theta)], axis=1)], axis=1)
+
+#2
+class BatchedTwoLevelDemonDisPowDisse0(BatchedTwoLevelDemonDis):
+    """ Batched TwoLevelDemonDisPowDisse0: the continuous action is the qubit gap, with sigmaZ measurement """
+
+    single_env_class = TwoLevelDemonDisPowDisse0
+    SIGMA = np.array([[1.,0.],[0.,-1.]])
+
+    def load_env_params(self, env_params):
+        self.gm = env_params["gm"]
+        super(BatchedTwoLevelDemonDisPowDisse0, self).load_env_params(env_params)
+
+    def gaps(self, u_act):
+        return u_act
+
+    def measurement_kappa(self):
+        return 0.5-np.sqrt(2.0*self.gm*self.dt)
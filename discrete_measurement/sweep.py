@@ -0,0 +1,125 @@
+import numpy as np
+import sac_tri
+import extra
+
+"""
+This module contains SuccessiveHalvingSweep, used to train many configurations of the same environment (e.g. for a
+hyperparameter study, or a sweep along the Pareto front) with asynchronous successive halving (ASHA): every
+configuration is first trained for a small number of steps, and at each rung only the best fraction of the runs is
+trained further, so that most of the compute goes to the promising configurations.
+"""
+
+class SuccessiveHalvingSweep(object):
+    """
+    Sweep over configurations with asynchronous successive halving. The rungs are at min_steps,
+    min_steps*reduction_factor, min_steps*reduction_factor^2,... up to max_steps training steps. Each time a run
+    reaches a rung, its score is computed from its logs. A run is promoted to the next rung as soon as it is in the
+    best 1/reduction_factor of the runs that reached its rung, otherwise a new configuration is started. Runs are
+    stopped and resumed through the saved training states (see SacTrain.save_full_state and SacTrain.load_train), so
+    only one training session is in memory at a time, and DONT_SAVE_MEMORY must not be True. Since the scores are
+    read from the log files, the rungs should be multiples of LOG_STEPS.
+
+    Args:
+        env_class: class of the environment, as in SacTrain.initialize_new_train
+        configs (list(dict)): the configurations to sweep over. Each one is a dictionary with "env_params" and
+            "training_hyperparams" (see SacTrain.initialize_new_train)
+        log_info (dict): logging info shared by all runs (see SacTrain.initialize_new_train). The index of the
+            configuration is appended to "extra_str"
+        min_steps (int): training steps of the first rung
+        max_steps (int): training steps of the last rung
+        reduction_factor (int): only the best 1/reduction_factor of the runs of a rung are promoted
+        score: function taking the log folder of a run and returning its score (the larger the better). If None,
+            the average of the last 3 logged values of the running reward (see extra.ret_last_rewards_and_avg).
+            For example, the running multi objectives can be scored reading sac_tri.SacTrain.RUNNING_MULTI_OBJ_FILE_NAME
+
+    Usage:
+        call run() to perform the whole sweep, or call next_job(), train_job() and report() to control it.
+        The results are in summary().
+    """
+    def __init__(self, env_class, configs, log_info, min_steps, max_steps, reduction_factor=3, score=None):
+        self.env_class = env_class
+        self.configs = configs
+        self.log_info = log_info
+        self.reduction_factor = reduction_factor
+        self.score = score if score is not None else (lambda log_dir: extra.ret_last_rewards_and_avg(log_dir)[1])
+
+        #steps of each rung
+        self.rungs = []
+        steps = min_steps
+        while steps < max_steps:
+            self.rungs.append(steps)
+            steps *= reduction_factor
+        self.rungs.append(max_steps)
+
+        #state of each run: the log folder of its latest training session, the steps done, and the score at each rung
+        self.runs = [{"log_dir": None, "steps": 0, "scores": []} for _ in configs]
+
+    def run(self):
+        """ performs the whole sweep, and returns summary() """
+        job = self.next_job()
+        while job is not None:
+            self.report(job[0], self.train_job(*job))
+            job = self.next_job()
+        return self.summary()
+
+    def next_job(self):
+        """
+        Chooses the next run to train: a run promoted to the next rung if possible, starting from the highest rung,
+        otherwise a new configuration.
+
+        Returns:
+            (int, int): the index of the configuration and the number of steps it must reach, or None if the
+                sweep is over
+        """
+        for rung in reversed(range(len(self.rungs)-1)):
+            #the runs that reached this rung, sorted by their score at this rung
+            reached = [i for i, run in enumerate(self.runs) if len(run["scores"]) > rung]
+            reached.sort(key=lambda i: self.runs[i]["scores"][rung], reverse=True)
+            for i in reached[:len(reached) // self.reduction_factor]:
+                if len(self.runs[i]["scores"]) == rung + 1:
+                    return i, self.rungs[rung + 1]
+        for i, run in enumerate(self.runs):
+            if run["log_dir"] is None:
+                return i, self.rungs[0]
+        return None
+
+    def train_job(self, index, steps):
+        """
+        Trains configuration index until it has done steps training steps. A new training session is created
+        if the configuration was never trained, otherwise its latest saved state is loaded. The state is saved
+        at the end of the training.
+
+        Returns:
+            (str): the log folder of the training session
+        """
+        run = self.runs[index]
+        train = sac_tri.SacTrain()
+        if run["log_dir"] is None:
+            config = self.configs[index]
+            log_info = dict(self.log_info, extra_str=f"{self.log_info['extra_str']}_config{index}")
+            train.initialize_new_train(self.env_class, dict(config["env_params"]),
+                                        dict(config["training_hyperparams"]), log_info)
+        else:
+            train.load_train(run["log_dir"])
+        train.train(steps - train.s.steps_done, output_plots=False)
+        #the state is already saved if steps is a multiple of SAVE_STATE_STEPS
+        if train.s.steps_done % train.s.training_hyperparams["SAVE_STATE_STEPS"] != 0:
+            train.save_full_state()
+        return train.s.log_session.log_dir
+
+    def report(self, index, log_dir):
+        """ records that configuration index reached its next rung, with its latest training session in log_dir """
+        run = self.runs[index]
+        run["log_dir"] = log_dir
+        run["steps"] = self.rungs[len(run["scores"])]
+        run["scores"].append(float(self.score(log_dir)))
+
+    def summary(self):
+        """
+        Returns:
+            (list(dict)): for each configuration, sorted from the best one, its index, the log folder of its latest
+                training session, the steps done, and the score at each rung reached
+        """
+        order = sorted(range(len(self.runs)), key=lambda i: (len(self.runs[i]["scores"]),
+                        self.runs[i]["scores"][-1] if self.runs[i]["scores"] else -np.inf), reverse=True)
+        return [dict(self.runs[i], index=i) for i in order]
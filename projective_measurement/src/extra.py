@@ -1,16 +1,15 @@
 import time
-import tempfile
 import numpy as np
 from pathlib import Path
 from dataclasses import dataclass
 import sys
 import os
 sys.path.append(os.path.join('..','src'))
-import plotting
 import bz2
 import _pickle as cPickle
 import pickle
 import sac_tri
+import run_catalog
 
 """
 This module contains support and extra functions.
@@ -54,6 +53,7 @@ class SacTrainState:
     running_loss = None
     actions = None
     running_multi_obj = None
+    trade_off = None
 
 class LogSession(object):
     """
@@ -76,7 +76,7 @@ class LogSession(object):
 
 def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_state = None, suppress_show=False,
                 actions_to_plot=400, save_policy_to_file_name=None, save_state_to_file_name=None, actions_ylim=None, 
-                dont_clear_output=False):
+                dont_clear_output=False, fast_step=False):
     """
     Function to test the performance of a given policy. It creates a new instance of the environment, eventually
     at a given initial state, and performs a given number of steps recording the reward and computing the running 
@@ -97,6 +97,8 @@ def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_st
         save_policy_to_file_name (str): if specified, it will save the chosen actions to this file
         save_state_to_file_name (str): if specified, it will save the corresponding state to this file
         actions_ylim ((float,float)): y_lim for the plot of the chosen actions
+        fast_step (bool): if True and the environment implements step_fast, it is used to perform the steps. Since
+            step_fast doesn't check the actions, it should only be True for policies that return actions within bound
 
     Returns:
         (float): final value of the running return
@@ -109,6 +111,10 @@ def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_st
     if env_state is not None:
         env.set_current_state(env_state)
         state = env_state
+    #if the environment implements it, step_fast is used, which writes the state into a preallocated buffer
+    fast_step = fast_step and is_tri and hasattr(env, "step_fast")
+    if fast_step:
+        state_buffer = np.empty(env.observation_space.shape, dtype=np.float32)
     #initialize variables to compute the running reward without bias, and to save the actions
     running_reward = 0.
     running_multi_obj = None
@@ -125,7 +131,11 @@ def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_st
 
         #perfor an action, save rewards, and average it
         act = policy(state)
-        state,ret,_, info_dict =  env.step(act)
+        if fast_step:
+            ret, pow, diss = env.step_fast(act[0], act[1][0], state_buffer)
+            state = state_buffer
+        else:
+            state,ret,_, info_dict =  env.step(act)
         o_n += (1.-gamma)*(1.-o_n)
         running_reward += (1.-gamma)/o_n*(ret - running_reward)
         running_rewards.append([i,running_reward])
@@ -137,21 +147,23 @@ def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_st
             actions.append([i] +  list(act))
 
         #running average of multi-obejctives (if they exist)
-        if "multi_obj" in info_dict:
+        if fast_step:
+            #step_fast returns the power and the dissipation, so the running average is updated in place
+            if running_multi_obj is None:
+                running_multi_obj = np.zeros(2)
+            running_multi_obj[0] += (1.-gamma)/o_n*(pow - running_multi_obj[0])
+            running_multi_obj[1] += (1.-gamma)/o_n*(-diss - running_multi_obj[1])
+            running_multi_objs.append([i] + list(running_multi_obj))
+        elif "multi_obj" in info_dict:
             if running_multi_obj is None:
                 running_multi_obj = np.zeros(len(info_dict["multi_obj"]))
             running_multi_obj += (1.-gamma)/o_n*(info_dict["multi_obj"] - running_multi_obj)
             running_multi_objs.append([i] + list(running_multi_obj)) 
 
-    #Saves the chosen actions to file (real or temporary)
+    #Saves the chosen actions to file if necessary
     if save_policy_to_file_name is not None:
-        f_actions_name = save_policy_to_file_name
-        Path(f_actions_name).parent.mkdir(parents=True, exist_ok=True)
-    else:
-        f_actions = tempfile.NamedTemporaryFile()
-        f_actions_name = f_actions.name
-        f_actions.close()
-    np.savetxt(f_actions_name, np.array(actions))
+        Path(save_policy_to_file_name).parent.mkdir(parents=True, exist_ok=True)
+        np.savetxt(save_policy_to_file_name, np.array(actions))
 
     #Save the corresponding states if necessary
     if save_state_to_file_name is not None:
@@ -161,21 +173,12 @@ def test_policy(env_class, env_params, policy, gamma, is_tri, steps=2000, env_st
     
     #if we need to plot the rewards and actions
     if not suppress_show:
-        #save rewards to a temp file in order to cal the plotting functions which loads data from files
-        f_running_rewards = tempfile.NamedTemporaryFile()
-        f_running_rewards_name = f_running_rewards.name
-        f_running_rewards.close()
-        np.savetxt(f_running_rewards_name, np.array(running_rewards))
-        
-        #if its multi_objective, i save that file too
-        if not running_multi_obj is None:
-            f_running_multi_objs = tempfile.NamedTemporaryFile()
-            f_running_multi_objs_name = f_running_multi_objs.name
-            f_running_multi_objs.close()
-            np.savetxt(f_running_multi_objs_name, np.array(running_multi_objs))
-        
-        plotting.plot_sac_logs(Path(f_running_rewards_name).parent.name, running_reward_file=f_running_rewards_name,
-            running_loss_file=None,  running_multi_obj_file= f_running_multi_objs_name , actions_file=f_actions_name, actions_per_log=1,
+        #imported here, so that evaluating without plots doesn't import matplotlib and IPython
+        import plotting
+        #the data is passed to the plotting function as arrays, without writing it to file
+        plotting.plot_sac_logs(None, running_reward_file=np.array(running_rewards), running_loss_file=None,
+            running_multi_obj_file=None if running_multi_obj is None else np.array(running_multi_objs),
+            actions_file=np.array(actions), actions_per_log=1,
             plot_to_file_line = None, suppress_show=False, save_plot = False, extra_str="",is_tri=is_tri,
             actions_to_plot=actions_to_plot,actions_ylim=actions_ylim,dont_clear_output=dont_clear_output)
     return running_reward if running_multi_obj is None else np.concatenate([np.array([running_reward]), running_multi_obj])
@@ -210,17 +213,26 @@ def unpickle_data(file, uncompressed_file = None):
 
     return data
     
-def log_dirs_given_criteria(main_dir, conditions_dict):
+def log_dirs_given_criteria(main_dir, conditions_dict, use_catalog=True):
     """
-    returns a list of directories with logs satisfying all parameter requests given in conditions_dict
+    returns a list of directories with logs satisfying all parameter requests given in conditions_dict.
+    By default the query is answered by the catalog of main_dir (see catalog_of_main_dir), if it exists. Otherwise,
+    the params files are parsed, so that read only data folders can be queried without creating a catalog.
 
     Args:
     main_dir (str): location of the directory containing all log directories
-    conditions_dict (dict): dictionary with all parameter requests to be satisfied
+    conditions_dict (dict): dictionary with all parameter requests to be satisfied. Using the catalog, values
+        given as strings are compared with the strings in the params file, and numbers are compared numerically
+    use_catalog (bool): if False, or if main_dir has no catalog, the params file of every log directory is parsed,
+        and compared as strings
 
     Return:
         list of log directories satisfying the requests
     """
+    if use_catalog and os.path.exists(os.path.join(main_dir, sac_tri.SacTrain.CATALOG_FILE_NAME)):
+        catalog = catalog_of_main_dir(main_dir)
+        return [os.path.join(main_dir, name) for name in sorted(catalog.query(conditions_dict))]
+
     ret_list = []
     #loop through all folders
     for sub_dir in os.listdir(main_dir):
@@ -253,14 +265,75 @@ def ret_last_rewards_and_avg(log_dir, number_of_rewards=3):
         last_rewards (np.array): array with the last number_of_rewards rewards
         avg (float): average of last_rewards
     """
-    #load running rewards
     file = os.path.join(log_dir, sac_tri.SacTrain.RUNNING_REWARD_FILE_NAME)
+    #use the catalog if it has enough rewards, and it was updated after the running rewards file
+    main_dir, name = os.path.split(os.path.normpath(log_dir))
+    catalog_file = os.path.join(main_dir, sac_tri.SacTrain.CATALOG_FILE_NAME)
+    if os.path.exists(catalog_file):
+        run = run_catalog.RunCatalog(catalog_file).run(name)
+        if (run is not None and len(run["last_rewards"]) >= number_of_rewards and
+                (not os.path.exists(file) or os.path.getmtime(file) <= run["updated"])):
+            last_rewards = run["last_rewards"][-number_of_rewards:,1]
+            return (last_rewards, np.mean(last_rewards))
+
+    #load running rewards
     data = np.loadtxt(file)
     #extract the last rewards
     last_rewards = data[-number_of_rewards:,1]
 
     return (last_rewards, np.mean(last_rewards))
 
+def catalog_of_main_dir(main_dir):
+    """
+    Returns the catalog of the log directories in main_dir (see run_catalog.RunCatalog), which is updated by
+    sac_tri.SacTrain while training. The log directories that are not in the catalog yet (e.g. created before
+    the catalog existed) are parsed and added to it, so their log files are only parsed once, while the ones that
+    were deleted or moved are removed from it.
+
+    Args:
+        main_dir (str): location of the directory containing all log directories
+
+    Returns:
+        (run_catalog.RunCatalog): the catalog
+    """
+    catalog = run_catalog.RunCatalog(os.path.join(main_dir, sac_tri.SacTrain.CATALOG_FILE_NAME))
+    known_names = catalog.names()
+    #remove the log directories that don't exist anymore
+    catalog.remove_runs(known_names - set(sub_dir for sub_dir in os.listdir(main_dir)
+                                            if os.path.isdir(os.path.join(main_dir, sub_dir))))
+    for sub_dir in os.listdir(main_dir):
+        log_dir = os.path.join(main_dir, sub_dir)
+        if (not sub_dir in known_names and os.path.isdir(log_dir) and
+                os.path.exists(os.path.join(log_dir, sac_tri.SacTrain.PARAMS_FILE_NAME))):
+            add_log_dir_to_catalog(catalog, log_dir)
+    return catalog
+
+def add_log_dir_to_catalog(catalog, log_dir):
+    """
+    Adds a log directory to a catalog parsing its log files: the parameters, the last running rewards, the last
+    running multi objectives, and the latest saved state.
+
+    Args:
+        catalog (run_catalog.RunCatalog): the catalog
+        log_dir (str): path to the log directory
+    """
+    catalog.update_run(log_dir, params=params_from_log_dir(log_dir))
+    #last running rewards
+    file = os.path.join(log_dir, sac_tri.SacTrain.RUNNING_REWARD_FILE_NAME)
+    if os.path.exists(file) and os.path.getsize(file) > 0:
+        for step, reward in np.loadtxt(file, ndmin=2)[-catalog.last_rewards:]:
+            catalog.update_run(log_dir, steps_done=step, running_reward=reward)
+    #last running multi objectives
+    file = os.path.join(log_dir, sac_tri.SacTrain.RUNNING_MULTI_OBJ_FILE_NAME)
+    if os.path.exists(file) and os.path.getsize(file) > 0:
+        catalog.update_run(log_dir, running_multi_obj=np.loadtxt(file, ndmin=2)[-1,1:])
+    #latest saved state
+    state_dir = os.path.join(log_dir, sac_tri.SacTrain.STATE_FOLDER_NAME)
+    if os.path.isdir(state_dir):
+        saves = [int(folder) for folder in os.listdir(state_dir) if folder.isdigit()]
+        if len(saves) > 0:
+            catalog.update_run(log_dir, latest_state=os.path.join(state_dir, str(max(saves))))
+
 def params_from_log_dir(log_dir):
     """
     given a log_dir, it returns a dictionary with all the parameters loaded.
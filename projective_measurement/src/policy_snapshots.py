@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+import torch
+import gym
+import core_tri
+
+"""
+This module contains the stream of policy snapshots written by SacTrain every SNAPSHOT_STEPS steps (see
+SacTrain.initialize_new_train). The parameters of the policy, flattened as float32, are appended to a binary file,
+and the offset of each snapshot is indexed by the training step. Since only the policy is stored, the snapshots are
+much lighter than the saved states, and they can be read (e.g. to study or animate the evolution of the policy)
+without loading the training session.
+"""
+
+#files of the stream, in the log folder of the training session
+DATA_FILE_NAME = "policy_snapshots.bin"
+INDEX_FILE_NAME = "policy_snapshots_index.txt"
+HEADER_FILE_NAME = "policy_snapshots.json"
+
+class PolicySnapshotWriter(object):
+    """
+    Appends snapshots of a policy to the stream in a log folder. The header file, with what is needed to create the
+    policy, is written with the first snapshot. If the stream already exists (e.g. in a training session loaded with
+    SacTrain.load_train, whose logs are copied from the saved state), the snapshots are appended to it.
+
+    Args:
+        log_dir (str): log folder of the training session
+        actor (core_tri.SquashedGaussianMLPActor): the policy
+        observation_space: observation space of the policy
+        action_space: action space of the environment
+        hidden_sizes (tuple(int)): sizes of the hidden layers of the policy
+        min_cov_eigen (float): min_cov_eigen of the policy
+    """
+    def __init__(self, log_dir, actor, observation_space, action_space, hidden_sizes, min_cov_eigen):
+        self.log_dir = log_dir
+        self.data_file = os.path.join(log_dir, DATA_FILE_NAME)
+        self.index_file = os.path.join(log_dir, INDEX_FILE_NAME)
+        header_file = os.path.join(log_dir, HEADER_FILE_NAME)
+        if not os.path.exists(header_file):
+            header = {"num_params": sum(p.numel() for p in actor.parameters()),
+                      "parameters": [[name, list(p.shape)] for name, p in actor.named_parameters()],
+                      "hidden_sizes": list(hidden_sizes), "min_cov_eigen": float(min_cov_eigen),
+                      "obs_low": observation_space.low.tolist(), "obs_high": observation_space.high.tolist(),
+                      "act_low": action_space[1].low.tolist(), "act_high": action_space[1].high.tolist()}
+            with open(header_file, "w") as f:
+                json.dump(header, f)
+
+    def append(self, steps_done, actor):
+        """
+        Appends a snapshot of the parameters of actor at training step steps_done. The parameters are written
+        before the index, so an interrupted write never results in an indexed snapshot that is incomplete.
+        """
+        params = torch.nn.utils.parameters_to_vector(actor.parameters()).detach().cpu().numpy().astype(np.float32)
+        with open(self.data_file, "ab") as f:
+            offset = f.tell()
+            f.write(params.tobytes())
+        with open(self.index_file, "a") as f:
+            f.write(f"{steps_done}\t{offset}\n")
+
+class PolicySnapshots(object):
+    """
+    Reads the stream of policy snapshots of a training session. The binary file is memory-mapped, so only the
+    snapshots that are used are read from disk. The snapshots written after the creation of this object are not
+    seen: create a new one to read them.
+
+    Args:
+        log_dir (str): log folder of the training session
+
+    Usage:
+        steps contains the training steps of the snapshots. Use params(step) to get the flattened parameters of a
+        snapshot, load_into(actor, step) to load them into a policy, or actor(step) to create the policy.
+    """
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        with open(os.path.join(log_dir, HEADER_FILE_NAME), "r") as f:
+            self.header = json.load(f)
+        index = np.loadtxt(os.path.join(log_dir, INDEX_FILE_NAME), dtype=np.int64, ndmin=2).reshape(-1,2)
+        #if a step was written more than once, the latest snapshot is used
+        self.offsets = dict(zip(index[:,0].tolist(), index[:,1].tolist()))
+        self.steps = np.array(sorted(self.offsets), dtype=np.int64)
+        num_params = self.header["num_params"]
+        self.data = np.memmap(os.path.join(log_dir, DATA_FILE_NAME), dtype=np.float32, mode="r",
+                                shape=(max(self.offsets.values(), default=0) // 4 + num_params,)) \
+                    if len(self.offsets) > 0 else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def params(self, step):
+        """
+        Returns the flattened parameters of the snapshot at training step step, as a read-only memory-mapped array.
+
+        Raises:
+            NameError: if there is no snapshot at step
+        """
+        if not step in self.offsets:
+            raise NameError(f"No policy snapshot at step {step} in {self.log_dir}")
+        start = self.offsets[step] // 4
+        return self.data[start:start + self.header["num_params"]]
+
+    def load_into(self, actor, step):
+        """ loads the parameters of the snapshot at training step step into actor, and returns it """
+        params = torch.from_numpy(np.array(self.params(step)))
+        torch.nn.utils.vector_to_parameters(params.to(next(actor.parameters()).device), actor.parameters())
+        return actor
+
+    def actor(self, step=None):
+        """
+        Creates a core_tri.SquashedGaussianMLPActor with the parameters of the snapshot at training step step.
+        If step is None, the latest snapshot is used.
+        """
+        observation_space = gym.spaces.Box(np.array(self.header["obs_low"], dtype=np.float32),
+                                            np.array(self.header["obs_high"], dtype=np.float32), dtype=np.float32)
+        action_space = gym.spaces.Tuple([gym.spaces.Discrete(3),
+                            gym.spaces.Box(np.array(self.header["act_low"], dtype=np.float32),
+                                            np.array(self.header["act_high"], dtype=np.float32), dtype=np.float32)])
+        actor = core_tri.SquashedGaussianMLPActor(observation_space, action_space, self.header["hidden_sizes"],
+                                    torch.nn.ReLU, min_cov_eigen=self.header["min_cov_eigen"])
+        return self.load_into(actor, self.steps[-1] if step is None else step)
@@ -2,9 +2,7 @@ from __future__ import print_function
 import gym
 import numpy as np
 import dataclasses
-import random
 import types
-import qutip as qt
 from scipy.special import xlogy
 
 
@@ -12,6 +10,59 @@ from scipy.special import xlogy
 This module contains gym.Env environments corresponding to the different physical setups
 """
 
+#qutip is only used by TwoQubitResonantFeedbackDemonPowDiss, and importing it is slow. So it is imported
+#by import_qutip() the first time it is needed, and not when this module is imported
+qt = None
+
+def import_qutip():
+    """ imports qutip (if it wasn't already imported) as the module variable qt, and returns it """
+    global qt
+    if qt is None:
+        import qutip
+        qt = qutip
+    return qt
+
+#torch is only used by the Torch environments, so it is imported by import_torch() the first time it is needed
+torch = None
+
+def import_torch():
+    """ imports torch (if it wasn't already imported) as the module variable torch, and returns it """
+    global torch
+    if torch is None:
+        import torch as torch_module
+        torch = torch_module
+    return torch
+
+def rng_from_env_params(env_params):
+    """
+    Returns the numpy.random.Generator from which an environment draws all its random numbers. It is seeded
+    with env_params["seed"], so an environment is reproducible if the seed is specified. If env_params has
+    no "seed", or it is None, the generator is seeded with fresh entropy from the OS.
+
+    Args:
+        env_params (dict): the parameters of the environment
+
+    Returns:
+        (numpy.random.Generator): the random number generator
+    """
+    return np.random.default_rng(env_params.get("seed", None))
+
+def spawn_env_params(env_params, n):
+    """
+    Returns n copies of env_params whose "seed" entries generate independent random streams, e.g. to
+    initialize the environments of parallel workers. The seeds are spawned from env_params["seed"],
+    so they are reproducible if it is specified.
+
+    Args:
+        env_params (dict): the parameters of the environment
+        n (int): number of copies
+
+    Returns:
+        (list(dict)): the n copies of env_params, each one with its own "seed"
+    """
+    children = np.random.SeedSequence(env_params.get("seed", None)).spawn(n)
+    return [dict(env_params, seed=int(child.generate_state(1, np.uint64)[0])) for child in children]
+
 
 class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
     """
@@ -47,6 +98,8 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
         self.pow_coeff = env_params["pow_coeff"]
         self.diss_coeff = env_params["diss_coeff"]
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #set the observation and action spaces
         self.observation_space = (gym.spaces.Box( low=np.array([0., self.min_u],dtype=np.float32),
@@ -75,14 +128,29 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-        
-        #load action 
-        d_act = action[0]
-        u_act = action[1][0]
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
 
         #initialize null multi objectives
         pow = 0.
@@ -93,7 +161,7 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
             #compute the entropy of the classical bit storing the outcome of the measurement
             s = self.entropy(self.state.p)
             #now I measure, and collapse the state 
-            if np.random.rand() < self.state.p:
+            if self.rng.random() < self.state.p:
                 self.state.p = 1.
             else:
                 self.state.p = 0.
@@ -116,9 +184,9 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
         #compute reward
         reward = self.a*pow - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([pow, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(pow), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -136,11 +204,15 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
     def current_state(self):
         """ Returns the current state as the type specificed by self.observation_space"""
         return np.array([self.state.p, self.state.u] , dtype=np.float32)
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[0], obs[1] = self.state.p, self.state.u
            
     def reset_internal_state_variables(self):
         """ sets initial values for the state """
         #set initial population to average temperature and choose random action b
-        random_u =  self.action_space[1].sample()[0]
+        random_u = self.rng.uniform(self.action_space[1].low, self.action_space[1].high).astype(np.float32)[0]
         
         #set the 2 state variables
         self.state.p = self.peq( self.de(random_u) ,self.b)
@@ -177,6 +249,151 @@ class TwoLevelBosonicFeedbackDemonPowDiss(gym.Env):
         rz = 2.*p0-1.
         return np.array([0., 0., rz])
 
+    def states_to_block_sphere(self, states):
+        #batched version of state_to_block_sphere: takes an (N,2) array of states and returns the (N,3) bloch vectors
+        states = np.asarray(states, dtype=np.float64)
+        bloch = np.zeros((states.shape[0], 3))
+        bloch[:,2] = 2.*states[:,0]-1.
+        return bloch
+
+
+class TorchTwoLevelBosonicFeedbackDemonPowDiss(object):
+    """
+    Torch implementation of TwoLevelBosonicFeedbackDemonPowDiss that evolves num_envs replicas at once. The actions
+    are passed, and the states, rewards and multi objectives are returned, as torch tensors on device, so that a
+    rollout (e.g. in sac_tri.SacTrain.train_vectorized) stays inside torch without conversions to numpy.
+    The actions are not checked to be in bound, since it would require a synchronization with the host.
+
+    Args:
+        env_params (dict): the parameters of TwoLevelBosonicFeedbackDemonPowDiss
+        num_envs (int): number of replicas
+        seed (int): seed of the torch random number generator used for the measurements and the resets. If None,
+            env_params["seed"] is used
+        device (torch.device): device where the state is stored. Defaults to cpu
+    """
+
+    single_env_class = TwoLevelBosonicFeedbackDemonPowDiss
+    torch_native = True
+
+    def __init__(self, env_params, num_envs, seed=None, device=None):
+        import_torch()
+        self.num_envs = num_envs
+        self.device = torch.device("cpu") if device is None else torch.device(device)
+        self.rng = torch.Generator(device=self.device)
+        if seed is None:
+            seed = env_params.get("seed", None)
+        if seed is None:
+            self.rng.seed()
+        else:
+            self.rng.manual_seed(seed)
+        self.load_env_params(env_params)
+
+    def load_env_params(self, env_params):
+        """
+        Initializes the environment
+        
+        Args:
+            env_params: environment parameters as passed to __init__()
+        """
+        #load the environment parameters
+        self.g = env_params["g"]
+        self.b = env_params["b"]
+        self.min_u = env_params["min_u"]
+        self.max_u = env_params["max_u"]
+        self.e0 = env_params["e0"]
+        self.dt = env_params["dt"]
+        self.a = env_params["a"]
+        self.pow_coeff = env_params["pow_coeff"]
+        self.diss_coeff = env_params["diss_coeff"]
+
+        #observation and action spaces of a single replica
+        self.observation_space = (gym.spaces.Box( low=np.array([0., self.min_u],dtype=np.float32),
+                                    high=np.array([1.,self.max_u],dtype=np.float32), dtype=np.float32))
+        self.action_space = (gym.spaces.Discrete(3), gym.spaces.Box(low=np.array([self.min_u],dtype=np.float32),
+                              high=np.array([self.max_u],dtype=np.float32), dtype=np.float32))
+ 
+        #reset the state of the environment
+        self.reset_internal_state_variables()
+
+    def reset(self):
+        """ resets the state of all the replicas """
+        self.reset_internal_state_variables()
+        return self.current_state()
+
+    def step(self, action):
+        """ Evolves all the replicas for a timestep depending on the chosen actions
+
+        Args:
+            action (tuple): (d_act, u_act), torch tensors with the discrete actions, with shape (num_envs,),
+                and the continuous actions, with shape (num_envs,1)
+
+        Returns:
+            state(torch.Tensor): new states after the step, with shape (num_envs,2)
+            reward(torch.Tensor): the rewards, with shape (num_envs,)
+            end(torch.Tensor): whether the episodes ended (these environments never end)
+            additional_info(dict): "multi_obj" contains the power and minus the dissipation, with shape (num_envs,2)
+        """
+        #load action 
+        d_act = torch.round(torch.as_tensor(action[0], device=self.device)).view(-1)
+        u_act = torch.as_tensor(action[1], device=self.device).view(-1).to(torch.float64)
+
+        #measurement (d_act=0): the state collapses to 1 or 0
+        s = self.entropy(self.p)
+        collapsed_p = (torch.rand(self.num_envs, generator=self.rng, device=self.device, dtype=torch.float64)
+                        < self.p).to(torch.float64)
+        diss = torch.where(d_act == 0, self.diss_coeff * s / self.b / self.dt, torch.zeros_like(s))
+
+        #thermalization (d_act=1): evolve the state according to the master equation
+        de = self.de(u_act)
+        peq = self.peq(de, self.b)
+        thermal_p = (self.p - peq)*torch.exp(-self.g*self.dt/torch.tanh(0.5*torch.abs(de)*self.b)) + peq
+        pow = torch.where(d_act == 1, self.pow_coeff*de*(thermal_p - self.p)/self.dt, torch.zeros_like(de))
+
+        #complete state evolution
+        self.p = torch.where(d_act == 0, collapsed_p, torch.where(d_act == 1, thermal_p, self.p))
+        self.u = u_act
+
+        #compute reward
+        reward = self.a*pow - (1.-self.a)*diss
+
+        #return        
+        return self.current_state(), reward.to(torch.float32), torch.zeros(self.num_envs, dtype=torch.bool,
+            device=self.device), {"multi_obj": torch.stack([pow, -diss], dim=1).to(torch.float32)}
+
+    def set_current_state(self, state):
+        """
+        Sets the current state of all the replicas.
+
+        Args:
+            state (torch.Tensor or np.Array): states of the replicas, with shape (num_envs,2)
+        """
+        state = torch.as_tensor(state, device=self.device).to(torch.float64).view(self.num_envs, 2)
+        self.p = state[:,0].clone()
+        self.u = state[:,1].clone()
+
+    def current_state(self):
+        """ Returns the current states of the replicas as a torch.float32 tensor with shape (num_envs,2) """
+        return torch.stack([self.p, self.u], dim=1).to(torch.float32)
+
+    def reset_internal_state_variables(self):
+        """ sets initial values for the state of all the replicas """
+        #set initial population to average temperature and choose random action u
+        random_u = self.min_u + (self.max_u-self.min_u)*torch.rand(self.num_envs, generator=self.rng,
+                                                                    device=self.device, dtype=torch.float64)
+        self.p = self.peq(self.de(random_u), self.b)
+        self.u = random_u
+
+    def peq(self, eps, b):
+        """ Equilibrium probability of being in excited state at energy gap eps and inverse temperature b """
+        return 1. / (1. + torch.exp(b*eps) )
+
+    def de(self, u):
+        """ Energy gap of the qubit given the control u """
+        return self.e0 * u
+
+    def entropy(self, p):
+        return -torch.special.xlogy(p,p) - torch.special.xlogy(1.-p,1.-p)
+
     
 class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
     """
@@ -223,6 +440,8 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
             self.mesolver_nsteps = None
         
         self.state = self.State()
+        #random number generator of the environment
+        self.rng = rng_from_env_params(env_params)
 
         #prepare the observation space (each of the 16 coefficients of the
         # density matrix is between -1 and +1)
@@ -261,14 +480,29 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
             end(bool): whether the episode ended (these environments never end)
             additional_info: required by gym.Env, but we don't use it
         """
-   
         #check if action in bound
         if not self.action_space[0].contains(action[0]) or not self.action_space[1].contains(action[1]):
             raise Exception(f"Action {action} out of bound")
-        
-        #load action 
-        d_act = action[0]
-        u_act = action[1][0]
+        obs = np.empty(self.observation_space.shape, dtype=np.float32)
+        reward, pow, diss = self.step_fast(action[0], action[1][0], obs)
+        return obs, reward, False, {"multi_obj": np.array([pow, -diss], dtype=np.float32)}
+
+    def step_fast(self, d_act, u_act, obs):
+        """
+        Evolves the state for a timestep like step(), but faster: it doesn't check that the action is in
+        bound, and it doesn't allocate the returned state and multi objectives. To be used when the caller
+        guarantees that the action is in bound.
+
+        Args:
+            d_act (int): the discrete action
+            u_act (float): the continuous action
+            obs (np.array): float32 array with the shape of the observation space, where the new state is written
+
+        Returns:
+            reward (float): the reward
+            pow (float): the power
+            diss (float): the dissipation
+        """
 
         #initialize null multi objectives
         pow = 0.
@@ -285,7 +519,7 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
             #i compute the entropy associated with the classical memory storing the outcome of the measurement
             s = self.entropy(p0)
             #now i compute the evolution of the state due to the measurement outcome
-            if np.random.rand() < p0:
+            if self.rng.random() < p0:
                 # i am in the GS
                 self.state.rho = self.gs_proj * self.state.rho * self.gs_proj / p0
             else:
@@ -336,9 +570,9 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
         #compute reward
         reward = self.a*pow - (1.-self.a)*diss
 
-        #return        
-        return self.current_state(), reward, False, {"multi_obj": 
-            np.array([pow, -diss], dtype=np.float32)}
+        #write the new state and return
+        self.write_current_state(obs)
+        return float(reward), float(pow), float(diss)
     
     def render(self):
         """ Required by gym.Env. Prints the current state."""
@@ -383,9 +617,14 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
         u_array = np.array([self.state.u])
 
         return np.concatenate([re_array, im_array, u_array])
+
+    def write_current_state(self, obs):
+        """ Writes the current state into obs, a float32 array with the shape of self.observation_space """
+        obs[:] = self.current_state()
            
     def init_qt_vars(self):
         """ initialize qutip object to speed up the construction of the hamiltonian """
+        import_qutip()
 
         sp = qt.operators.sigmap()
         sm = qt.operators.sigmam()
@@ -449,14 +688,16 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
         return 1./np.expm1(x)
     
     def array_state_to_state_obj(self, array_state):
+        import_qutip()
+
         #parse the state
         re_array = array_state[:10]
         im_array = array_state[10:16]
         u_val = array_state[-1]
         
         #create the state matrix
-        re_mat = np.zeros((4,4), dtype=np.complex)
-        im_mat = np.zeros((4,4), dtype=np.complex)
+        re_mat = np.zeros((4,4), dtype=complex)
+        im_mat = np.zeros((4,4), dtype=complex)
 
         #create the real part
         re_mat[self.re_part_indices] = re_array
@@ -476,38 +717,302 @@ class TwoQubitResonantFeedbackDemonPowDiss(gym.Env):
 
         return obj_state
 
+    def array_state_to_rho(self, array_state):
+        #this takes the vector form of the state of input, and returns the density matrix as a 4x4 numpy array,
+        #without using qutip. Like array_state_to_state_obj, it can be called with self=None
+        return TwoQubitResonantFeedbackDemonPowDiss.array_states_to_rho(None, np.asarray(array_state)[None])[0]
+
+    def array_states_to_rho(self, array_states):
+        #batched version of array_state_to_rho: takes an (N,17) array of states and returns the (N,4,4) density matrices
+        array_states = np.asarray(array_states, dtype=np.float64)
+        rho = np.zeros((array_states.shape[0],4,4), dtype=complex)
+
+        #the upper triangle (with the diagonal) has real part array_state[:10] and imaginary part array_state[10:16]
+        re_rows, re_cols = np.triu_indices(4,0)
+        im_rows, im_cols = np.triu_indices(4,1)
+        rho[:,re_rows,re_cols] = array_states[:,:10]
+        rho[:,im_rows,im_cols] += 1.j*array_states[:,10:16]
+
+        #the lower triangle is fixed by hermiticity
+        return rho + np.conjugate(np.swapaxes(np.triu(rho,1),1,2))
+
     def state_to_block_sphere(self, state):
         #this takes the vector form of the state of input, and returns the bloch vector of qubit 0 (the thermalizing one)
         #here I use as convention that negative rz is the ground state of the positive u hamiltonian.
-        
-        #create a "fake self" to make array_state_to_state_obj work without initializing this object
-        fake_self = types.SimpleNamespace(re_part_indices = np.triu_indices(4,0), im_part_indices = np.triu_indices(4,1))
-        
-        #i reconstruct the qutip state from the array representation
-        obj_state = TwoQubitResonantFeedbackDemonPowDiss.array_state_to_state_obj(fake_self, state)
+        return TwoQubitResonantFeedbackDemonPowDiss.states_to_block_sphere(None, np.asarray(state)[None])[0]
 
-        #compute the reduced density matrix
-        rho_reduced = obj_state.rho.ptrace(0)
+    def states_to_block_sphere(self, states):
+        #batched version of state_to_block_sphere: takes an (N,17) array of states and returns the (N,3) bloch vectors
+        
+        #reconstruct the density matrices from the array representation
+        rho = TwoQubitResonantFeedbackDemonPowDiss.array_states_to_rho(None, states)
 
-        #compute the 3 components of the block vector
-        rx = qt.expect(qt.operators.sigmax(), rho_reduced)
-        ry = qt.expect(qt.operators.sigmay(), rho_reduced)
-        rz = qt.expect(qt.operators.sigmaz(), rho_reduced)
+        #compute the reduced density matrices of qubit 0 tracing out qubit 1
+        rho_reduced = np.einsum("nijkj->nik", rho.reshape(-1,2,2,2,2))
 
-        #return it as a vector
-        return np.array([rx, ry, rz])
+        #compute the 3 components of the block vectors, i.e. the expectation values of sigma x,y,z
+        bloch = np.empty((rho.shape[0],3))
+        bloch[:,0] = 2.*np.real(rho_reduced[:,0,1])
+        bloch[:,1] = -2.*np.imag(rho_reduced[:,0,1])
+        bloch[:,2] = np.real(rho_reduced[:,0,0] - rho_reduced[:,1,1])
+        return bloch
 
     def state_to_concurrence(self, state):
         #this takes the vector form of the state of input, and returns the concurrence between the two qubits
-        #here I use as convention that negative rz is the ground state of the positive u hamiltonian.
+        return TwoQubitResonantFeedbackDemonPowDiss.states_to_concurrence(None, np.asarray(state)[None])[0]
+
+    def states_to_concurrence(self, states):
+        #batched version of state_to_concurrence: takes an (N,17) array of states and returns the (N,) concurrences
         
-        #create a "fake self" to make array_state_to_state_obj work without initializing this object
-        fake_self = types.SimpleNamespace(re_part_indices = np.triu_indices(4,0), im_part_indices = np.triu_indices(4,1))
+        #reconstruct the density matrices from the array representation
+        rho = TwoQubitResonantFeedbackDemonPowDiss.array_states_to_rho(None, states)
+
+        #Wootters concurrence, computed as in qutip.entropy.concurrence, from the eigenvalues of rho*rho_tilde
+        sysy = np.array([[0.,0.,0.,-1.],[0.,0.,1.,0.],[0.,1.,0.,0.],[-1.,0.,0.,0.]])
+        evals = np.linalg.eigvals(rho @ sysy @ np.conjugate(rho) @ sysy)
+        evals = np.abs(np.sort(np.real(evals), axis=1))
+        lsum = np.sqrt(evals[:,3]) - np.sqrt(evals[:,2]) - np.sqrt(evals[:,1]) - np.sqrt(evals[:,0])
+        return np.maximum(0., lsum)
+
+
+class BatchedTwoQubitResonantFeedbackDemonPowDiss(object):
+    """
+    Batched counterpart of TwoQubitResonantFeedbackDemonPowDiss, which doesn't use qutip. The density matrices of
+    num_envs replicas are stored in a single (num_envs,16) array, where each row is the row-major vectorization of
+    a 4x4 density matrix. The replicas that chose d_act=1 (thermalization) or d_act=2 (unitary evolution) are evolved
+    with batched 16x16 propagators exp(L*dt), where L is the Liouvillian, computed once for each distinct pair (d_act,u)
+    in closed form (thermal amplitude damping of qubit 0, or kron(U,U*) for the unitary evolution), and the replicas that
+    chose d_act=0 are projectively measured with gs_proj and ex_proj at once. The states are packed directly in
+    the 17 components layout of TwoQubitResonantFeedbackDemonPowDiss.current_state().
+    It is not a gym.Env: step() takes the actions of all the replicas and returns the stacked states, rewards and
+    multi objectives.
+
+    Args:
+        env_params (dict): the parameters of TwoQubitResonantFeedbackDemonPowDiss ("mesolver_nsteps" is ignored)
+        num_envs (int): number of replicas
+        seed (int): seed of the random number generator used for the measurements. If None, env_params["seed"]
+            is used
+    """
+
+    single_env_class = TwoQubitResonantFeedbackDemonPowDiss
+
+    def __init__(self, env_params, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed if seed is not None else env_params.get("seed", None))
+        self.load_env_params(env_params)
+
+    def load_env_params(self, env_params):
+        """
+        Initializes the environment
         
-        #i reconstruct the qutip state from the array representation
-        obj_state = TwoQubitResonantFeedbackDemonPowDiss.array_state_to_state_obj(fake_self, state)
+        Args:
+            env_params: environment parameters as passed to __init__()
+        """
+        #load the environment parameters
+        self.e0 = env_params["e0"]
+        self.g = env_params["g"]
+        self.b = env_params["b"]
+        self.gamma = env_params["gamma"]
+        self.min_u = env_params["min_u"]
+        self.max_u = env_params["max_u"]
+        self.dt = env_params["dt"]
+        self.a = env_params["a"]
+        self.pow_coeff = env_params["pow_coeff"]
+        self.diss_coeff = env_params["diss_coeff"]
+        self.counter_rot = env_params["counter_rot"]
+
+        #observation and action spaces of a single replica
+        obs_low = np.zeros(17, dtype=np.float32) - 1. 
+        obs_low[-1] = self.min_u
+        obs_high = obs_low + 2.
+        obs_high[-1] = self.max_u
+        self.observation_space = gym.spaces.Box( low=obs_low, high= obs_high, dtype=np.float32)
+        self.action_space = (gym.spaces.Discrete(3),
+                            gym.spaces.Box(low=np.array([self.min_u],dtype=np.float32),
+                                        high=np.array([self.max_u],dtype=np.float32), dtype=np.float32))
 
-        #return the concurrence
-        return qt.entropy.concurrence(obj_state.rho)
+        #initialize the operators
+        self.init_np_vars()
 
+        #reset the state of the environment
+        self.reset_internal_state_variables()
+
+    def reset(self):
+        """ resets the state of all the replicas """
+        self.reset_internal_state_variables()
+        return self.current_state()
+
+    def step(self, action):
+        """ Evolves all the replicas for a timestep depending on the chosen actions
 
+        Args:
+            action (tuple): (d_act, u_act), where d_act are the discrete actions, with shape (num_envs,),
+                and u_act are the continuous actions, with shape (num_envs,1)
+
+        Raises:
+            Exception: action out of bound
+
+        Returns:
+            state(np.Array): new states after the step, with shape (num_envs,17)
+            reward(np.Array): the rewards, with shape (num_envs,)
+            end(np.Array): whether the episodes ended (these environments never end)
+            additional_info(dict): "multi_obj" contains the power and minus the dissipation, with shape (num_envs,2)
+        """
+        #load and check the actions
+        d_act = np.asarray(action[0]).reshape(self.num_envs)
+        u_act = np.asarray(action[1], dtype=np.float32).reshape(self.num_envs)
+        if (np.any((d_act < 0) | (d_act >= self.action_space[0].n)) or np.any(u_act < self.action_space[1].low[0])
+            or np.any(u_act > self.action_space[1].high[0])):
+            raise Exception(f"Action {action} out of bound")
+        u_act = u_act.astype(np.float64)
+
+        #initialize null multi objectives
+        pow = np.zeros(self.num_envs)
+        diss = np.zeros(self.num_envs)
+
+        #measurement
+        idx = np.flatnonzero(d_act == 0)
+        if len(idx) > 0:
+            diss[idx] = self.measure(idx)
+
+        #thermalization. The heat is the energy difference computed with the hamiltonian at the new value of u
+        idx = np.flatnonzero(d_act == 1)
+        if len(idx) > 0:
+            initial_energy = u_act[idx] * np.real(self.rho[idx] @ self.h_loc_vec)
+            self.evolve(idx, 1, u_act[idx])
+            final_energy = u_act[idx] * np.real(self.rho[idx] @ self.h_loc_vec)
+            pow[idx] = self.pow_coeff*(final_energy-initial_energy)/self.dt
+
+        #unitary evolution
+        idx = np.flatnonzero(d_act == 2)
+        if len(idx) > 0:
+            self.evolve(idx, 2, u_act[idx])
+
+        #complete state evolution
+        self.u = u_act
+
+        #compute reward
+        reward = self.a*pow - (1.-self.a)*diss
+
+        #return        
+        return self.current_state(), reward, np.zeros(self.num_envs, dtype=bool), {"multi_obj":
+            np.stack([pow, -diss], axis=1).astype(np.float32)}
+
+    def measure(self, idx):
+        """
+        Performs the projective measurement of qubit 1 on the replicas idx, and returns their dissipation
+        """
+        #probability of measuring the ground state, clipped as in TwoQubitResonantFeedbackDemonPowDiss
+        p0 = np.clip(np.real(self.rho[idx] @ self.gs_proj_vec), 0.00001, 0.99999)
+        s = TwoQubitResonantFeedbackDemonPowDiss.entropy(None, p0)
+
+        #the projectors are diagonal, so P*rho*P multiplies each element of rho by P_ii*P_jj
+        in_gs = self.rng.random(len(idx)) < p0
+        self.rho[idx] *= np.where(in_gs[:,None], self.gs_proj_mask/p0[:,None], self.ex_proj_mask/(1.-p0[:,None]))
+        return self.diss_coeff * s / self.b / self.dt
+
+    def evolve(self, idx, d_act, u_act):
+        """
+        Evolves the replicas idx, that chose the discrete action d_act (1 or 2) and the continuous actions u_act,
+        for a timestep dt. The propagator is computed once for each distinct value of u.
+        """
+        u_unique, inverse = np.unique(u_act, return_inverse=True)
+        propagators = self.propagators(d_act, u_unique)
+        self.rho[idx] = np.einsum("nij,nj->ni", propagators[inverse], self.rho[idx])
+
+    def propagators(self, d_act, u):
+        """
+        Returns the propagators exp(L*dt), where L is the Liouvillian for the discrete action d_act (1 or 2)
+        and the values u of the control. They are computed in closed form instead of with expm
+
+        Args:
+            d_act (int): 1 for the thermalization, 2 for the unitary evolution
+            u (np.Array): values of the control
+
+        Returns:
+            (np.Array): the propagators acting on the vectorized density matrices, with shape (len(u),16,16)
+        """
+        if d_act == 1:
+            #the coupling between qubits is switched off, so qubit 0 undergoes thermal amplitude damping and
+            #qubit 1 only acquires a phase. q0[n,A,C,a,c] maps the blocks rho_ac to rho_AC of qubit 0
+            w = self.e0 * u
+            n = TwoQubitResonantFeedbackDemonPowDiss.bose(None, self.b * w)
+            gam_up = self.gamma*np.abs(n)
+            gam_sig = gam_up + self.gamma*np.abs(1.+n)
+            decay = np.exp(-gam_sig*self.dt)
+            p_inf = gam_up/gam_sig
+            q0 = np.zeros((len(u),2,2,2,2), dtype=complex)
+            q0[:,0,0,0,0] = decay + p_inf*(1.-decay)
+            q0[:,0,0,1,1] = p_inf*(1.-decay)
+            q0[:,1,1,0,0] = (1.-p_inf)*(1.-decay)
+            q0[:,1,1,1,1] = 1. - p_inf*(1.-decay)
+            q0[:,0,1,0,1] = np.exp(-(gam_sig/2.+1.j*w)*self.dt)
+            q0[:,1,0,1,0] = np.exp(-(gam_sig/2.-1.j*w)*self.dt)
+            #phases of qubit 1, whose excited state (index 0) has energy w
+            exc = np.array([1.,0.])
+            phase = np.exp(-1.j*w[:,None,None]*(exc[:,None]-exc[None,:])*self.dt)
+            return np.einsum("nACac,Bb,Dd,nBD->nABCDabcd", q0, np.identity(2), np.identity(2),
+                             phase).reshape(len(u),16,16)
+        else:
+            #coupling switched on and no dissipation: exp(L*dt) acts as U*rho*U^dagger, with U = exp(-i*H*dt)
+            h = u[:,None,None]*self.h_loc + self.g*self.h_int
+            evals, evecs = np.linalg.eigh(h)
+            unit = (evecs*np.exp(-1.j*evals*self.dt)[:,None,:]) @ np.swapaxes(evecs,1,2)
+            return np.einsum("nik,njl->nijkl", unit, np.conjugate(unit)).reshape(len(u),16,16)
+
+    def init_np_vars(self):
+        """ initializes the operators, with the same conventions as init_qt_vars() """
+        sp = np.array([[0.,1.],[0.,0.]])
+        sm = np.array([[0.,0.],[1.,0.]])
+        sx = np.array([[0.,1.],[1.,0.]])
+        id2 = np.identity(2)
+
+        #projectors on the excited (index 0) and ground (index 1) state of a single qubit
+        ex_ex = np.diag([1.,0.])
+        gs_gs = np.diag([0.,1.])
+
+        #hamiltonian terms. The density matrices are vectorized in row-major order, so vec(A*rho*B) = kron(A,B.T)*vec(rho)
+        self.h_loc = np.kron(self.e0*sp@sm, id2) + np.kron(id2, self.e0*sp@sm)
+        if self.counter_rot:
+            self.h_int = np.kron(sx,sx)
+        else:
+            self.h_int = np.kron(sp,sm) + np.kron(sm,sp)
+
+        #vectors such that tr(A*rho) = vec(rho) @ vec(A.T)
+        self.h_loc_vec = self.h_loc.T.reshape(16)
+        self.gs_proj_vec = np.kron(id2, gs_gs).T.reshape(16)
+
+        #masks such that vec(P*rho*P) = vec(rho)*mask for the diagonal projectors
+        self.gs_proj_mask = np.outer(np.diag(np.kron(id2, gs_gs)), np.diag(np.kron(id2, gs_gs))).reshape(16)
+        self.ex_proj_mask = np.outer(np.diag(np.kron(id2, ex_ex)), np.diag(np.kron(id2, ex_ex))).reshape(16)
+
+        #indices to extract the state, as in TwoQubitResonantFeedbackDemonPowDiss.current_state()
+        self.re_part_indices = np.triu_indices(4,0)
+        self.im_part_indices = np.triu_indices(4,1)
+
+    def reset_internal_state_variables(self):
+        """ sets initial values for the state of all the replicas """
+        #qubit 0 is 50% in the gs and excited state, and qubit 1 is in the g.s. (uncorrelated)
+        rho = np.kron(np.diag([0.5,0.5]), np.diag([0.,1.]))
+        self.rho = np.tile(rho.reshape(16).astype(complex), (self.num_envs,1))
+
+        #set initial u to half way
+        self.u = np.full(self.num_envs, 0.5*(self.min_u+self.max_u))
+
+    def set_current_state(self, state):
+        """
+        Sets the current state of all the replicas.
+
+        Args:
+            state (np.Array): states of the replicas, with shape (num_envs,17)
+        """
+        state = np.asarray(state, dtype=np.float64).reshape(self.num_envs, 17)
+        self.rho = TwoQubitResonantFeedbackDemonPowDiss.array_states_to_rho(None, state).reshape(self.num_envs, 16)
+        self.u = state[:,-1].copy()
+
+    def current_state(self):
+        """ Returns the current states of the replicas, with shape (num_envs,17) """
+        rho = self.rho.reshape(self.num_envs, 4, 4)
+        re_array = np.real(rho[:, self.re_part_indices[0], self.re_part_indices[1]])
+        im_array = np.imag(rho[:, self.im_part_indices[0], self.im_part_indices[1]])
+        return np.concatenate([re_array, im_array, self.u[:,None]], axis=1)